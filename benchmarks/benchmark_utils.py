@@ -0,0 +1,29 @@
+"""Helpers shared by the benchmarks."""
+
+import socket
+import time
+
+
+def percentile(values, p):
+    """Nearest rank percentile of a list of values, nan when empty."""
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+def get_free_port():
+    """Gets a local TCP port nothing listens on."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port, timeout = 10):
+    """Waits for a local server to listen on a port."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Nothing listening on port {}".format(port))
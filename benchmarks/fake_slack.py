@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""In-process HTTP server standing in for slack.com and the response_url of slash commands.
+
+Web API methods are served on /api/<method>: chat.postMessage, groups.create, groups.invite, groups.kick
+and channels.create. Any other path is a response_url sink, recording the arrival time of the first
+response POSTed to it.
+
+Slack slowness and failures can be injected: a latency (plus random jitter) on every call, a share of
+calls failing with an error, and per method rate limits answered with 429 and Retry-After, as Slack does.
+chat.postMessage is also limited per channel.
+
+Point the bot to it with SLACK_API_BASE_URL=<api_url> and, for the response_url of real requests,
+SLACK_RESPONSE_BASE_URL=<base url>. Standalone:
+    python3 benchmarks/fake_slack.py --port 8900 --latency-ms 300 --error-rate 0.01 --rate-limit chat.postMessage=1
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class RateLimiter:
+    """Allows a number of calls per second for each key, in one second windows."""
+
+    def __init__(self, calls_per_second):
+        self.calls_per_second = calls_per_second
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def allow(self, key):
+        """Counts a call, returning 0 if allowed or the seconds until the next window if limited."""
+        now = time.monotonic()
+        with self.lock:
+            [window_start, count] = self.windows.get(key, [now, 0])
+            if now - window_start >= 1.0:
+                [window_start, count] = [now, 0]
+            if count >= self.calls_per_second:
+                self.windows[key] = [window_start, count]
+                # Retry-After is in whole seconds, and windows last one
+                return 1
+            self.windows[key] = [window_start, count + 1]
+            return 0
+
+
+class FakeSlack:
+    """Fake Slack server. Start it, point the bot to api_url and use response_url(request_id) on each request.
+
+    latency_seconds and latency_jitter_seconds delay every answer by latency + uniform(0, jitter).
+    error_rate is the share of calls failing: Web API calls answer {"ok": false}, response_url sinks a 500.
+    rate_limits maps Web API methods to the calls allowed per second, above which 429 is answered.
+    channel_messages_per_second limits chat.postMessage on each channel, None for no limit."""
+
+    def __init__(self, host = "127.0.0.1", port = 0, latency_seconds = 0.0, latency_jitter_seconds = 0.0,
+                 error_rate = 0.0, rate_limits = None, channel_messages_per_second = None, seed = None):
+        self.latency_seconds = latency_seconds
+        self.latency_jitter_seconds = latency_jitter_seconds
+        self.error_rate = error_rate
+        self.method_limiters = {method: RateLimiter(limit) for method, limit in (rate_limits or {}).items()}
+        self.channel_limiter = RateLimiter(channel_messages_per_second) if channel_messages_per_second else None
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+
+        self.responses = {}
+        # Counters by method (response_url for the sinks) and outcome: ok, error, rate_limited
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.next_id = 0
+
+        self.httpd = ThreadingHTTPServer((host, port), self.make_handler())
+        self.host = host
+        self.port = self.httpd.server_address[1]
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return "http://{}:{}".format(self.host, self.port)
+
+    @property
+    def api_url(self):
+        return self.base_url + "/api/"
+
+    def response_url(self, request_id):
+        return "{}/response/{}".format(self.base_url, request_id)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="FakeSlackThread", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def get_response(self, request_id):
+        """Gets the first delayed response to response_url(request_id), as [arrival time.monotonic(), body], or None."""
+        return self.get_response_by_path("/response/{}".format(request_id))
+
+    def get_response_by_path(self, path):
+        with self.lock:
+            return self.responses.get(path)
+
+    def get_calls(self):
+        """Gets the calls received, as {method: {outcome: count}}."""
+        with self.lock:
+            return {method: dict(outcomes) for method, outcomes in self.calls.items()}
+
+    def record_call(self, method, outcome):
+        with self.lock:
+            outcomes = self.calls.setdefault(method, {})
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    def record_response(self, path, body):
+        with self.lock:
+            self.responses.setdefault(path, [time.monotonic(), body])
+
+    def get_delay(self):
+        with self.random_lock:
+            return self.latency_seconds + self.random.uniform(0, self.latency_jitter_seconds)
+
+    def should_fail(self):
+        if not self.error_rate:
+            return False
+        with self.random_lock:
+            return self.random.random() < self.error_rate
+
+    def get_retry_after(self, method, payload):
+        """Seconds to retry after if the call is rate limited, else 0."""
+        limiter = self.method_limiters.get(method)
+        retry_after = limiter.allow(method) if limiter else 0
+        if not retry_after and method == "chat.postMessage" and self.channel_limiter and payload.get("channel"):
+            retry_after = self.channel_limiter.allow(payload["channel"])
+        return retry_after
+
+    def generate_id(self, prefix):
+        with self.lock:
+            self.next_id += 1
+            return "{}FAKE{:06d}".format(prefix, self.next_id)
+
+    def api_response(self, method, payload):
+        """Successful answer to a Web API method, as Slack shapes it."""
+        if method == "chat.postMessage":
+            if not payload.get("channel"):
+                return {"ok": False, "error": "channel_not_found"}
+            ts = "{:.6f}".format(time.time())
+            return {"ok": True, "channel": payload["channel"], "ts": ts, "message": {"text": payload.get("text"), "ts": ts}}
+        if method == "groups.create":
+            return {"ok": True, "group": {"id": self.generate_id("G"), "name": payload.get("name")}}
+        if method == "channels.create":
+            return {"ok": True, "channel": {"id": self.generate_id("C"), "name": payload.get("name")}}
+        if method == "groups.invite":
+            return {"ok": True, "group": {"id": payload.get("channel"), "members": [payload.get("user")]}}
+        if method == "groups.kick":
+            return {"ok": True}
+        return {"ok": False, "error": "unknown_method"}
+
+    def make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw_body = self.rfile.read(length)
+                try:
+                    payload = json.loads(raw_body.decode("utf-8")) if raw_body else {}
+                except ValueError:
+                    payload = {}
+
+                delay = fake.get_delay()
+                if delay > 0:
+                    time.sleep(delay)
+
+                if self.path.startswith("/api/"):
+                    self.answer_api(self.path[len("/api/"):], payload)
+                else:
+                    self.answer_response_url(payload)
+
+            def answer_api(self, method, payload):
+                if not self.headers.get("Authorization"):
+                    fake.record_call(method, "error")
+                    self.send_json(200, {"ok": False, "error": "not_authed"})
+                    return
+                retry_after = fake.get_retry_after(method, payload)
+                if retry_after:
+                    fake.record_call(method, "rate_limited")
+                    self.send_json(429, {"ok": False, "error": "ratelimited"}, {"Retry-After": str(retry_after)})
+                    return
+                if fake.should_fail():
+                    fake.record_call(method, "error")
+                    self.send_json(200, {"ok": False, "error": "internal_error"})
+                    return
+                content = fake.api_response(method, payload)
+                fake.record_call(method, "ok" if content["ok"] else "error")
+                self.send_json(200, content)
+
+            def answer_response_url(self, payload):
+                if fake.should_fail():
+                    fake.record_call("response_url", "error")
+                    self.send_json(500, {"ok": False, "error": "internal_error"})
+                    return
+                fake.record_response(self.path, payload)
+                fake.record_call("response_url", "ok")
+                self.send_json(200, {"ok": True})
+
+            def send_json(self, status, content, headers = None):
+                body = json.dumps(content).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def add_arguments(parser, prefix = ""):
+    """Adds the fake Slack options to an argument parser, eg: --slack-latency-ms with prefix "slack-"."""
+    parser.add_argument("--{}latency-ms".format(prefix), type=float, default=0.0, help="delay of every Slack answer")
+    parser.add_argument("--{}jitter-ms".format(prefix), type=float, default=0.0, help="random extra delay, up to this")
+    parser.add_argument("--{}error-rate".format(prefix), type=float, default=0.0, help="share of Slack calls failing")
+    parser.add_argument(
+        "--{}rate-limit".format(prefix), action="append", default=[], metavar="METHOD=PER_SECOND",
+        help="calls per second of a method above which 429 is answered, repeatable"
+    )
+    parser.add_argument("--{}channel-rate-limit".format(prefix), type=float, default=None, help="chat.postMessage per second per channel")
+
+def from_arguments(args, prefix = "", **kwargs):
+    """Creates a FakeSlack from the options added by add_arguments."""
+    option = lambda name: getattr(args, (prefix + name).replace("-", "_"))
+    rate_limits = {}
+    for rate_limit in option("rate-limit"):
+        [method, per_second] = rate_limit.split("=")
+        rate_limits[method] = float(per_second)
+    return FakeSlack(
+        latency_seconds=option("latency-ms") / 1000.0,
+        latency_jitter_seconds=option("jitter-ms") / 1000.0,
+        error_rate=option("error-rate"),
+        rate_limits=rate_limits,
+        channel_messages_per_second=option("channel-rate-limit"),
+        **kwargs
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Slack Web API and response_url server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    fake_slack = from_arguments(args, host=args.host, port=args.port).start()
+    print("Fake Slack listening. SLACK_API_BASE_URL={} SLACK_RESPONSE_BASE_URL={}".format(fake_slack.api_url, fake_slack.base_url))
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(fake_slack.get_calls(), sort_keys=True))
+    except KeyboardInterrupt:
+        fake_slack.stop()
+
+if __name__ == "__main__":
+    main()
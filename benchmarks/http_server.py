@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Compares the HTTP server backends of server.get_server_adapter.
+
+Each backend serves a route taking --handler-ms to answer, standing in for a slow request
+(eg: waiting on the database), while --concurrency clients POST to it.
+Reports throughput and latency percentiles of every backend.
+
+Usage: python3 benchmarks/http_server.py [--servers wsgiref,threaded,waitress] [--threads 8]
+    [--concurrency 16] [--requests 50] [--handler-ms 50]
+"""
+
+import argparse
+import http.client
+import importlib.util
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import bottle
+import server
+from benchmark_utils import get_free_port, percentile, wait_for_port
+
+
+def start_server(server_name, threads, handler_seconds):
+    """Serves the benchmark app on a daemon thread, returning its port."""
+    app = bottle.Bottle()
+
+    @app.route("/", method=["POST"])
+    def slow_handler():
+        time.sleep(handler_seconds)
+        return "ok"
+
+    port = get_free_port()
+    [server_adapter, server_options] = server.get_server_adapter(server_name, threads)
+    if server_adapter == "waitress" and importlib.util.find_spec("waitress") is None:
+        raise ImportError("waitress is not installed")
+    t = threading.Thread(
+        target=bottle.run,
+        kwargs=dict(app=app, server=server_adapter, host="127.0.0.1", port=port, quiet=True, **server_options),
+        daemon=True
+    )
+    t.start()
+    wait_for_port(port)
+    return port
+
+def run_client(port, requests_count, latencies, errors):
+    """POSTs requests_count times, reusing the connection while the server keeps it alive."""
+    connection = None
+    for _ in range(requests_count):
+        started = time.monotonic()
+        try:
+            if connection is None:
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            connection.request("POST", "/", body=b"command=%2Fsaldo", headers={"Content-Type": "application/x-www-form-urlencoded"})
+            response = connection.getresponse()
+            response.read()
+            if response.will_close:
+                connection.close()
+                connection = None
+        except (OSError, http.client.HTTPException):
+            errors.append(1)
+            if connection is not None:
+                connection.close()
+            connection = None
+            continue
+        latencies.append(time.monotonic() - started)
+    if connection is not None:
+        connection.close()
+
+def benchmark(server_name, args):
+    port = start_server(server_name, args.threads, args.handler_ms / 1000.0)
+    latencies = []
+    errors = []
+    clients = [
+        threading.Thread(target=run_client, args=(port, args.requests, latencies, errors))
+        for _ in range(args.concurrency)
+    ]
+    started = time.monotonic()
+    for t in clients:
+        t.start()
+    for t in clients:
+        t.join()
+    elapsed = time.monotonic() - started
+    return {
+        "server": server_name,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "max": max(latencies or [float("nan")]) * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the HTTP server backends.")
+    parser.add_argument("--servers", default=",".join(server.definitions.HTTP_SERVERS))
+    parser.add_argument("--threads", type=int, default=server.definitions.HTTP_SERVER_DEFAULT_THREADS)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=50, help="requests per client")
+    parser.add_argument("--handler-ms", type=float, default=50.0)
+    args = parser.parse_args()
+
+    print("{:<10} {:>9} {:>7} {:>10} {:>9} {:>9} {:>9}".format("server", "requests", "errors", "req/s", "p50 ms", "p99 ms", "max ms"))
+    for server_name in args.servers.split(","):
+        try:
+            result = benchmark(server_name, args)
+        except ImportError as ex:
+            print("{:<10} skipped: {}".format(server_name, ex))
+            continue
+        print("{server:<10} {requests:>9} {errors:>7} {throughput:>10.1f} {p50:>9.1f} {p99:>9.1f} {max:>9.1f}".format(**result))
+
+if __name__ == "__main__":
+    main()
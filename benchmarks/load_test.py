@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""Load test of the whole bot: signed slash commands against the Bottle app, dispatcher and a local Postgres,
+with benchmarks/fake_slack.py standing in for slack.com and the response_url of every command.
+
+The database given by the DB_* environment variables is migrated and seeded with load test teams and users
+(slack ids starting with ULOAD). Use a scratch database. --no-db skips the database altogether:
+every request then fails on the context load, which still measures the ack and error reply path.
+
+Reports the throughput and, per command, ack and end-to-end (until the delayed response reaches
+response_url, or the ack for inline answers) p50/p99 latencies.
+
+Slack slowness is injected with --slack-latency-ms, --slack-jitter-ms, --slack-error-rate, --slack-rate-limit
+and --slack-channel-rate-limit, see benchmarks/fake_slack.py.
+
+Usage: python3 benchmarks/load_test.py [--requests 2000] [--concurrency 16] [--mix-from-db]
+    [--server threaded] [--threads 8] [--teams 20] [--users-per-team 5] [--no-db] [--slack-latency-ms 300]
+"""
+
+import argparse
+import hashlib
+import hmac
+import http.client
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+os.environ.setdefault("SLACK_SIGNING_SECRET", "load-test-signing-secret")
+os.environ.setdefault("SLACK_USER_TOKEN", "xoxp-load-test")
+os.environ.setdefault("SLACK_LOGS_CHANNEL_ID", "CLOADLOGS")
+os.environ.setdefault("SLACK_STAFF_CHANNEL_ID", "CLOADSTAFF")
+os.environ.setdefault("SLACK_SUPPORT_CHANNEL_ID", "CLOADSUPPORT")
+# Keep the files written by the bot out of the source tree
+os.environ.setdefault("TRACE_FILE", os.path.join(tempfile.gettempdir(), "load_test_traces.jsonl"))
+os.environ.setdefault("REQUEST_LOG_SPILL_FILE", os.path.join(tempfile.gettempdir(), "load_test_request_log_spill.jsonl"))
+
+import bottle
+import database
+import definitions
+import dispatcher
+import responder_messages
+import schema
+import server
+import fake_slack as fake_slack_server
+from benchmark_utils import get_free_port, percentile, wait_for_port
+
+
+# Share of each command in the generated traffic. --mix-from-db replaces it by the share
+# of each command on the requests table, eg: after an event.
+DEFAULT_COMMAND_MIX = {
+    "/saldo": 30,
+    "/compra": 25,
+    "/movimentos": 15,
+    "/meus-movimentos": 10,
+    "/ver-equipas": 4,
+    "/ver-staff": 2,
+    "/detalhes-equipa": 3,
+    "/detalhes": 3,
+    "/transacoes-equipa": 3,
+    "/transacoes-participante": 2,
+    "/transacoes-todas": 2,
+    "/hackerboy": 1,
+}
+
+LOAD_TEST_ADMIN = ["ULOADADMIN", "load_admin"]
+LOAD_TEST_TEAM_BALANCE = 100000
+
+def get_load_test_users(teams_count, users_per_team):
+    """Slack id and name of the load test users, by team index."""
+    return [
+        [["ULOAD{:03d}{:03d}".format(t, u), "load_t{}_u{}".format(t, u)] for u in range(users_per_team)]
+        for t in range(teams_count)
+    ]
+
+def seed_database(teams_count, users_per_team):
+    """Creates the load test teams, users and admin, if missing. Returns the team ids, by team index."""
+    team_ids = []
+    with database.connection(False) as db_connection:
+        cursor = db_connection.cursor()
+        for t, team_users in enumerate(get_load_test_users(teams_count, users_per_team)):
+            team_name = "load-team-{}".format(t)
+            cursor.execute("SELECT team_id FROM teams WHERE team_name = %s", (team_name,))
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute("""
+                    INSERT INTO teams (team_name, balance, slack_channel_id)
+                    VALUES (%s, %s, %s)
+                    RETURNING team_id
+                """, (team_name, LOAD_TEST_TEAM_BALANCE, "GLOAD{:03d}".format(t)))
+                row = cursor.fetchone()
+                cursor.execute("""
+                    INSERT INTO team_registration (team_id, team_name, entry_code)
+                    VALUES (%s, %s, %s)
+                """, (row[0], team_name, "load-{}".format(row[0])))
+            team_ids.append(str(row[0]))
+            for [slack_id, slack_name] in team_users:
+                cursor.execute("""
+                    INSERT INTO users (slack_id, slack_name, team)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (slack_id) DO NOTHING
+                """, (slack_id, slack_name, row[0]))
+
+        cursor.execute("""
+            INSERT INTO users (slack_id, slack_name)
+            VALUES (%s, %s)
+            ON CONFLICT (slack_id) DO NOTHING
+        """, LOAD_TEST_ADMIN)
+        cursor.execute("""
+            INSERT INTO permissions (user_id, staff_function)
+            SELECT user_id, 'admin'
+            FROM users
+            WHERE slack_id = %s
+            AND NOT EXISTS (SELECT FROM permissions WHERE permissions.user_id = users.user_id)
+        """, (LOAD_TEST_ADMIN[0],))
+        cursor.close()
+    return team_ids
+
+def get_command_mix_from_db():
+    """Share of each registered command on the requests table."""
+    with database.connection() as db_connection:
+        cursor = db_connection.cursor()
+        cursor.execute("SELECT command, COUNT(*) FROM requests GROUP BY command")
+        mix = {command: count for [command, count] in cursor.fetchall() if command in dispatcher.commands}
+        cursor.close()
+    return mix
+
+def get_command_text(command, rng, teams, team_index):
+    """Arguments of a command, as a user of team team_index would type them."""
+    def other_user():
+        other_team = rng.choice([t for t in range(len(teams)) if t != team_index] or [team_index])
+        [slack_id, slack_name] = rng.choice(teams[other_team]["users"])
+        return "<@{}|{}>".format(slack_id, slack_name)
+
+    if command == "/compra":
+        return "{} 1 load test".format(other_user())
+    if command in ("/detalhes",):
+        return other_user()
+    if command == "/transacoes-participante":
+        return "{} 10".format(other_user())
+    if command in ("/detalhes-equipa",):
+        return teams[rng.randrange(len(teams))]["id"]
+    if command == "/transacoes-equipa":
+        return "{} 10".format(teams[rng.randrange(len(teams))]["id"])
+    if command == "/transacoes-todas":
+        return "10"
+    if command == "/hackerboy":
+        return "1 load test"
+    return ""
+
+def build_request(command, text, slack_id, slack_name, response_url):
+    """Slash command body and headers, signed as Slack does."""
+    body = urllib.parse.urlencode({
+        "token": "load-test",
+        "team_id": "TLOAD",
+        "team_domain": "load-test",
+        "channel_id": "CLOAD",
+        "channel_name": "load-test",
+        "user_id": slack_id,
+        "user_name": slack_name,
+        "command": command,
+        "text": text,
+        "response_url": response_url,
+        "trigger_id": "load-test",
+    })
+    timestamp = str(int(time.time()))
+    base_string = "v0:{}:{}".format(timestamp, body).encode("utf-8")
+    signature = "v0=" + hmac.new(
+        bytes(os.getenv("SLACK_SIGNING_SECRET"), "utf-8"), msg = base_string, digestmod = hashlib.sha256
+    ).hexdigest()
+    headers = {
+        "Content-Type": "application/x-www-form-urlencoded",
+        "X-Slack-Request-Timestamp": timestamp,
+        "X-Slack-Signature": signature,
+    }
+    return [body.encode("utf-8"), headers]
+
+def start_app(server_name, threads):
+    """Serves the bot on a daemon thread, returning its port."""
+    app = server.JSONBottle()
+    server.define_routing(app)
+    [server_adapter, server_options] = server.get_server_adapter(server_name, threads)
+    port = get_free_port()
+    t = threading.Thread(
+        target=bottle.run,
+        kwargs=dict(app=app, server=server_adapter, host="127.0.0.1", port=port, quiet=True, **server_options),
+        daemon=True
+    )
+    t.start()
+    wait_for_port(port)
+    return port
+
+class LoadTest:
+
+    def __init__(self, args, fake_slack, port, teams, command_mix):
+        self.args = args
+        self.fake_slack = fake_slack
+        self.port = port
+        self.teams = teams
+        self.commands = list(command_mix.keys())
+        self.weights = [command_mix[c] for c in self.commands]
+        # Request id -> [command, sent_at, acked_at, inline]
+        self.results = {}
+        self.errors = []
+        self.lock = threading.Lock()
+        self.next_id = 0
+
+    def get_request_id(self):
+        with self.lock:
+            self.next_id += 1
+            if self.next_id > self.args.requests:
+                return None
+            return self.next_id
+
+    def run_client(self, seed):
+        rng = random.Random(seed)
+        connection = None
+        while True:
+            request_id = self.get_request_id()
+            if request_id is None:
+                break
+            command = rng.choices(self.commands, self.weights)[0]
+            team_index = rng.randrange(len(self.teams))
+            if dispatcher.commands[command].role:
+                [slack_id, slack_name] = LOAD_TEST_ADMIN
+            else:
+                [slack_id, slack_name] = rng.choice(self.teams[team_index]["users"])
+            text = get_command_text(command, rng, self.teams, team_index)
+            [body, headers] = build_request(command, text, slack_id, slack_name, self.fake_slack.response_url(request_id))
+
+            sent_at = time.monotonic()
+            try:
+                if connection is None:
+                    connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+                connection.request("POST", "/", body=body, headers=headers)
+                response = connection.getresponse()
+                response_body = response.read()
+                if response.will_close:
+                    connection.close()
+                    connection = None
+            except (OSError, http.client.HTTPException) as ex:
+                with self.lock:
+                    self.errors.append(str(ex))
+                if connection is not None:
+                    connection.close()
+                connection = None
+                continue
+            acked_at = time.monotonic()
+            inline = json.loads(response_body.decode("utf-8")).get("text") != responder_messages.REQUEST_RECEIVED
+            with self.lock:
+                self.results[request_id] = [command, sent_at, acked_at, inline]
+        if connection is not None:
+            connection.close()
+
+    def run(self):
+        clients = [threading.Thread(target=self.run_client, args=(self.args.seed + idx,)) for idx in range(self.args.concurrency)]
+        started = time.monotonic()
+        for t in clients:
+            t.start()
+        for t in clients:
+            t.join()
+        self.elapsed = time.monotonic() - started
+        self.wait_for_responses()
+
+    def wait_for_responses(self):
+        """Waits for the delayed responses of every queued request, up to --drain-timeout seconds."""
+        deadline = time.monotonic() + self.args.drain_timeout
+        while time.monotonic() < deadline:
+            if all(inline or self.fake_slack.get_response(request_id) for request_id, [_, _, _, inline] in self.results.items()):
+                return
+            time.sleep(0.1)
+
+    def report(self):
+        by_command = {}
+        for request_id, [command, sent_at, acked_at, inline] in self.results.items():
+            stats = by_command.setdefault(command, {"ack": [], "e2e": [], "inline": 0, "missing": 0})
+            stats["ack"].append(acked_at - sent_at)
+            if inline:
+                stats["inline"] += 1
+                stats["e2e"].append(acked_at - sent_at)
+                continue
+            response = self.fake_slack.get_response(request_id)
+            if response is None:
+                stats["missing"] += 1
+            else:
+                stats["e2e"].append(response[0] - sent_at)
+
+        print("{} requests in {:.1f}s: {:.1f} req/s, {} errors".format(
+            len(self.results), self.elapsed, len(self.results) / self.elapsed, len(self.errors)
+        ))
+        print("{:<26} {:>6} {:>7} {:>8} {:>9} {:>9} {:>9} {:>9}".format(
+            "command", "count", "inline", "missing", "ack p50", "ack p99", "e2e p50", "e2e p99"
+        ))
+        for command in sorted(by_command, key=lambda c: -len(by_command[c]["ack"])):
+            stats = by_command[command]
+            print("{:<26} {:>6} {:>7} {:>8} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+                command, len(stats["ack"]), stats["inline"], stats["missing"],
+                percentile(stats["ack"], 50) * 1000, percentile(stats["ack"], 99) * 1000,
+                percentile(stats["e2e"], 50) * 1000, percentile(stats["e2e"], 99) * 1000,
+            ))
+        print("Latencies in ms. Slack calls: {}".format(json.dumps(self.fake_slack.get_calls(), sort_keys=True)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test with signed slash commands.")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--server", default="threaded", choices=definitions.HTTP_SERVERS)
+    parser.add_argument("--threads", type=int, default=definitions.HTTP_SERVER_DEFAULT_THREADS)
+    parser.add_argument("--teams", type=int, default=20)
+    parser.add_argument("--users-per-team", type=int, default=5)
+    parser.add_argument("--mix-from-db", action="store_true", help="use the command mix of the requests table")
+    parser.add_argument("--no-db", action="store_true", help="don't migrate, seed or read the database")
+    parser.add_argument("--drain-timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    fake_slack_server.add_arguments(parser, prefix="slack-")
+    args = parser.parse_args()
+
+    fake_slack = fake_slack_server.from_arguments(args, prefix="slack-", seed=args.seed).start()
+    os.environ["SLACK_API_BASE_URL"] = fake_slack.api_url
+
+    users = get_load_test_users(args.teams, args.users_per_team)
+    command_mix = DEFAULT_COMMAND_MIX
+    if args.no_db:
+        team_ids = ["00000000-0000-4000-8000-{:012d}".format(t) for t in range(args.teams)]
+    else:
+        schema.apply_migrations()
+        team_ids = seed_database(args.teams, args.users_per_team)
+        if args.mix_from_db:
+            command_mix = get_command_mix_from_db() or DEFAULT_COMMAND_MIX
+    teams = [{"id": team_id, "users": team_users} for team_id, team_users in zip(team_ids, users)]
+
+    dispatcher.start()
+    port = start_app(args.server, args.threads)
+    load_test = LoadTest(args, fake_slack, port, teams, command_mix)
+    try:
+        load_test.run()
+    finally:
+        dispatcher.stop()
+        database.stop_request_log_writer()
+        database.close_pool()
+        fake_slack.stop()
+    load_test.report()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""Replays the requests logged on the requests table of a source database against this build.
+
+Requests created in [--since, --until) are read from --source-dsn and re-driven, in their original order,
+through the dispatcher queues (dispatcher.add_request_to_queue and dispatcher.general_dispatcher),
+at their original pace divided by --speed, or as fast as possible with --speed max.
+The bot runs on the scratch database of the DB_* environment variables, with benchmarks/fake_slack.py
+standing in for Slack. Never point DB_* to the source database.
+
+Ids assigned by the database are remapped: team ids and entry codes on command arguments are replaced
+by the ones the scratch database gave to the team of the same name. Replay from before the first
+/criar-equipa to rebuild every team. Staff permissions are copied from the source database first.
+
+Compares the outcome (success and description) of every replayed request with the logged one,
+and reports the end-to-end latency of each command, until its delayed response reaches Slack.
+--output saves the results, --compare reports the latency changes against results saved before.
+
+Usage: python3 benchmarks/replay.py --source-dsn "host=... dbname=..." --since 2019-03-01T09:00 [--until ...]
+    [--speed 1|10|max] [--init-schema] [--output results.json] [--compare previous.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+os.environ.setdefault("SLACK_SIGNING_SECRET", "replay-signing-secret")
+os.environ.setdefault("SLACK_USER_TOKEN", "xoxp-replay")
+os.environ.setdefault("SLACK_LOGS_CHANNEL_ID", "CREPLAYLOGS")
+os.environ.setdefault("SLACK_STAFF_CHANNEL_ID", "CREPLAYSTAFF")
+os.environ.setdefault("SLACK_SUPPORT_CHANNEL_ID", "CREPLAYSUPPORT")
+# Keep the files written by the bot out of the source tree
+os.environ.setdefault("TRACE_FILE", os.path.join(tempfile.gettempdir(), "replay_traces.jsonl"))
+os.environ.setdefault("REQUEST_LOG_SPILL_FILE", os.path.join(tempfile.gettempdir(), "replay_request_log_spill.jsonl"))
+
+import psycopg2
+import database
+import dispatcher
+import schema
+import fake_slack as fake_slack_server
+from benchmark_utils import percentile
+
+
+CREATE_SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "db", "init", "create.sql")
+
+def read_logged_requests(source, since, until):
+    """Logged requests created in [since, until), oldest first, as dicts."""
+    cursor = source.cursor()
+    cursor.execute("""
+        SELECT
+            created_at,
+            token,
+            team_id,
+            team_domain,
+            channel_id,
+            channel_name,
+            slack_user_id,
+            slack_user_name,
+            command,
+            command_text,
+            success,
+            description
+        FROM requests
+        WHERE created_at >= %s
+        AND (%s IS NULL OR created_at < %s)
+        ORDER BY created_at, id
+    """, (since, until, until))
+    columns = [column[0] for column in cursor.description]
+    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    cursor.close()
+    return rows
+
+def read_teams(db_connection):
+    """Registered teams, as {team name: [team id, entry code]}."""
+    cursor = db_connection.cursor()
+    cursor.execute("SELECT team_name, team_id, entry_code FROM team_registration")
+    teams = {team_name: [str(team_id), entry_code] for [team_name, team_id, entry_code] in cursor.fetchall()}
+    cursor.close()
+    return teams
+
+def copy_permissions(source):
+    """Creates the staff users of the source database on the scratch one, with their permissions."""
+    cursor = source.cursor()
+    cursor.execute("""
+        SELECT users.slack_id, users.slack_name, permissions.staff_function
+        FROM permissions
+        INNER JOIN users
+        ON users.user_id = permissions.user_id
+    """)
+    staff = cursor.fetchall()
+    cursor.close()
+    with database.connection(False) as db_connection:
+        cursor = db_connection.cursor()
+        for [slack_id, slack_name, staff_function] in staff:
+            cursor.execute("""
+                INSERT INTO users (slack_id, slack_name)
+                VALUES (%s, %s)
+                ON CONFLICT (slack_id) DO NOTHING
+            """, (slack_id, slack_name))
+            cursor.execute("""
+                INSERT INTO permissions (user_id, staff_function)
+                SELECT user_id, %s
+                FROM users
+                WHERE slack_id = %s
+                AND NOT EXISTS (SELECT FROM permissions WHERE permissions.user_id = users.user_id)
+            """, (staff_function, slack_id))
+        cursor.close()
+    return len(staff)
+
+
+class IdMap:
+    """Maps the team ids and entry codes of the source database to the scratch database ones, by team name."""
+
+    def __init__(self, source):
+        self.source_teams = read_teams(source)
+        self.source_ids = {}
+        for team_name, [team_id, entry_code] in self.source_teams.items():
+            self.source_ids[team_id.lower()] = [team_name, 0]
+            if entry_code:
+                self.source_ids[entry_code] = [team_name, 1]
+        self.scratch_teams = {}
+
+    def refresh(self):
+        with database.connection() as db_connection:
+            self.scratch_teams = read_teams(db_connection)
+
+    def get_unmapped(self, text):
+        """Source ids in a command text with no scratch database id yet."""
+        return [token for token in text.split() if self.lookup(token) is None and self.is_source_id(token)]
+
+    def is_source_id(self, token):
+        return token.lower() in self.source_ids or token in self.source_ids
+
+    def lookup(self, token):
+        entry = self.source_ids.get(token.lower()) or self.source_ids.get(token)
+        if entry is None:
+            return None
+        [team_name, field] = entry
+        scratch_team = self.scratch_teams.get(team_name)
+        return scratch_team[field] if scratch_team else None
+
+    def remap(self, text):
+        """Replaces the source ids of a command text. Whitespace is normalised, as commands split on it."""
+        return " ".join(self.lookup(token) or token for token in text.split())
+
+
+def wait_for_queues():
+    """Waits for every queued request to be dispatched."""
+    for shard_queue in list(dispatcher.requests_queues):
+        shard_queue.join()
+
+def replay(logged_requests, id_map, fake_slack, run_id, speed):
+    """Queues every logged request at its original pace divided by speed (None for max speed).
+    Returns, by replay index, [logged request, queued_at]."""
+    replayed = {}
+    first_created_at = logged_requests[0]["created_at"] if logged_requests else None
+    started = time.monotonic()
+    for idx, logged in enumerate(logged_requests):
+        if speed is not None:
+            target = started + (logged["created_at"] - first_created_at).total_seconds() / speed
+            if target > time.monotonic():
+                time.sleep(target - time.monotonic())
+
+        text = logged["command_text"] or ""
+        if id_map.get_unmapped(text):
+            # Teams are registered by earlier requests, possibly still queued on another shard
+            wait_for_queues()
+            id_map.refresh()
+        request = {
+            "token": logged["token"],
+            "team_id": logged["team_id"],
+            "team_domain": logged["team_domain"],
+            "channel_id": logged["channel_id"],
+            "channel_name": logged["channel_name"],
+            "user_id": logged["slack_user_id"],
+            "user_name": logged["slack_user_name"],
+            "command": logged["command"],
+            "text": id_map.remap(text),
+            "response_url": fake_slack.response_url("{}/{}".format(run_id, idx)),
+        }
+        replayed[idx] = [logged, time.monotonic()]
+        while not dispatcher.add_request_to_queue(request):
+            time.sleep(0.01)
+    return replayed
+
+def read_replayed_outcomes(fake_slack, run_id):
+    """Outcome logged by the scratch database for each replayed request, by replay index."""
+    prefix = fake_slack.response_url("{}/".format(run_id))
+    with database.connection() as db_connection:
+        cursor = db_connection.cursor()
+        cursor.execute("""
+            SELECT response_url, success, description
+            FROM requests
+            WHERE response_url LIKE %s
+        """, (prefix + "%",))
+        outcomes = {int(response_url[len(prefix):]): [success, description] for [response_url, success, description] in cursor.fetchall()}
+        cursor.close()
+    return outcomes
+
+def wait_for_responses(fake_slack, run_id, replayed, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(fake_slack.get_response("{}/{}".format(run_id, idx)) for idx in replayed):
+            return
+        time.sleep(0.1)
+
+def get_results(fake_slack, run_id, replayed, outcomes):
+    """Outcome comparison and latencies, by command."""
+    results = {}
+    mismatches = []
+    for idx, [logged, queued_at] in sorted(replayed.items()):
+        command_results = results.setdefault(logged["command"], {
+            "count": 0, "matched": 0, "mismatched": 0, "not_logged": 0, "missing_responses": 0, "latencies": []
+        })
+        command_results["count"] += 1
+        outcome = outcomes.get(idx)
+        if outcome is None:
+            command_results["not_logged"] += 1
+        elif outcome == [logged["success"], logged["description"]]:
+            command_results["matched"] += 1
+        else:
+            command_results["mismatched"] += 1
+            mismatches.append([logged, outcome])
+        response = fake_slack.get_response("{}/{}".format(run_id, idx))
+        if response is None:
+            command_results["missing_responses"] += 1
+        else:
+            command_results["latencies"].append(response[0] - queued_at)
+
+    for command_results in results.values():
+        latencies = command_results.pop("latencies")
+        command_results["p50_ms"] = percentile(latencies, 50) * 1000
+        command_results["p99_ms"] = percentile(latencies, 99) * 1000
+    return [results, mismatches]
+
+def report(results, mismatches, previous, max_mismatches):
+    print("{:<26} {:>6} {:>8} {:>10} {:>10} {:>8} {:>9} {:>9} {:>9} {:>9}".format(
+        "command", "count", "matched", "mismatched", "not logged", "missing", "p50 ms", "p99 ms", "Δp50 %", "Δp99 %"
+    ))
+    for command in sorted(results, key=lambda c: -results[c]["count"]):
+        r = results[command]
+        before = (previous or {}).get(command)
+        print("{:<26} {:>6} {:>8} {:>10} {:>10} {:>8} {:>9.1f} {:>9.1f} {:>9} {:>9}".format(
+            command, r["count"], r["matched"], r["mismatched"], r["not_logged"], r["missing_responses"], r["p50_ms"], r["p99_ms"],
+            format_change(r["p50_ms"], before["p50_ms"]) if before else "",
+            format_change(r["p99_ms"], before["p99_ms"]) if before else "",
+        ))
+    for [logged, [success, description]] in mismatches[:max_mismatches]:
+        print("Mismatch {} {} {!r}: logged [{}, {}], replayed [{}, {}]".format(
+            logged["created_at"].isoformat(), logged["command"], logged["command_text"],
+            logged["success"], logged["description"], success, description
+        ))
+
+def format_change(value, before):
+    if not before:
+        return ""
+    return "{:+.1f}".format((value - before) / before * 100)
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays logged requests against this build.")
+    parser.add_argument("--source-dsn", required=True, help="libpq connection string of the database to read requests from")
+    parser.add_argument("--since", required=True, type=datetime.fromisoformat)
+    parser.add_argument("--until", type=datetime.fromisoformat, default=None)
+    parser.add_argument("--speed", default="1", help="1, 10 or any pace multiplier, or max")
+    parser.add_argument("--init-schema", action="store_true", help="create the base schema on the scratch database first")
+    parser.add_argument("--drain-timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="file to save the results to, as JSON")
+    parser.add_argument("--compare", help="results saved before with --output, to compare latencies with")
+    parser.add_argument("--max-mismatches", type=int, default=20, help="mismatches to print")
+    parser.add_argument("--seed", type=int, default=1)
+    fake_slack_server.add_arguments(parser, prefix="slack-")
+    args = parser.parse_args()
+    speed = None if args.speed == "max" else float(args.speed)
+
+    source = psycopg2.connect(args.source_dsn)
+    source.set_session(readonly=True)
+    logged_requests = read_logged_requests(source, args.since, args.until)
+    print("Replaying {} requests".format(len(logged_requests)))
+
+    if args.init_schema:
+        with open(CREATE_SCHEMA_FILE, encoding="utf-8") as create_file:
+            with database.connection() as db_connection:
+                db_connection.cursor().execute(create_file.read())
+    schema.apply_migrations()
+    copy_permissions(source)
+    id_map = IdMap(source)
+    id_map.refresh()
+    source.close()
+
+    fake_slack = fake_slack_server.from_arguments(args, prefix="slack-", seed=args.seed).start()
+    os.environ["SLACK_API_BASE_URL"] = fake_slack.api_url
+    run_id = uuid.uuid4().hex
+
+    dispatcher.start()
+    try:
+        replayed = replay(logged_requests, id_map, fake_slack, run_id, speed)
+        wait_for_queues()
+        wait_for_responses(fake_slack, run_id, replayed, args.drain_timeout)
+    finally:
+        dispatcher.stop()
+        database.stop_request_log_writer()
+    outcomes = read_replayed_outcomes(fake_slack, run_id)
+    database.close_pool()
+    fake_slack.stop()
+
+    [results, mismatches] = get_results(fake_slack, run_id, replayed, outcomes)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    report(results, mismatches, previous, args.max_mismatches)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    main()
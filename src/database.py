@@ -1,33 +1,271 @@
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+import psycopg2.extras
+import json
+import base64
+import uuid
+import struct
 import os
+import time
+import threading
 import logging as logger
 import exceptions
 import common
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from definitions import INITIAL_TEAM_BALANCE
+import definitions
+import metrics
+import recenttransactions
+import teambalances
+import tracing
 import log_messages as messages
 
 
 common.setup_logger()
 
+# Process wide connection pool, created on first use.
+connection_pool = None
+connection_pool_lock = threading.Lock()
+# Bounds the number of borrowed connections, so callers wait instead of failing when the pool is exhausted.
+connection_pool_slots = threading.BoundedSemaphore(definitions.DATABASE_POOL_MAX_CONNECTIONS)
+# Time at which each pooled connection was last returned, keyed by id(connection).
+connection_last_used = {}
+connection_pool_metrics = {
+    "checkouts": 0,
+    "checkins": 0,
+    "checkout_timeouts": 0,
+    "checkout_wait_seconds": 0.0,
+    "health_check_failures": 0,
+    "connection_errors": 0,
+}
+
+# Page tokens hold the created_at of the last transaction listed, as microseconds since this date
+PAGE_TOKEN_EPOCH = datetime(1970, 1, 1)
+
+# Request log rows waiting to be inserted by the request log writer thread.
+request_log_buffer = []
+request_log_condition = threading.Condition()
+request_log_writer_state = {
+    "thread": None,
+    "stopping": False,
+}
+
+def get_connection_pool():
+    """Returns the process wide connection pool, creating it if needed."""
+    global connection_pool
+    with connection_pool_lock:
+        if connection_pool is None:
+            try:
+                connection_pool = psycopg2.pool.ThreadedConnectionPool(
+                    definitions.DATABASE_POOL_MIN_CONNECTIONS,
+                    definitions.DATABASE_POOL_MAX_CONNECTIONS,
+                    dbname=os.getenv("DB_NAME"),
+                    user=os.getenv("DB_USERNAME"),
+                    password=os.getenv("DB_PASSWORD"),
+                    host=os.getenv("DB_HOST"),
+                    port="5432"
+                )
+            except Exception as e:
+                connection_pool_metrics["connection_errors"] += 1
+                logger.critical(messages.CONNECT_TO_DB_FAILED.format(e))
+                raise exceptions.DatabaseConnectionError("Can't establish connection to database.")
+            logger.debug(messages.DB_POOL_CREATED.format(definitions.DATABASE_POOL_MIN_CONNECTIONS, definitions.DATABASE_POOL_MAX_CONNECTIONS))
+        return connection_pool
+
+def connection_is_healthy(conn):
+    """Checks if a pooled connection is still usable. Idle connections are pinged."""
+    if conn.closed:
+        return False
+    idle_time = time.monotonic() - connection_last_used.get(id(conn), 0)
+    if idle_time < definitions.DATABASE_POOL_HEALTH_CHECK_IDLE_SECONDS:
+        return True
+    try:
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.close()
+    except Exception as ex:
+        logger.warn(messages.DB_POOL_HEALTH_CHECK_FAILED.format(ex))
+        return False
+    return True
+
 def connect(autocommit = True):
-    """Connects to a PostgreSQL database and returns a connection."""
+    """Borrows a connection from the connection pool. Must be given back with release()."""
+    wait_start = time.monotonic()
+    if not connection_pool_slots.acquire(timeout=definitions.DATABASE_POOL_CHECKOUT_TIMEOUT_SECONDS):
+        with connection_pool_lock:
+            connection_pool_metrics["checkout_timeouts"] += 1
+        logger.critical(messages.DB_POOL_CHECKOUT_TIMEOUT)
+        raise exceptions.DatabaseConnectionError("Timed out waiting for a database connection.")
+
     try:
-        conn = psycopg2.connect(
-            dbname=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USERNAME"),
-            password=os.getenv("DB_PASSWORD"),
-            host=os.getenv("DB_HOST"),
-            port="5432"
-        )
+        pool = get_connection_pool()
+        # After an outage every idle connection may be dead. Discarding one per attempt, at most every
+        # pooled connection is checked before the pool opens a fresh one, which is checked too.
+        for _ in range(definitions.DATABASE_POOL_MAX_CONNECTIONS + 1):
+            conn = pool.getconn()
+            if connection_is_healthy(conn):
+                break
+            with connection_pool_lock:
+                connection_pool_metrics["health_check_failures"] += 1
+            connection_last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+        else:
+            with connection_pool_lock:
+                connection_pool_metrics["connection_errors"] += 1
+            logger.critical(messages.CONNECT_TO_DB_FAILED.format("no pooled connection passed the health check"))
+            raise exceptions.DatabaseConnectionError("Can't establish connection to database.")
         conn.autocommit = autocommit
-        return conn
+    except exceptions.DatabaseConnectionError:
+        connection_pool_slots.release()
+        raise
     except Exception as e:
+        connection_pool_slots.release()
+        with connection_pool_lock:
+            connection_pool_metrics["connection_errors"] += 1
         logger.critical(messages.CONNECT_TO_DB_FAILED.format(e))
         raise exceptions.DatabaseConnectionError("Can't establish connection to database.")
 
+    with connection_pool_lock:
+        connection_pool_metrics["checkouts"] += 1
+        connection_pool_metrics["checkout_wait_seconds"] += time.monotonic() - wait_start
+    return conn
+
+def release(conn):
+    """Gives a borrowed connection back to the connection pool."""
+    try:
+        if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            # Never hand out a connection with a pending transaction
+            conn.rollback()
+        if conn.closed:
+            connection_last_used.pop(id(conn), None)
+        else:
+            connection_last_used[id(conn)] = time.monotonic()
+        connection_pool.putconn(conn, close=bool(conn.closed))
+    except Exception as ex:
+        logger.warn(messages.DB_POOL_RELEASE_FAILED.format(ex))
+    finally:
+        with connection_pool_lock:
+            connection_pool_metrics["checkins"] += 1
+        connection_pool_slots.release()
+
+@contextmanager
+def connection(autocommit = True):
+    """Context manager that borrows a pooled connection.
+    Without autocommit, the transaction is committed on success and rolled back on error."""
+    db_connection = connect(autocommit)
+    try:
+        yield db_connection
+        if not autocommit:
+            db_connection.commit()
+    except Exception:
+        if not autocommit and not db_connection.closed:
+            db_connection.rollback()
+        raise
+    finally:
+        release(db_connection)
+
+def get_pool_metrics():
+    """Returns a snapshot of the connection pool metrics."""
+    with connection_pool_lock:
+        metrics = dict(connection_pool_metrics)
+        metrics["min_connections"] = definitions.DATABASE_POOL_MIN_CONNECTIONS
+        metrics["max_connections"] = definitions.DATABASE_POOL_MAX_CONNECTIONS
+        if connection_pool is not None:
+            metrics["in_use"] = len(connection_pool._used)
+            metrics["idle"] = len(connection_pool._pool)
+        else:
+            metrics["in_use"] = 0
+            metrics["idle"] = 0
+    return metrics
+
+def close_pool():
+    """Closes every connection in the pool."""
+    global connection_pool
+    with connection_pool_lock:
+        if connection_pool is not None:
+            connection_pool.closeall()
+            connection_pool = None
+            connection_last_used.clear()
+
 def save_request_log(request, success, description):
+    """Queues a request log row, to be inserted by the request log writer thread."""
+    row = (
+        datetime.now().isoformat(),
+        request['token'],
+        request['team_id'],
+        request['team_domain'],
+        request['channel_id'],
+        request['channel_name'],
+        request['user_id'],
+        request['user_name'],
+        request['command'],
+        request['text'],
+        request['response_url'],
+        success,
+        description
+    )
+    with request_log_condition:
+        request_log_buffer.append(row)
+        if request_log_writer_state["thread"] is None:
+            start_request_log_writer()
+        if len(request_log_buffer) >= definitions.REQUEST_LOG_FLUSH_ROWS:
+            request_log_condition.notify()
+
+def start_request_log_writer():
+    """Starts the request log writer thread. Must be called holding request_log_condition."""
+    request_log_writer_state["stopping"] = False
+    t = threading.Thread(target=request_log_writer, name="RequestLogWriterThread")
+    t.setDaemon(True)
+    t.start()
+    request_log_writer_state["thread"] = t
+
+def stop_request_log_writer():
+    """Writes the buffered request logs and stops the request log writer thread."""
+    with request_log_condition:
+        t = request_log_writer_state["thread"]
+        request_log_writer_state["stopping"] = True
+        request_log_condition.notify()
+    if t is not None:
+        t.join(definitions.REQUEST_LOG_FLUSH_INTERVAL_SECONDS + definitions.DATABASE_POOL_CHECKOUT_TIMEOUT_SECONDS)
+    with request_log_condition:
+        request_log_writer_state["thread"] = None
+
+def request_log_writer():
+    """Request log writer loop. Inserts the buffered rows every REQUEST_LOG_FLUSH_ROWS rows
+    or REQUEST_LOG_FLUSH_INTERVAL_SECONDS, whichever comes first."""
+    while True:
+        with request_log_condition:
+            if not request_log_writer_state["stopping"] and len(request_log_buffer) < definitions.REQUEST_LOG_FLUSH_ROWS:
+                request_log_condition.wait(definitions.REQUEST_LOG_FLUSH_INTERVAL_SECONDS)
+            stopping = request_log_writer_state["stopping"]
+            rows = list(request_log_buffer)
+            request_log_buffer.clear()
+
+        if rows:
+            flush_request_logs(rows)
+        if stopping:
+            return
+
+def flush_request_logs(rows):
+    """Inserts request log rows. Rows that can't be inserted are spilled to the spill file,
+    which is inserted back on the next successful flush."""
     try:
-        db_connection = connect()
+        insert_request_logs(rows)
+    except exceptions.SaveRequestLogError as ex:
+        logger.error(messages.REQUEST_LOG_SPILLED.format(len(rows), ex))
+        spill_request_logs(rows)
+    else:
+        replay_spilled_request_logs()
+
+def insert_request_logs(rows):
+    """Inserts request log rows with multi-row INSERTs of up to REQUEST_LOG_FLUSH_ROWS rows,
+    committed together, so either every row is inserted or none is."""
+    try:
+        db_connection = connect(False)
     except exceptions.DatabaseConnectionError as ex:
         logger.critical(messages.CONNECT_TO_DB_FAILED.format(ex))
         raise exceptions.SaveRequestLogError("Could not connect to database: {}".format(ex))
@@ -36,6 +274,7 @@ def save_request_log(request, success, description):
 
         sql_string = """
             INSERT INTO requests (
+                created_at,
                 token,
                 team_id,
                 team_domain,
@@ -48,33 +287,69 @@ def save_request_log(request, success, description):
                 response_url,
                 success,
                 description
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ) VALUES %s
             """
-        data = (
-            request['token'],
-            request['team_id'],
-            request['team_domain'],
-            request['channel_id'],
-            request['channel_name'],
-            request['user_id'],
-            request['user_name'],
-            request['command'],
-            request['text'],
-            request['response_url'],
-            success,
-            description
-        )
 
         try:
-            cursor.execute(sql_string, data)
+            psycopg2.extras.execute_values(cursor, sql_string, rows, page_size=definitions.REQUEST_LOG_FLUSH_ROWS)
+            db_connection.commit()
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            if not db_connection.closed:
+                db_connection.rollback()
+            release(db_connection)
             raise exceptions.SaveRequestLogError("Could not execute query: {}".format(ex))
         else:
             cursor.close()
-            db_connection.close()
+            release(db_connection)
+
+def get_request_log_spill_file():
+    """Returns the path of the file where request logs are kept while the database is unreachable."""
+    path = os.getenv("REQUEST_LOG_SPILL_FILE") or definitions.REQUEST_LOG_SPILL_FILE
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+
+def spill_request_logs(rows):
+    """Appends request log rows to the spill file, one JSON list per line."""
+    try:
+        with open(get_request_log_spill_file(), "a", encoding="utf-8") as spill_file:
+            for row in rows:
+                spill_file.write(json.dumps(row) + "\n")
+    except OSError as ex:
+        logger.critical(messages.REQUEST_LOG_SPILL_FAILED.format(len(rows), ex))
+
+def replay_spilled_request_logs():
+    """Inserts the spilled request logs. The spill file is first renamed to a claimed name, which is never
+    replayed again: rows that can't be inserted are spilled anew, and a claimed file that can't be read
+    or removed is kept for manual recovery, so rows are never inserted twice."""
+    path = get_request_log_spill_file()
+    if not os.path.isfile(path):
+        return
+    claimed_path = "{}.{}.replaying".format(path, uuid.uuid4().hex)
+    try:
+        os.rename(path, claimed_path)
+    except OSError as ex:
+        logger.error(messages.REQUEST_LOG_REPLAY_FAILED.format(ex))
+        return
+    try:
+        with open(claimed_path, encoding="utf-8") as spill_file:
+            rows = [tuple(json.loads(line)) for line in spill_file if line.strip()]
+    except (OSError, ValueError) as ex:
+        logger.critical(messages.REQUEST_LOG_CLAIMED_READ_FAILED.format(claimed_path, ex))
+        return
+
+    try:
+        if rows:
+            insert_request_logs(rows)
+    except exceptions.SaveRequestLogError as ex:
+        logger.error(messages.REQUEST_LOG_REPLAY_FAILED.format(ex))
+        spill_request_logs(rows)
+    else:
+        logger.info(messages.REQUEST_LOG_REPLAYED.format(len(rows)))
+    try:
+        os.remove(claimed_path)
+    except OSError as ex:
+        logger.warn(messages.REQUEST_LOG_CLAIMED_REMOVE_FAILED.format(claimed_path, ex))
 
 def team_name_available(team_name):
     """Checks if a team name is available."""
@@ -102,12 +377,12 @@ def team_name_available(team_name):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Couldn't not perform database query: {}".format(ex))
         else:
             result = cursor.fetchone()[0]
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             return result
 
 def save_team_registration(team_name, entry_code):
@@ -137,16 +412,16 @@ def save_team_registration(team_name, entry_code):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database insertion query: {}".format(ex))
         else:
             result = cursor.fetchone()[0]
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             return result
 
-def user_exists(slack_id):
-    """Checks if a user exists in the database."""
+def save_user(slack_id, slack_name):
+    """Saves a user in the database, if not saved yet."""
     try:
         db_connection = connect()
     except exceptions.DatabaseConnectionError as ex:
@@ -155,15 +430,17 @@ def user_exists(slack_id):
     else:
         cursor = db_connection.cursor()
 
+        # Two dispatcher threads may register the same user at once
         sql_string = """
-            SELECT EXISTS (
-                SELECT *
-                FROM users
-                WHERE slack_id = %s
-            )
+            INSERT INTO users (
+                slack_id,
+                slack_name
+            ) VALUES (%s, %s)
+            ON CONFLICT (slack_id) DO NOTHING
             """
         data = (
             slack_id,
+            slack_name,
         )
 
         try:
@@ -171,16 +448,57 @@ def user_exists(slack_id):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
+            raise exceptions.QueryDatabaseError("Could not perform database insertion query: {}".format(ex))
+        else:
+            cursor.close()
+            release(db_connection)
+
+def get_all_users_teams():
+    """Gets the slack id and team id of every user in the database, as [slack_id, team] lists."""
+    try:
+        db_connection = connect()
+    except exceptions.DatabaseConnectionError as ex:
+        logger.critical(messages.CONNECT_TO_DB_FAILED.format(ex))
+        raise exceptions.QueryDatabaseError("Could not connect to database: {}".format(ex))
+    else:
+        cursor = db_connection.cursor()
+
+        sql_string = """
+            SELECT slack_id, team
+            FROM users
+            """
+
+        try:
+            cursor.execute(sql_string)
+        except Exception as ex:
+            logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
+            cursor.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database query: {}".format(ex))
         else:
-            result = cursor.fetchone()[0]
+            result = [list(r) for r in cursor.fetchall()]
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             return result
 
-def save_user(slack_id, slack_name):
-    """Saves a user exists in the database."""
+RequestContext = namedtuple("RequestContext", [
+    "user_id",
+    "slack_id",
+    "slack_name",
+    # Team fields are None for users without team
+    "team_id",
+    "team_name",
+    "balance",
+    "balance_version",
+    "team_channel_id",
+    # Staff function, None for users without permissions
+    "role",
+])
+
+def get_request_context(slack_id, slack_name, save_user = True):
+    """Gets the facts about a user needed to handle a request, in one query.
+    When save_user is True, the user is saved first if not in the database yet."""
     try:
         db_connection = connect()
     except exceptions.DatabaseConnectionError as ex:
@@ -189,27 +507,70 @@ def save_user(slack_id, slack_name):
     else:
         cursor = db_connection.cursor()
 
+        # Rows inserted by new_user aren't visible to other parts of the same statement,
+        # so the new user is taken from the INSERT output.
         sql_string = """
-            INSERT INTO users (
-                slack_id,
-                slack_name
-            ) VALUES (%s, %s)
+            WITH new_user AS (
+                INSERT INTO users (
+                    slack_id,
+                    slack_name
+                )
+                SELECT %(slack_id)s, %(slack_name)s
+                WHERE %(save_user)s
+                AND NOT EXISTS (
+                    SELECT 1
+                    FROM users
+                    WHERE slack_id = %(slack_id)s
+                )
+                ON CONFLICT (slack_id) DO NOTHING
+                RETURNING user_id, slack_id, slack_name, team
+            ), context_user AS (
+                SELECT user_id, slack_id, slack_name, team
+                FROM users
+                WHERE slack_id = %(slack_id)s
+                UNION ALL
+                SELECT user_id, slack_id, slack_name, team
+                FROM new_user
+            )
+            SELECT
+                context_user.user_id,
+                context_user.slack_id,
+                context_user.slack_name,
+                teams.team_id,
+                teams.team_name,
+                teams.balance,
+                teams.balance_version,
+                teams.slack_channel_id,
+                (
+                    SELECT staff_function
+                    FROM permissions
+                    WHERE permissions.user_id = context_user.user_id
+                    LIMIT 1
+                )
+            FROM context_user
+            LEFT JOIN teams ON teams.team_id = context_user.team
+            LIMIT 1
             """
-        data = (
-            slack_id,
-            slack_name,
-        )
+        data = {
+            "slack_id": slack_id,
+            "slack_name": slack_name,
+            "save_user": save_user,
+        }
 
         try:
             cursor.execute(sql_string, data)
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
-            raise exceptions.QueryDatabaseError("Could not perform database insertion query: {}".format(ex))
+            release(db_connection)
+            raise exceptions.QueryDatabaseError("Could not perform database query: {}".format(ex))
         else:
+            db_results = cursor.fetchone()
             cursor.close()
-            db_connection.close()
+            release(db_connection)
+            if db_results:
+                return RequestContext(*db_results)
+            return None
 
 def user_has_team(slack_id):
     """Checks if a user is already on a team."""
@@ -238,12 +599,12 @@ def user_has_team(slack_id):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database query: {}".format(ex))
         else:
             result = cursor.fetchone()[0]
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             return result
 
 def valid_entry_code(entry_code):
@@ -270,13 +631,13 @@ def valid_entry_code(entry_code):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database query: {}".format(ex))
         else:
             db_results = cursor.fetchone()
             if cursor.rowcount != 1:
                 cursor.close()
-                db_connection.close()
+                release(db_connection)
                 return dict()
             else:
                 result = {
@@ -284,7 +645,7 @@ def valid_entry_code(entry_code):
                     "name": db_results[1]
                 }
                 cursor.close()
-                db_connection.close()
+                release(db_connection)
                 return result
 
 def is_team_created(team_id):
@@ -313,12 +674,12 @@ def is_team_created(team_id):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database query: {}".format(ex))
         else:
             result = cursor.fetchone()[0]
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             return result
 
 def create_team(team_info):
@@ -351,11 +712,11 @@ def create_team(team_info):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database insertion query: {}".format(ex))
         else:
             cursor.close()
-            db_connection.close()
+            release(db_connection)
 
 def add_user_to_team(user_slack_id, team_id):
     """Adds a user to a team."""
@@ -382,50 +743,24 @@ def add_user_to_team(user_slack_id, team_id):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database update query: {}".format(ex))
         else:
             cursor.close()
-            db_connection.close()
-
-def get_users_balance(user_slack_id):
-    """Get a user's balance."""
-    try:
-        db_connection = connect()
-    except exceptions.DatabaseConnectionError as ex:
-        logger.critical(messages.CONNECT_TO_DB_FAILED.format(ex))
-        raise exceptions.QueryDatabaseError("Could not connect to database: {}".format(ex))
-    else:
-        cursor = db_connection.cursor()
+            release(db_connection)
 
-        sql_string = """
-            SELECT team_name, balance
-            FROM teams
-            WHERE team_id IN (
-                SELECT team
-                FROM users
-                WHERE slack_id=%s
-            )
-            """
-        data = (
-            user_slack_id,
-        )
+class BuyResults:
+    """Result codes returned by perform_buy, as set by the perform_buy database function."""
+    Success = "SUCCESS"
+    OriginWithoutTeam = "ORIGIN_WITHOUT_TEAM"
+    DestinationWithoutTeam = "DESTINATION_WITHOUT_TEAM"
+    SameTeam = "SAME_TEAM"
+    NotEnoughCredit = "NOT_ENOUGH_CREDIT"
 
-        try:
-            cursor.execute(sql_string, data)
-        except Exception as ex:
-            logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
-            cursor.close()
-            db_connection.close()
-            raise exceptions.QueryDatabaseError("Could not perform database update query: {}".format(ex))
-        else:
-            result = cursor.fetchone()
-            cursor.close()
-            db_connection.close()
-            return result
-
-def users_with_different_team(slack_user_id_1, slack_user_id_2):
-    """Checks if two users are in different teams."""
+def perform_buy(origin_slack_user_id, destination_slack_user_id, amount, description):
+    """Performs a shop operation between the two users, in one call of the perform_buy database function.
+    It locks both teams, then validates, updates both balances and records the transaction atomically.
+    Returns [result code, destination team channel id]."""
     try:
         db_connection = connect()
     except exceptions.DatabaseConnectionError as ex:
@@ -434,137 +769,34 @@ def users_with_different_team(slack_user_id_1, slack_user_id_2):
     else:
         cursor = db_connection.cursor()
 
+        # See migrations/006_perform_buy_function.sql
         sql_string = """
-            SELECT COUNT(DISTINCT team)
-            FROM public.users
-            WHERE slack_id IN (%s, %s)
+            SELECT *
+            FROM perform_buy(%s, %s, %s, %s)
             """
         data = (
-            slack_user_id_1, slack_user_id_2,
+            origin_slack_user_id,
+            destination_slack_user_id,
+            amount,
+            description,
         )
-        try:
-            cursor.execute(sql_string, data)
-        except Exception as ex:
-            logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
-            cursor.close()
-            db_connection.close()
-            raise exceptions.QueryDatabaseError("Could not perform database update query: {}".format(ex))
-        else:
-            result = cursor.fetchone()[0]
-            cursor.close()
-            db_connection.close()
-            return result == 2
-
-def user_has_enough_credit(slack_user_id, amount):
-    """Checks if a user has enough credit."""
-    try:
-        db_connection = connect()
-    except exceptions.DatabaseConnectionError as ex:
-        logger.critical(messages.CONNECT_TO_DB_FAILED.format(ex))
-        raise exceptions.QueryDatabaseError("Could not connect to database: {}".format(ex))
-    else:
-        cursor = db_connection.cursor()
 
-        sql_string = """
-            SELECT EXISTS (
-                SELECT
-                FROM teams
-                WHERE team_id IN (
-                    SELECT team
-                    FROM public.users
-                    WHERE slack_id=%s
-                )
-                AND balance > %s
-            )
-            """
-        data = (
-            slack_user_id, amount,
-        )
         try:
             cursor.execute(sql_string, data)
+            [result, channel_id, origin_balance, origin_version, destination_balance, destination_version, origin_team, destination_team, *transaction] = cursor.fetchone()
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
-            raise exceptions.QueryDatabaseError("Could not perform database update query: {}".format(ex))
-        else:
-            result = cursor.fetchone()[0]
-            cursor.close()
-            db_connection.close()
-            return result
-
-def perform_buy(origin_slack_user_id, destination_slack_user_id, amount, description):
-    """Performs a shop operation between the two users."""
-    try:
-        db_connection = connect(False)
-    except exceptions.DatabaseConnectionError as ex:
-        logger.critical(messages.CONNECT_TO_DB_FAILED.format(ex))
-        raise exceptions.QueryDatabaseError("Could not connect to database: {}".format(ex))
-    else:
-        cursor = db_connection.cursor()
-
-        sql_string_1 = """
-            UPDATE teams
-            SET balance = balance - %s
-            WHERE team_id IN (
-                SELECT team
-                FROM users
-                WHERE slack_id = %s
-            )
-            """
-        data_1 = (
-            amount, origin_slack_user_id
-        )
-
-        sql_string_2 = """
-            UPDATE teams
-            SET balance = balance + %s
-            WHERE team_id IN (
-                SELECT team
-                FROM users
-                WHERE slack_id = %s
-            )
-            """
-        data_2 = (
-            amount, destination_slack_user_id
-        )
-
-        sql_string_3 = """
-            INSERT INTO transactions (
-                origin_user_id,
-                destination_user_id,
-                amount, description
-            )
-            SELECT origin.user_id, destination.user_id, %s, %s
-            FROM (
-                SELECT user_id
-                FROM users
-                WHERE slack_id=%s
-            ) origin
-            CROSS JOIN (
-                SELECT user_id
-                FROM users
-                WHERE slack_id=%s
-            ) destination
-            """
-        data_3 = (
-            amount, description, origin_slack_user_id, destination_slack_user_id
-        )
-
-        try:
-            cursor.execute(sql_string_1, data_1)
-            cursor.execute(sql_string_2, data_2)
-            cursor.execute(sql_string_3, data_3)
-        except Exception as ex:
-            logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
-            cursor.close()
-            db_connection.rollback()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database operations: {}".format(ex))
         else:
             cursor.close()
-            db_connection.commit()
-            db_connection.close()
+            release(db_connection)
+            if result == BuyResults.Success:
+                teambalances.update(origin_team, origin_balance, origin_version)
+                teambalances.update(destination_team, destination_balance, destination_version)
+                recenttransactions.add(tuple(transaction), origin_team, destination_team)
+            return [result, channel_id]
 
 def get_slack_name(slack_user_id):
     """ Gets the slack name of a user."""
@@ -589,16 +821,16 @@ def get_slack_name(slack_user_id):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
         else:
             result = cursor.fetchone()[0]
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             return result
 
-def get_last_transactions(slack_user_id, max_quantity):
-    """ Gets the last transactions of a team."""
+def get_teams():
+    """ Gets the teams list."""
     try:
         db_connection = connect()
     except exceptions.DatabaseConnectionError as ex:
@@ -607,60 +839,25 @@ def get_last_transactions(slack_user_id, max_quantity):
     else:
         cursor = db_connection.cursor()
 
-        # NOTE: Multiple operations, change to having more info on the table?
         sql_string = """
-            SELECT
-                transactions.created_at,
-                u1.slack_id AS origin_slack_id,
-                u1.slack_name AS origin_slack_name,
-                u2.slack_id AS destination_slack_id,
-                u2.slack_name AS destination_slack_name,
-                transactions.amount,
-                transactions.description
-            FROM transactions
-            INNER JOIN users u1
-            ON transactions.origin_user_id = u1.user_id
-            INNER JOIN users u2
-            ON transactions.destination_user_id = u2.user_id
-            WHERE transactions.origin_user_id IN (
-                SELECT users.user_id
-                FROM users
-                WHERE users.team IN (
-                    SELECT team
-                    FROM users
-                    WHERE slack_id=%s
-                )
-            )
-            OR transactions.destination_user_id IN (
-                SELECT user_id
-                FROM users
-                WHERE team IN (
-                    SELECT team
-                    FROM users
-                    WHERE slack_id=%s
-                )
-            )
-            ORDER BY created_at DESC
-            LIMIT %s
+            SELECT team_id, team_name
+            FROM teams
         """
-        data = (
-            slack_user_id, slack_user_id, max_quantity
-        )
         try:
-            cursor.execute(sql_string, data)
+            cursor.execute(sql_string)
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
         else:
             result = [r for r in cursor.fetchall()]
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             return result
 
-def get_teams():
-    """ Gets the teams list."""
+def get_teams_balances():
+    """ Gets the balance of every team, as [team_id, balance, balance_version] lists."""
     try:
         db_connection = connect()
     except exceptions.DatabaseConnectionError as ex:
@@ -670,7 +867,7 @@ def get_teams():
         cursor = db_connection.cursor()
 
         sql_string = """
-            SELECT team_id, team_name
+            SELECT team_id, balance, balance_version
             FROM teams
         """
         try:
@@ -678,12 +875,12 @@ def get_teams():
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
         else:
-            result = [r for r in cursor.fetchall()]
+            result = [list(r) for r in cursor.fetchall()]
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             return result
 
 def get_teams_registration():
@@ -705,12 +902,12 @@ def get_teams_registration():
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
         else:
             result = [r for r in cursor.fetchall()]
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             return result
 
 def get_team_details(team_id):
@@ -736,12 +933,12 @@ def get_team_details(team_id):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
         else:
             result = cursor.fetchone()
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             return result
 
 def get_team_users(team_id):
@@ -767,12 +964,12 @@ def get_team_users(team_id):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
         else:
             result = [r for r in cursor.fetchall()]
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             return result
 
 def get_user_details_from_slack_id(slack_id):
@@ -798,12 +995,12 @@ def get_user_details_from_slack_id(slack_id):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
         else:
             result = cursor.fetchone()
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             return result
 
 def get_user_details_from_user_id(user_id):
@@ -829,104 +1026,24 @@ def get_user_details_from_user_id(user_id):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
         else:
             result = cursor.fetchone()
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             return result
 
-def get_user_permissions(slack_user_id):
-    """ Gets users permissions from its slack user id."""
-    try:
-        db_connection = connect()
-    except exceptions.DatabaseConnectionError as ex:
-        logger.critical(messages.CONNECT_TO_DB_FAILED.format(ex))
-        raise exceptions.QueryDatabaseError("Could not connect to database: {}".format(ex))
-    else:
-        cursor = db_connection.cursor()
-
-        sql_string = """
-            SELECT staff_function
-            FROM permissions
-            WHERE permissions.user_id IN (
-                SELECT users.user_id
-                FROM users
-                WHERE users.slack_id = %s
-            )
-        """
-        data = (
-            slack_user_id,
-        )
-        try:
-            cursor.execute(sql_string, data)
-        except Exception as ex:
-            logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
-            cursor.close()
-            db_connection.close()
-            raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
-        else:
-            if cursor.rowcount > 0:
-                result = cursor.fetchone()[0]
-                cursor.close()
-                db_connection.close()
-                return result
-            else:
-                return None
-
-def get_last_user_transactions(slack_user_id, max_quantity):
-    """ Gets the last transactions of a user."""
-    try:
-        db_connection = connect()
-    except exceptions.DatabaseConnectionError as ex:
-        logger.critical(messages.CONNECT_TO_DB_FAILED.format(ex))
-        raise exceptions.QueryDatabaseError("Could not connect to database: {}".format(ex))
-    else:
-        cursor = db_connection.cursor()
-
-        sql_string = """
-            SELECT
-                transactions.created_at,
-                u1.slack_id AS origin_slack_id,
-                u1.slack_name AS origin_slack_name,
-                u2.slack_id AS destination_slack_id,
-                u2.slack_name AS destination_slack_name,
-                transactions.amount,
-                transactions.description
-            FROM transactions
-            INNER JOIN users u1
-            ON transactions.origin_user_id = u1.user_id
-            INNER JOIN users u2
-            ON transactions.destination_user_id = u2.user_id
-            WHERE transactions.origin_user_id IN (
-                SELECT user_id
-                FROM users
-                WHERE slack_id = %s
-            )
-            OR transactions.destination_user_id IN (
-                SELECT user_id
-                FROM users
-                WHERE slack_id = %s
-            )
-            ORDER BY created_at DESC
-            LIMIT %s
-        """
-        data = (
-            slack_user_id, slack_user_id, max_quantity
-        )
-        try:
-            cursor.execute(sql_string, data)
-        except Exception as ex:
-            logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
-            cursor.close()
-            db_connection.close()
-            raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
-        else:
-            result = [r for r in cursor.fetchall()]
-            cursor.close()
-            db_connection.close()
-            return result
+def get_last_user_transactions(slack_user_id, max_quantity, page_token = None):
+    """ Gets a page of the last transactions of a user. Returns [transactions, next_page_token]."""
+    if not page_token:
+        cached_page = get_cached_page(recenttransactions.get_user_page(slack_user_id, max_quantity))
+        if cached_page is not None:
+            return cached_page
+    return get_transactions_page([
+        ("transactions.origin_user_id = (SELECT user_id FROM users WHERE slack_id = %s)", (slack_user_id,)),
+        ("transactions.destination_user_id = (SELECT user_id FROM users WHERE slack_id = %s)", (slack_user_id,)),
+    ], max_quantity, page_token)
 
 def remove_user_permissions(slack_user_id):
     """ Removes users permissions"""
@@ -954,11 +1071,11 @@ def remove_user_permissions(slack_user_id):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
         else:
             cursor.close()
-            db_connection.close()
+            release(db_connection)
 
 def user_is_staff(slack_user_id):
     """ Returns True if a user is staff/admin, False otherwise"""
@@ -989,12 +1106,12 @@ def user_is_staff(slack_user_id):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
         else:
             result = cursor.fetchone()[0]
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             return result
 
 def update_user_role(slack_user_id, new_role):
@@ -1024,11 +1141,11 @@ def update_user_role(slack_user_id, new_role):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database update query: {}".format(ex))
         else:
             cursor.close()
-            db_connection.close()
+            release(db_connection)
 
 def add_user_to_staff(slack_user_id, new_role):
     """Adds a user to the staff team."""
@@ -1060,11 +1177,11 @@ def add_user_to_staff(slack_user_id, new_role):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database insert query: {}".format(ex))
         else:
             cursor.close()
-            db_connection.close()
+            release(db_connection)
 
 def get_staff_team():
     """Returns all staff members."""
@@ -1091,12 +1208,12 @@ def get_staff_team():
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
         else:
             result = [r for r in cursor.fetchall()]
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             return result
 
 def all_teams_balance_above(quantity):
@@ -1123,12 +1240,12 @@ def all_teams_balance_above(quantity):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
         else:
             result = cursor.fetchone()[0]
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             return not result
 
 def alter_money_to_all_teams(quantity):
@@ -1141,9 +1258,17 @@ def alter_money_to_all_teams(quantity):
     else:
         cursor = db_connection.cursor()
 
+        # Rows are locked in team_id order, as the perform_buy function locks them, so the two can't deadlock
         sql_string = """
             UPDATE teams
-            SET balance = balance + %s
+            SET balance = balance + %s, balance_version = balance_version + 1
+            WHERE team_id IN (
+                SELECT team_id
+                FROM teams
+                ORDER BY team_id
+                FOR UPDATE
+            )
+            RETURNING team_id, balance, balance_version
         """
         data = (
             quantity,
@@ -1153,11 +1278,14 @@ def alter_money_to_all_teams(quantity):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
         else:
+            balances = cursor.fetchall()
             cursor.close()
-            db_connection.close()
+            release(db_connection)
+            for [team_id, balance, balance_version] in balances:
+                teambalances.update(team_id, balance, balance_version)
 
 def save_reward(request, amount, description):
     """Saves a reward given to all teams."""
@@ -1191,11 +1319,11 @@ def save_reward(request, amount, description):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.SaveRequestLogError("Could not execute query: {}".format(ex))
         else:
             cursor.close()
-            db_connection.close()
+            release(db_connection)
 
 def team_balance_above(team_id, quantity):
     """Returns True if a team balance is above quantity."""
@@ -1223,12 +1351,12 @@ def team_balance_above(team_id, quantity):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
         else:
             result = cursor.fetchone()[0]
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             return result
 
 def alter_money_to_team(team_id, quantity):
@@ -1243,8 +1371,9 @@ def alter_money_to_team(team_id, quantity):
 
         sql_string = """
             UPDATE teams
-            SET balance = balance + %s
+            SET balance = balance + %s, balance_version = balance_version + 1
             WHERE team_id = %s
+            RETURNING balance, balance_version
         """
         data = (
             quantity, team_id
@@ -1254,11 +1383,14 @@ def alter_money_to_team(team_id, quantity):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
         else:
+            db_results = cursor.fetchone()
             cursor.close()
-            db_connection.close()
+            release(db_connection)
+            if db_results:
+                teambalances.update(team_id, db_results[0], db_results[1])
 
 def save_reward_team(request, team_id, amount, description):
     """Saves a reward given to a team."""
@@ -1293,14 +1425,41 @@ def save_reward_team(request, team_id, amount, description):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.SaveRequestLogError("Could not execute query: {}".format(ex))
         else:
             cursor.close()
-            db_connection.close()
-
-def get_last_team_transactions(team_id, max_quantity):
-    """ Gets the last transactions of a team."""
+            release(db_connection)
+
+def get_last_team_transactions(team_id, max_quantity, page_token = None):
+    """ Gets a page of the last transactions of a team. Returns [transactions, next_page_token]."""
+    if not page_token:
+        cached_page = get_cached_page(recenttransactions.get_team_page(team_id, max_quantity))
+        if cached_page is not None:
+            return cached_page
+    return get_transactions_page([
+        ("transactions.origin_team = %s", (team_id,)),
+        ("transactions.destination_team = %s", (team_id,)),
+    ], max_quantity, page_token)
+
+def get_last_all_transactions(max_quantity, page_token = None):
+    """ Gets a page of the last transactions of the entire server. Returns [transactions, next_page_token]."""
+    return get_transactions_page([("TRUE", ())], max_quantity, page_token)
+
+def get_cached_page(cached_page):
+    """Turns a [transactions, has_more] page of the recent transactions cache into [transactions, next_page_token].
+    Returns None when the cache can't serve the page."""
+    if cached_page is None:
+        return None
+    [transactions, has_more] = cached_page
+    next_page_token = None
+    if has_more:
+        next_page_token = encode_page_token(transactions[-1][0], transactions[-1][7])
+    return [transactions, next_page_token]
+
+def get_recent_transactions(key_columns, quantity):
+    """Gets the last quantity transactions of every key, where the key of a transaction is each of the
+    key_columns, eg: ("origin_team", "destination_team"). Returns a list of [key, transaction] lists."""
     try:
         db_connection = connect()
     except exceptions.DatabaseConnectionError as ex:
@@ -1309,52 +1468,73 @@ def get_last_team_transactions(team_id, max_quantity):
     else:
         cursor = db_connection.cursor()
 
-        # NOTE: Multiple operations, change to having more info on the table?
-        sql_string = """
+        key_sql = """
             SELECT
-                transactions.created_at,
-                u1.slack_id AS origin_slack_id,
-                u1.slack_name AS origin_slack_name,
-                u2.slack_id AS destination_slack_id,
-                u2.slack_name AS destination_slack_name,
-                transactions.amount,
-                transactions.description
+                {} AS key,
+                created_at,
+                origin_slack_id,
+                origin_slack_name,
+                destination_slack_id,
+                destination_slack_name,
+                amount,
+                description,
+                id
             FROM transactions
-            INNER JOIN users u1
-            ON transactions.origin_user_id = u1.user_id
-            INNER JOIN users u2
-            ON transactions.destination_user_id = u2.user_id
-            WHERE transactions.origin_user_id IN (
-                SELECT users.user_id
-                FROM users
-                WHERE users.team = %s
-            )
-            OR transactions.destination_user_id IN (
-                SELECT users.user_id
-                FROM users
-                WHERE users.team = %s
-            )
-            ORDER BY created_at DESC
-            LIMIT %s
         """
+        sql_string = """
+            SELECT *
+            FROM (
+                SELECT
+                    keyed.*,
+                    ROW_NUMBER() OVER (PARTITION BY key ORDER BY created_at DESC, id DESC) AS position
+                FROM ({}) AS keyed
+                WHERE key IS NOT NULL
+            ) AS ranked
+            WHERE position <= %s
+        """.format(" UNION ALL ".join(key_sql.format(column) for column in key_columns))
         data = (
-            team_id, team_id, max_quantity
+            quantity,
         )
+
         try:
             cursor.execute(sql_string, data)
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
         else:
-            result = [r for r in cursor.fetchall()]
+            result = [[r[0], tuple(r[1:9])] for r in cursor.fetchall()]
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             return result
 
-def get_last_all_transactions(max_quantity):
-    """ Gets the last transactions of the entire server."""
+def encode_page_token(created_at, transaction_id):
+    """Builds the opaque token pointing after a transaction, on a newest first listing."""
+    microseconds = (created_at - PAGE_TOKEN_EPOCH) // timedelta(microseconds=1)
+    key = struct.pack(">q", microseconds) + uuid.UUID(str(transaction_id)).bytes
+    return base64.urlsafe_b64encode(key).decode("ascii").rstrip("=")
+
+def decode_page_token(page_token):
+    """Gets the [created_at, transaction_id] key from a page token. Raises PageTokenError."""
+    try:
+        key = base64.urlsafe_b64decode(page_token + "=" * (-len(page_token) % 4))
+        [microseconds] = struct.unpack(">q", key[:8])
+        return [PAGE_TOKEN_EPOCH + timedelta(microseconds=microseconds), str(uuid.UUID(bytes=key[8:]))]
+    except Exception as ex:
+        raise exceptions.PageTokenError("Invalid page token: {}".format(ex))
+
+def get_transactions_page(conditions, page_size, page_token):
+    """Gets up to page_size transactions matching any of the conditions, newest first, starting after page_token.
+    conditions is a list of (where_sql, data) tuples. Each one is read as its own index range scan
+    on (column, created_at, id), and the scans are merged by time.
+    Returns [transactions, next_page_token], next_page_token is None on the last page."""
+    keyset_sql = ""
+    keyset_data = ()
+    if page_token:
+        keyset_sql = "AND (transactions.created_at, transactions.id) < (%s, %s)"
+        keyset_data = tuple(decode_page_token(page_token))
+
     try:
         db_connection = connect()
     except exceptions.DatabaseConnectionError as ex:
@@ -1363,38 +1543,53 @@ def get_last_all_transactions(max_quantity):
     else:
         cursor = db_connection.cursor()
 
+        # One row more than the page size tells if there is a next page
+        branch_sql = """
+            (
+                SELECT
+                    transactions.created_at,
+                    transactions.origin_slack_id,
+                    transactions.origin_slack_name,
+                    transactions.destination_slack_id,
+                    transactions.destination_slack_name,
+                    transactions.amount,
+                    transactions.description,
+                    transactions.id
+                FROM transactions
+                WHERE {}
+                {}
+                ORDER BY transactions.created_at DESC, transactions.id DESC
+                LIMIT %s
+            )
+        """
         sql_string = """
-            SELECT
-                transactions.created_at,
-                u1.slack_id AS origin_slack_id,
-                u1.slack_name AS origin_slack_name,
-                u2.slack_id AS destination_slack_id,
-                u2.slack_name AS destination_slack_name,
-                transactions.amount,
-                transactions.description
-            FROM transactions
-            INNER JOIN users u1
-            ON transactions.origin_user_id = u1.user_id
-            INNER JOIN users u2
-            ON transactions.destination_user_id = u2.user_id
-            ORDER BY created_at DESC
+            SELECT *
+            FROM ({}) AS page
+            ORDER BY created_at DESC, id DESC
             LIMIT %s
-        """
-        data = (
-            max_quantity,
-        )
+        """.format(" UNION ".join(branch_sql.format(where_sql, keyset_sql) for [where_sql, _] in conditions))
+        data = ()
+        for [_, where_data] in conditions:
+            data += where_data + keyset_data + (page_size + 1,)
+        data += (page_size + 1,)
+
         try:
             cursor.execute(sql_string, data)
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
         else:
-            result = [r for r in cursor.fetchall()]
+            result = cursor.fetchall()
             cursor.close()
-            db_connection.close()
-            return result
+            release(db_connection)
+
+            next_page_token = None
+            if len(result) > page_size:
+                result = result[:page_size]
+                next_page_token = encode_page_token(result[-1][0], result[-1][7])
+            return [result, next_page_token]
 
 def get_all_entry_codes():
     """ Gets all entry codes."""
@@ -1415,12 +1610,12 @@ def get_all_entry_codes():
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
         else:
             result = [r[0] for r in cursor.fetchall()]
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             return result
 
 def get_team_slack_group_id(team_id):
@@ -1446,50 +1641,12 @@ def get_team_slack_group_id(team_id):
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
         else:
             results = cursor.fetchone()[0]
             cursor.close()
-            db_connection.close()
-            return results
-
-def get_team_slack_group_id_from_slack_user_id(slack_user_id):
-    """ Gets the slack group id of a team."""
-    try:
-        db_connection = connect()
-    except exceptions.DatabaseConnectionError as ex:
-        logger.critical(messages.CONNECT_TO_DB_FAILED.format(ex))
-        raise exceptions.QueryDatabaseError("Could not connect to database: {}".format(ex))
-    else:
-        cursor = db_connection.cursor()
-        sql_string = """
-            SELECT slack_channel_id
-            FROM teams
-            WHERE team_id IN (
-                SELECT team
-                FROM users
-                WHERE slack_id = %s
-            )
-        """
-        data = (
-            slack_user_id,
-        )
-        try:
-            cursor.execute(sql_string, data)
-        except Exception as ex:
-            logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
-            cursor.close()
-            db_connection.close()
-            raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
-        else:
-            if cursor.rowcount == 1:
-                results = cursor.fetchone()[0]
-            else:
-                results = None
-
-            cursor.close()
-            db_connection.close()
+            release(db_connection)
             return results
 
 def get_all_teams_slack_group_id():
@@ -1510,10 +1667,55 @@ def get_all_teams_slack_group_id():
         except Exception as ex:
             logger.critical(messages.DB_EXECUTE_FAILED.format(ex))
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             raise exceptions.QueryDatabaseError("Could not perform database select query: {}".format(ex))
         else:
             result = [r[0] for r in cursor.fetchall()]
             cursor.close()
-            db_connection.close()
+            release(db_connection)
             return result
+
+def get_pool_connections():
+    """Connections of the pool by state, for the metrics endpoint."""
+    pool_metrics = get_pool_metrics()
+    return {("in_use",): pool_metrics["in_use"], ("idle",): pool_metrics["idle"]}
+
+def get_pool_events():
+    """Connection pool event counters, for the metrics endpoint."""
+    pool_metrics = get_pool_metrics()
+    return {
+        (event,): pool_metrics[event]
+        for event in ("checkouts", "checkins", "checkout_timeouts", "health_check_failures", "connection_errors")
+    }
+
+metrics.function_metric("database_pool_connections", "Database pool connections, by state.", "gauge", ["state"], get_pool_connections)
+metrics.function_metric("database_pool_events_total", "Database pool events, by event.", "counter", ["event"], get_pool_events)
+metrics.function_metric(
+    "database_pool_checkout_wait_seconds_total", "Time spent waiting for a pool connection.", "counter", [],
+    lambda: {(): get_pool_metrics()["checkout_wait_seconds"]}
+)
+
+query_latency = metrics.histogram("database_call_seconds", "Duration of database module calls, by function.", ["function"])
+query_errors = metrics.counter("database_call_errors_total", "Exceptions raised by database module calls, by function.", ["function"])
+# Time every function reaching the database. Pool handling, the request log writer thread and helpers are left out
+uninstrumented_functions = (
+    "get_connection_pool",
+    "connection_is_healthy",
+    "connect",
+    "release",
+    "connection",
+    "get_pool_metrics",
+    "close_pool",
+    "save_request_log",
+    "start_request_log_writer",
+    "stop_request_log_writer",
+    "request_log_writer",
+    "get_request_log_spill_file",
+    "get_cached_page",
+    "encode_page_token",
+    "decode_page_token",
+    "get_pool_connections",
+    "get_pool_events",
+)
+metrics.instrument_functions(globals(), query_latency, query_errors, exclude = uninstrumented_functions)
+tracing.instrument_functions(globals(), exclude = uninstrumented_functions)
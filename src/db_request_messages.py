@@ -60,3 +60,5 @@ HACKERBOY_TEAM_BALANCE_CHECK_FAILED = "Balance check on team failed."
 TEAM_NOT_FOUND = "Team not found."
 INVALID_UUID = "Invalid UUID4 provided."
 TRANSACTION_BELOW_MINIUM = "Transaction amount is below the minimum defined."
+REQUEST_CONTEXT_LOAD_FAILED = "Failed to load user context on database."
+INVALID_PAGE_TOKEN = "Invalid page token provided."
@@ -1,5 +1,19 @@
 # HTTP port where the server is being served on
 SERVER_PORT = 8888
+# HTTP server backends, chosen with the HTTP_SERVER environment variable. See server.get_server_adapter.
+# All serve from a single process, as the dispatcher queues and caches live in memory
+HTTP_SERVERS = ["wsgiref", "threaded", "waitress"]
+HTTP_SERVER_DEFAULT = "wsgiref"
+# Requests handled at once by the threaded backends. HTTP_SERVER_THREADS environment variable overrides it
+HTTP_SERVER_DEFAULT_THREADS = 8
+# Time an idle keep-alive connection is kept open, by the backends supporting it
+HTTP_SERVER_KEEPALIVE_SECONDS = 120
+
+# Internal port and path of the Prometheus metrics endpoint. METRICS_PORT environment variable overrides the port,
+# 0 disables it
+METRICS_SERVER_PORT = 9100
+METRICS_PATH = "/metrics"
+METRICS_SERVER_THREADS = 2
 
 # Requests must contain all this keys to be valid
 SLACK_REQUEST_DATA_KEYS = [
@@ -41,8 +55,126 @@ SLACK_REQUEST_TIMESTAMP_MAX_GAP_SECONDS = 60.0
 
 TEAM_CHANNEL_PREFIX = "t_"
 
-DATABASE_MAX_LIMIT = 10000
+# Transactions listed per message. Listings longer than this continue on the next page
+TRANSACTION_LIST_PAGE_MAX_LENGTH = 50
 
 DEFAULT_TRANSACTION_LIST_LENGTH = 10
 
-MINIUM_TRANSACTION_AMOUNT = 0.01
\ No newline at end of file
+MINIUM_TRANSACTION_AMOUNT = 0.01
+
+DATABASE_POOL_MIN_CONNECTIONS = 2
+
+# Should be above the number of dispatcher threads, as each one can hold a connection
+DATABASE_POOL_MAX_CONNECTIONS = 10
+
+DATABASE_POOL_CHECKOUT_TIMEOUT_SECONDS = 10.0
+
+# Pooled connections idle for longer than this are pinged before being handed out
+DATABASE_POOL_HEALTH_CHECK_IDLE_SECONDS = 30.0
+
+# Directory, relative to the source root, holding the numbered SQL migrations
+DATABASE_MIGRATIONS_DIRECTORY = "migrations"
+
+# Number of dispatcher threads, if the DISPATCHER_WORKERS environment variable is not set
+DISPATCHER_DEFAULT_WORKERS = 4
+
+# How long to wait for each dispatcher thread to finish on shutdown
+DISPATCHER_STOP_TIMEOUT_SECONDS = 30.0
+
+# Outgoing HTTP requests (Slack API and delayed responses)
+HTTP_CONNECT_TIMEOUT_SECONDS = 3.05
+
+HTTP_READ_TIMEOUT_SECONDS = 10.0
+
+# Number of hosts with a kept-alive connection pool, for hosts without a dedicated pool
+HTTP_POOL_HOSTS = 4
+
+HTTP_POOL_DEFAULT_MAXSIZE = 10
+
+# Dedicated keep-alive pools, by URL prefix. Slash command response_url lives in hooks.slack.com
+HTTP_POOL_MAXSIZE_PER_HOST = {
+    "https://slack.com/": 20,
+    "https://hooks.slack.com/": 10,
+}
+
+# Logs shipped to the Slack logs channel. SLACK_LOG_LEVEL environment variable overrides the level
+SLACK_LOG_DEFAULT_LEVEL = "INFO"
+
+SLACK_LOG_FLUSH_INTERVAL_SECONDS = 2.0
+
+SLACK_LOG_BUFFER_MAX_LINES = 1000
+
+# Slack recommends keeping messages under 4000 characters
+SLACK_LOG_MESSAGE_MAX_LENGTH = 4000
+
+# Slack Web API. Method names are appended to the base URL.
+# SLACK_API_BASE_URL environment variable overrides it, and SLACK_RESPONSE_BASE_URL the host of response URLs,
+# eg: to run against benchmarks/fake_slack.py
+SLACK_API_BASE_URL = "https://slack.com/api/"
+
+# Slack rate limit tiers, in requests per minute per workspace
+SLACK_API_TIER_LIMITS_PER_MINUTE = {
+    1: 1,
+    2: 20,
+    3: 50,
+    4: 100,
+}
+
+SLACK_API_METHOD_TIERS = {
+    "groups.create": 2,
+    "groups.invite": 3,
+    "groups.kick": 3,
+    "channels.create": 2,
+}
+
+# chat.postMessage is limited per channel instead of by tier: about 1 message per second
+SLACK_API_CHANNEL_MESSAGES_PER_SECOND = 1.0
+
+# Messages allowed in a burst on a channel before the per channel rate applies
+SLACK_API_CHANNEL_BURST = 3
+
+# Retries after a 429 response. Each waits Retry-After plus a random jitter
+SLACK_API_MAX_RETRIES = 3
+
+SLACK_API_DEFAULT_RETRY_AFTER_SECONDS = 1.0
+
+SLACK_API_RETRY_JITTER_SECONDS = 1.0
+
+# Channels posted to at the same time when broadcasting a message to every team
+SLACK_FAN_OUT_MAX_WORKERS = 8
+
+# Request logs are inserted in batches, every this many rows or seconds, whichever comes first
+REQUEST_LOG_FLUSH_ROWS = 100
+
+REQUEST_LOG_FLUSH_INTERVAL_SECONDS = 0.5
+
+# Where request logs are appended while the database is unreachable, relative to the source root.
+# REQUEST_LOG_SPILL_FILE environment variable overrides it
+REQUEST_LOG_SPILL_FILE = "request_log_spill.jsonl"
+
+# How long a user role is cached before being read again from the database.
+# Permission changes made by the bot invalidate the cached role immediately
+PERMISSIONS_CACHE_TTL_SECONDS = 300.0
+
+# Transactions of each team and user kept in memory, to list the first page without querying.
+# Should be above DEFAULT_TRANSACTION_LIST_LENGTH
+RECENT_TRANSACTIONS_PER_KEY = 20
+
+# How often the cached team balances are checked against the database.
+# Balances are written through on every update, this only repairs drifts
+TEAM_BALANCES_RECONCILE_INTERVAL_SECONDS = 60.0
+
+# Time an inline reply, answered from the caches by the HTTP handler, may take.
+# Slower replies are discarded and the request is queued, well within Slack 3 seconds limit
+INLINE_REPLY_BUDGET_SECONDS = 0.2
+# How long the teams and staff lists are cached. Changes made by the bot invalidate them immediately
+LISTS_CACHE_TTL_SECONDS = 300.0
+
+# Finished request traces kept in memory, served by the metrics server on TRACES_PATH
+TRACE_BUFFER_SIZE = 200
+# Traces slower than this are logged with their full span tree
+TRACE_SLOW_THRESHOLD_SECONDS = 2.0
+# JSON-lines file finished traces are appended to, relative to the source root.
+# TRACE_FILE environment variable overrides it
+TRACE_FILE = "traces.jsonl"
+TRACES_PATH = "/traces"
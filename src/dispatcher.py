@@ -1,8 +1,9 @@
 import logging as logger
 import database
 import responder
-from threading import Thread
+from threading import Thread, Event, Lock
 from queue import Queue
+from collections import namedtuple
 import definitions
 import common
 import exceptions
@@ -11,89 +12,187 @@ import random
 import string
 import re
 import uuid
+import recenttransactions
 import security
+import listcache
+import metrics
+import teambalances
+import tracing
 import slackapi
 import log_messages as messages
 import os
+import time
 import db_request_messages as db_messages
 
 
 common.setup_logger()
 
-requests_queue = Queue()
+# One queue per dispatcher thread. Requests with the same shard key always go to the same queue.
+# Requests are queued as [request, queued_at, write_key] lists, queued_at from time.monotonic()
+# and write_key the shard key of write commands, None for read only ones.
+requests_queues = []
+dispatcher_threads = []
+# Put on a requests queue to make its dispatcher thread exit
+dispatcher_stop_signal = object()
+# Team of each known user, used to pick the requests shard. Users without team aren't cached.
+# Loaded on start and updated by every request context, so picking a shard never queries the database.
+users_team_ids = {}
+# Set to stop the team balances reconciler thread
+team_balances_reconciler_stop = Event()
+team_balances_reconciler_threads = []
+# Write requests queued or being dispatched, by shard key. Read only commands aren't answered inline
+# while their shard has a write pending, so an inline reply never overtakes a write of the same team.
+pending_writes = {}
+pending_writes_lock = Lock()
+# Slack ids of the users saved in the users table. Users are never deleted, so entries never go stale.
+known_users = set()
+
+# Slack command -> Command. Filled by the @command decorator on each command dispatcher.
+commands = {}
+
+Command = namedtuple("Command", [
+    "name",
+    "handler",
+    "start_message",
+    # Minimum role level needed, None if every user can run it
+    "role",
+    "min_args",
+    # None for no limit
+    "max_args",
+    # Responder function called when the number of args is outside the limits
+    "missing_args_reply",
+    # True if the command changes data, False if it only reads it
+    "writes",
+    # Answers the request from the caches, see dispatch_request_inline. None if always queued
+    "inline_handler",
+])
+
+def command(name, start_message, role = None, min_args = 0, max_args = None, missing_args_reply = None, writes = False, inline_handler = None):
+    """Registers a function as the dispatcher of a command, from its SLACK_COMMANDS key.
+    Only read only commands can have an inline handler."""
+    if writes and inline_handler is not None:
+        raise ValueError("Command {} writes, so it can't be answered inline.".format(name))
+    def register(handler):
+        slack_command = definitions.SLACK_COMMANDS[name]
+        commands[slack_command] = Command(slack_command, handler, start_message, role, min_args, max_args, missing_args_reply, writes, inline_handler)
+        return handler
+    return register
+
+def get_command(slack_command):
+    """Returns the Command registered for a slack command, or None."""
+    return commands.get(slack_command)
+
+def get_command_label(request):
+    """Gets the metrics label of a request command. Unregistered commands share one label."""
+    if request.get("command") in commands:
+        return request["command"]
+    return "unknown"
+
+def get_queues_depth():
+    """Requests waiting on each queue, for the metrics endpoint."""
+    return {(str(idx),): shard_queue.qsize() for idx, shard_queue in enumerate(requests_queues)}
+
+queue_wait = metrics.histogram("dispatcher_queue_wait_seconds", "Time requests wait on the requests queues.")
+dispatch_latency = metrics.histogram("dispatcher_dispatch_seconds", "Time to dispatch a request, by command.", ["command"])
+metrics.function_metric("dispatcher_queue_depth", "Requests waiting on each requests queue.", "gauge", ["queue"], get_queues_depth)
 
 def start():
-    """Starts a request dispatcher thread."""
-    logger.debug(messages.DISPATCHER_STARTING)
-
-    t = Thread(target=general_dispatcher, name="DispatcherThread")
+    """Starts the pool of request dispatcher threads, each one consuming its own queue."""
+    workers_count = get_dispatcher_workers_count()
+    logger.debug(messages.DISPATCHER_STARTING.format(workers_count))
+    load_known_users()
+    load_recent_transactions()
+    reconcile_team_balances()
+    load_lists()
+
+    team_balances_reconciler_stop.clear()
+    t = Thread(target=team_balances_reconciler, name="TeamBalancesReconcilerThread")
     t.setDaemon(True)
     t.start()
+    team_balances_reconciler_threads.append(t)
+
+    for idx in range(workers_count):
+        shard_queue = Queue()
+        requests_queues.append(shard_queue)
+        t = Thread(target=general_dispatcher, args=(shard_queue,), name="DispatcherThread-{}".format(idx))
+        t.setDaemon(True)
+        t.start()
+        dispatcher_threads.append(t)
+
+def stop():
+    """Stops all dispatcher threads, once the requests already queued are dispatched."""
+    logger.debug(messages.DISPATCHER_STOPPING)
+    for shard_queue in requests_queues:
+        shard_queue.put(dispatcher_stop_signal)
+    for t in dispatcher_threads:
+        t.join(definitions.DISPATCHER_STOP_TIMEOUT_SECONDS)
+    del dispatcher_threads[:]
+    del requests_queues[:]
+    team_balances_reconciler_stop.set()
+    for t in team_balances_reconciler_threads:
+        t.join(definitions.DISPATCHER_STOP_TIMEOUT_SECONDS)
+    del team_balances_reconciler_threads[:]
+
+def get_dispatcher_workers_count():
+    """Gets the number of dispatcher threads to run, from the environment."""
+    try:
+        workers_count = int(os.getenv("DISPATCHER_WORKERS", definitions.DISPATCHER_DEFAULT_WORKERS))
+    except ValueError:
+        workers_count = definitions.DISPATCHER_DEFAULT_WORKERS
+    return max(1, workers_count)
 
-def general_dispatcher():
-    """Main dispatcher loop"""
+def general_dispatcher(shard_queue):
+    """Main dispatcher loop, run by every dispatcher thread. Requests are dispatched in order."""
     while True:
-        request = requests_queue.get()
-        logger.debug(messages.DISPATCH_REQUEST_STARTING)
+        item = shard_queue.get()
+        if item is dispatcher_stop_signal:
+            shard_queue.task_done()
+            return
 
-        if request["command"] == definitions.SLACK_COMMANDS["CREATE_TEAM"]:
-            create_team_dispatcher(request)
-        elif request["command"] == definitions.SLACK_COMMANDS["JOIN_TEAM"]:
-            join_team_dispatcher(request)
-        elif request["command"] == definitions.SLACK_COMMANDS["CHECK_BALANCE"]:
-            check_balance_dispatcher(request)
-        elif request["command"] == definitions.SLACK_COMMANDS["BUY"]:
-            buy_dispatcher(request)
-        elif request["command"] == definitions.SLACK_COMMANDS["LIST_TRANSACTIONS"]:
-            list_transactions_dispatcher(request)
-        elif request["command"] == definitions.SLACK_COMMANDS["LIST_TEAMS"]:
-            list_teams_dispatcher(request)
-        elif request["command"] == definitions.SLACK_COMMANDS["LIST_TEAMS_REGISTRATION"]:
-            list_teams_registration_dispatcher(request)
-        elif request["command"] == definitions.SLACK_COMMANDS["TEAM_DETAILS"]:
-            team_details_dispatcher(request)
-        elif request["command"] == definitions.SLACK_COMMANDS["USER_DETAILS"]:
-            user_details_dispatcher(request)
-        elif request["command"] == definitions.SLACK_COMMANDS["LIST_MY_TRANSACTIONS"]:
-            list_my_transactions_dispatcher(request)
-        elif request["command"] == definitions.SLACK_COMMANDS["CHANGE_PERMISSIONS"]:
-            change_permissions_dispatcher(request)
-        elif request["command"] == definitions.SLACK_COMMANDS["LIST_STAFF"]:
-            list_staff_dispatcher(request)
-        elif request["command"] == definitions.SLACK_COMMANDS["HACKERBOY"]:
-            hackerboy_dispatcher(request)
-        elif request["command"] == definitions.SLACK_COMMANDS["HACKERBOY_TEAM"]:
-            hackerboy_team_dispatcher(request)
-        elif request["command"] == definitions.SLACK_COMMANDS["LIST_USER_TRANSACTIONS"]:
-            list_user_transactions_dispatcher(request)
-        elif request["command"] == definitions.SLACK_COMMANDS["LIST_TEAM_TRANSACTIONS"]:
-            list_team_transactions_dispatcher(request)
-        elif request["command"] == definitions.SLACK_COMMANDS["LIST_ALL_TRANSACTIONS"]:
-            list_all_transactions_dispatcher(request)
-        else:
-            logger.error(messages.INVALID_REQUEST_COMMAND_VALUE)
-            if not slackapi.logger_error(messages.INVALID_REQUEST_COMMAND_VALUE):
+        [request, queued_at, write_key] = item
+        started = time.monotonic()
+        queue_wait.observe(started - queued_at)
+        tracing.resume(request.get("trace_id"), "dispatch", queued_at)
+        logger.debug(messages.DISPATCH_REQUEST_STARTING)
+        try:
+            dispatch_request(request)
+        except Exception as ex:
+            # Keep the thread alive for the next requests
+            logger.critical(messages.DISPATCH_REQUEST_FAILED.format(ex))
+            if not slackapi.logger_critical(messages.DISPATCH_REQUEST_FAILED.format(ex)):
                 logger.warn(messages.SLACK_POST_LOG_FAILED)
-            try:
-                database.save_request_log(request, False, db_messages.INVALID_REQUEST_COMMAND_VALUE)
-            except exceptions.SaveRequestLogError:
-                logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-            responder.delayed_reply_default_error(request)
+        dispatch_latency.observe(time.monotonic() - started, (get_command_label(request),))
+        if write_key is not None:
+            remove_pending_write(write_key)
+        tracing.finish_trace(request.get("trace_id"))
         logger.debug(messages.DISPATCH_REQUEST_COMPLETE)
-        requests_queue.task_done()
+        shard_queue.task_done()
 
-def create_team_dispatcher(request):
-    """Dispatcher to create team requests/commands."""
-    logger.info(messages.REQUEST_CREATE_TEAM_START)
-    if not slackapi.logger_info(messages.REQUEST_CREATE_TEAM_START):
+def dispatch_request(request):
+    """Runs the checks declared by the request command and calls its dispatcher."""
+    command_info = commands.get(request["command"])
+    if command_info is None:
+        logger.error(messages.INVALID_REQUEST_COMMAND_VALUE)
+        if not slackapi.logger_error(messages.INVALID_REQUEST_COMMAND_VALUE):
+            logger.warn(messages.SLACK_POST_LOG_FAILED)
+        try:
+            database.save_request_log(request, False, db_messages.INVALID_REQUEST_COMMAND_VALUE)
+        except exceptions.SaveRequestLogError:
+            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
+        responder.delayed_reply_default_error(request)
+        return
+
+    logger.info(command_info.start_message)
+    if not slackapi.logger_info(command_info.start_message):
         logger.warn(messages.SLACK_POST_LOG_FAILED)
 
-    # Check if user is in the users table
-    if not user_exists_or_save_new_user(request):
+    # Load the user, saving it if not in the users table
+    context = load_request_context(request)
+    if context is None:
         return
 
     # Security check
-    if not security.user_has_permission(security.RoleLevels.Admin, request["user_id"]):
+    if command_info.role and not security.role_has_permission(command_info.role, context.role):
         logger.warn(messages.INSUFFICIENT_PERMISSIONS)
         if not slackapi.logger_warning(messages.INSUFFICIENT_PERMISSIONS):
             logger.warn(messages.SLACK_POST_LOG_FAILED)
@@ -104,8 +203,9 @@ def create_team_dispatcher(request):
         responder.unauthorized_error(request)
         return
 
-    team_name = request['text']
-    if not team_name:
+    # Check if args are present
+    args_count = len(get_request_args(request["text"]))
+    if args_count < command_info.min_args or (command_info.max_args is not None and args_count > command_info.max_args):
         logger.warn(messages.MISSING_ARGS)
         if not slackapi.logger_warning(messages.MISSING_ARGS):
             logger.warn(messages.SLACK_POST_LOG_FAILED)
@@ -113,9 +213,60 @@ def create_team_dispatcher(request):
             database.save_request_log(request, False, db_messages.MISSING_ARGS)
         except exceptions.SaveRequestLogError:
             logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.create_team_delayed_reply_missing_args(request)
+        command_info.missing_args_reply(request)
         return
 
+    command_info.handler(request, context)
+
+def dispatch_request_inline(request):
+    """Answers a request from the caches, from the HTTP handler, if its command has an inline handler.
+    Returns the response, or None when the request must be queued: unknown users, cold caches,
+    failed checks or an answer slower than INLINE_REPLY_BUDGET_SECONDS."""
+    command_info = commands.get(request["command"])
+    if command_info is None or command_info.inline_handler is None:
+        return None
+    # New users must be saved first
+    if request["user_id"] not in known_users:
+        return None
+    # Queued writes of the same team must be seen first
+    if has_pending_writes(get_request_shard_key(request)):
+        logger.debug(messages.INLINE_REPLY_PENDING_WRITES.format(command_info.name))
+        return None
+
+    started = time.monotonic()
+    if command_info.role:
+        cached_role = security.get_cached_user_role(request["user_id"])
+        # Unauthorized requests are answered by the queue
+        if cached_role is None or not security.role_has_permission(command_info.role, cached_role[0]):
+            return None
+    args_count = len(get_request_args(request["text"]))
+    if args_count < command_info.min_args or (command_info.max_args is not None and args_count > command_info.max_args):
+        return None
+
+    reply = command_info.inline_handler(request)
+    if reply is None:
+        logger.debug(messages.INLINE_REPLY_CACHE_COLD.format(command_info.name))
+        return None
+    elapsed = time.monotonic() - started
+    if elapsed > definitions.INLINE_REPLY_BUDGET_SECONDS:
+        logger.warn(messages.INLINE_REPLY_OVER_BUDGET.format(command_info.name, elapsed))
+        return None
+
+    [db_message, response_content] = reply
+    logger.info(command_info.start_message)
+    if not slackapi.logger_info(command_info.start_message):
+        logger.warn(messages.SLACK_POST_LOG_FAILED)
+    try:
+        database.save_request_log(request, True, db_message)
+    except exceptions.SaveRequestLogError:
+        logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
+    return responder.immediate_reply(response_content)
+
+@command("CREATE_TEAM", messages.REQUEST_CREATE_TEAM_START, role=security.RoleLevels.Admin, min_args=1, missing_args_reply=responder.create_team_delayed_reply_missing_args, writes=True)
+def create_team_dispatcher(request, context):
+    """Dispatcher to create team requests/commands."""
+    team_name = request['text']
+
     try:
         if database.team_name_available(team_name):
             # Team name available
@@ -159,48 +310,20 @@ def create_team_dispatcher(request):
             logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
         responder.delayed_reply_default_error(request)
 
-def join_team_dispatcher(request):
+@command("JOIN_TEAM", messages.REQUEST_JOIN_TEAM_START, min_args=1, missing_args_reply=responder.join_team_delayed_reply_missing_args, writes=True)
+def join_team_dispatcher(request, context):
     """Dispatcher to join team requests/commands."""
-    logger.info(messages.REQUEST_JOIN_TEAM_START)
-    if not slackapi.logger_info(messages.REQUEST_JOIN_TEAM_START):
-        logger.warn(messages.SLACK_POST_LOG_FAILED)
-
-    # Check if user is in the users table
-    if not user_exists_or_save_new_user(request):
-        return
-
     team_entry_code = request["text"]
-    if not team_entry_code:
-        logger.warn(messages.MISSING_ARGS)
-        if not slackapi.logger_warning(messages.MISSING_ARGS):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.MISSING_ARGS)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.join_team_delayed_reply_missing_args(request)
-        return
 
     # Check if user has a team
-    try:
-        if database.user_has_team(request["user_id"]):
-            # User already on team.
-            logger.warn(messages.USER_ALREADY_ON_TEAM)
-            try:
-                database.save_request_log(request, False, db_messages.USER_ALREADY_ON_TEAM)
-            except exceptions.SaveRequestLogError:
-                logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-            responder.join_team_delayed_reply_already_on_team(request)
-            return
-    except exceptions.QueryDatabaseError as ex:
-        logger.critical(messages.USER_HAS_TEAM_CHECK_FAILED.format(ex))
-        if not slackapi.logger_critical(messages.USER_HAS_TEAM_CHECK_FAILED.format(ex)):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
+    if context.team_id:
+        # User already on team.
+        logger.warn(messages.USER_ALREADY_ON_TEAM)
         try:
-            database.save_request_log(request, False, db_messages.USER_HAS_TEAM_CHECK_FAILED)
+            database.save_request_log(request, False, db_messages.USER_ALREADY_ON_TEAM)
         except exceptions.SaveRequestLogError:
             logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.delayed_reply_default_error(request)
+        responder.join_team_delayed_reply_already_on_team(request)
         return
 
     # Check if provided code is valid
@@ -254,6 +377,8 @@ def join_team_dispatcher(request):
                     logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
                 responder.delayed_reply_default_error(request)
                 return
+            else:
+                listcache.invalidate("teams")
         else:
             # Team was already created, get channel id from the database
             try:
@@ -289,113 +414,55 @@ def join_team_dispatcher(request):
             logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
         responder.delayed_reply_default_error(request)
     else:
+        users_team_ids[request["user_id"]] = str(team_info["id"])
         try:
             database.save_request_log(request, True, db_messages.JOIN_TEAM_SUCCESS)
         except exceptions.SaveRequestLogError:
             logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
         responder.join_team_delayed_reply_success(request, team_info["name"])
 
-def check_balance_dispatcher(request):
-    """Dispatcher to check balance requests/commands."""
-    logger.info(messages.REQUEST_CHECK_BALANCE_START)
-    if not slackapi.logger_info(messages.REQUEST_CHECK_BALANCE_START):
-        logger.warn(messages.SLACK_POST_LOG_FAILED)
-
-    # Check if user is in the users table
-    if not user_exists_or_save_new_user(request):
-        return
+def check_balance_inline(request):
+    """Answers check balance requests from the caches, as [db_message, response_content], or None."""
+    team_id = users_team_ids.get(request["user_id"])
+    if not team_id:
+        return None
+    teams = listcache.get("teams")
+    if teams is None:
+        return None
+    team_names = [team[1] for team in teams if str(team[0]) == team_id]
+    balance = teambalances.get(team_id)
+    if not team_names or balance is None:
+        return None
+    return [db_messages.CHECK_BALANCE_SUCCESS, responder.check_balance_success_content(team_names[0], balance)]
 
+@command("CHECK_BALANCE", messages.REQUEST_CHECK_BALANCE_START, inline_handler=check_balance_inline)
+def check_balance_dispatcher(request, context):
+    """Dispatcher to check balance requests/commands."""
     # First, check if user is in a team
-    try:
-        if not database.user_has_team(request["user_id"]):
-            logger.warn(messages.USER_WITHOUT_TEAM)
-            if not slackapi.logger_warning(messages.USER_WITHOUT_TEAM):
-                logger.warn(messages.SLACK_POST_LOG_FAILED)
-            try:
-                database.save_request_log(request, False, db_messages.USER_WITHOUT_TEAM)
-            except exceptions.SaveRequestLogError:
-                logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-            responder.check_balance_delayed_reply_no_team(request)
-            return
-    except exceptions.QueryDatabaseError as ex:
-        logger.critical(messages.USER_HAS_TEAM_CHECK_FAILED.format(ex))
-        if not slackapi.logger_critical(messages.USER_HAS_TEAM_CHECK_FAILED.format(ex)):
+    if not context.team_id:
+        logger.warn(messages.USER_WITHOUT_TEAM)
+        if not slackapi.logger_warning(messages.USER_WITHOUT_TEAM):
             logger.warn(messages.SLACK_POST_LOG_FAILED)
         try:
-            database.save_request_log(request, False, db_messages.USER_HAS_TEAM_CHECK_FAILED)
+            database.save_request_log(request, False, db_messages.USER_WITHOUT_TEAM)
         except exceptions.SaveRequestLogError:
             logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.delayed_reply_default_error(request)
+        responder.check_balance_delayed_reply_no_team(request)
         return
 
-    # If has a team, get the team balance
     try:
-        [team_name, team_balance] = database.get_users_balance(request["user_id"])
-    except exceptions.QueryDatabaseError as ex:
-        logger.critical(messages.USER_BALANCE_CHECK_FAILED.format(ex))
-        if not slackapi.logger_critical(messages.USER_BALANCE_CHECK_FAILED.format(ex)):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.USER_BALANCE_CHECK_FAILED)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.delayed_reply_default_error(request)
-        return
-    else:
-        try:
-            database.save_request_log(request, True, db_messages.CHECK_BALANCE_SUCCESS)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.check_balance_delayed_reply_success(request, team_name, team_balance)
+        database.save_request_log(request, True, db_messages.CHECK_BALANCE_SUCCESS)
+    except exceptions.SaveRequestLogError:
+        logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
+    teambalances.update(context.team_id, context.balance, context.balance_version)
+    responder.check_balance_delayed_reply_success(request, context.team_name, context.balance)
 
-def buy_dispatcher(request):
+@command("BUY", messages.REQUEST_BUY_START, min_args=3, missing_args_reply=responder.buy_delayed_reply_missing_args, writes=True)
+def buy_dispatcher(request, context):
     """Dispatcher to buy requests/commands."""
-    logger.info(messages.REQUEST_BUY_START)
-    if not slackapi.logger_info(messages.REQUEST_BUY_START):
-        logger.warn(messages.SLACK_POST_LOG_FAILED)
-
-    # Check if user is in the users table
-    if not user_exists_or_save_new_user(request):
-        return
-
-    # Check if args are present
     request_args = get_request_args(request["text"])
-    if not request_args or len(request_args) < 3:
-        logger.warn(messages.MISSING_ARGS)
-        if not slackapi.logger_warning(messages.MISSING_ARGS):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.MISSING_ARGS)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.buy_delayed_reply_missing_args(request)
-        return
 
-    # Check if user is in a team
-    try:
-        if not database.user_has_team(request["user_id"]):
-            # User has no team
-            logger.warn(messages.USER_WITHOUT_TEAM)
-            if not slackapi.logger_warning(messages.USER_WITHOUT_TEAM):
-                logger.warn(messages.SLACK_POST_LOG_FAILED)
-            try:
-                database.save_request_log(request, False, db_messages.USER_WITHOUT_TEAM)
-            except exceptions.SaveRequestLogError:
-                logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-            responder.buy_delayed_reply_no_team(request)
-            return
-    except exceptions.QueryDatabaseError as ex:
-        logger.critical(messages.USER_HAS_TEAM_CHECK_FAILED.format(ex))
-        if not slackapi.logger_critical(messages.USER_HAS_TEAM_CHECK_FAILED.format(ex)):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.USER_HAS_TEAM_CHECK_FAILED)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.delayed_reply_default_error(request)
-        return
-
-    # User has a team
+    # Check if destination user is valid
     destination_slack_user_id = get_slack_user_id_from_arg(request_args[0])
     if not destination_slack_user_id:
         logger.warn(messages.ARG_NO_DESTINATION_USER)
@@ -408,7 +475,7 @@ def buy_dispatcher(request):
         responder.buy_delayed_reply_no_user_arg(request)
         return
 
-    # Check if destination is valid (exists and has a team, not the same user and not in the same team)
+    # Check if destination is not the same user
     if request["user_id"] == destination_slack_user_id:
         logger.info(messages.DESTINATION_ORIGIN_USER_SAME)
         if not slackapi.logger_info(messages.DESTINATION_ORIGIN_USER_SAME):
@@ -420,51 +487,6 @@ def buy_dispatcher(request):
         responder.buy_delayed_reply_destination_himself(request)
         return
 
-    try:
-        if not database.user_has_team(destination_slack_user_id):
-            logger.info(messages.DESTINATION_USER_WITHOUT_TEAM)
-            if not slackapi.logger_info(messages.DESTINATION_USER_WITHOUT_TEAM):
-                logger.warn(messages.SLACK_POST_LOG_FAILED)
-            try:
-                database.save_request_log(request, False, db_messages.DESTINATION_USER_WITHOUT_TEAM)
-            except exceptions.SaveRequestLogError:
-                logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-            responder.buy_delayed_reply_destination_no_team(request)
-            return
-    except exceptions.QueryDatabaseError as ex:
-        logger.critical(messages.USER_HAS_TEAM_CHECK_FAILED.format(ex))
-        if not slackapi.logger_critical(messages.USER_HAS_TEAM_CHECK_FAILED.format(ex)):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.USER_HAS_TEAM_CHECK_FAILED)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.delayed_reply_default_error(request)
-        return
-
-    # Check if origin and destination teams are different
-    try:
-        if not database.users_with_different_team(destination_slack_user_id, request["user_id"]):
-            logger.info(messages.DESTINATION_ORIGIN_SAME_TEAM)
-            if not slackapi.logger_info(messages.DESTINATION_ORIGIN_SAME_TEAM):
-                logger.warn(messages.SLACK_POST_LOG_FAILED)
-            try:
-                database.save_request_log(request, False, db_messages.DESTINATION_ORIGIN_SAME_TEAM)
-            except exceptions.SaveRequestLogError:
-                logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-            responder.buy_delayed_reply_destination_same_team(request)
-            return
-    except exceptions.QueryDatabaseError as ex:
-        logger.critical(messages.DESTINATION_ORIGIN_TEAMS_CHECK_FAILED.format(ex))
-        if not slackapi.logger_critical(messages.DESTINATION_ORIGIN_TEAMS_CHECK_FAILED.format(ex)):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.DESTINATION_ORIGIN_TEAMS_CHECK_FAILED)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.delayed_reply_default_error(request)
-        return
-
     # Parse transaction value
     try:
         transaction_amount = parse_transaction_amount(request_args[1])
@@ -504,33 +526,10 @@ def buy_dispatcher(request):
         responder.delayed_reply_invalid_value(request)
         return
 
-    # Check if user has enough credit.
-    try:
-        if not database.user_has_enough_credit(request["user_id"], transaction_amount):
-            logger.info(messages.NOT_ENOUGH_CREDIT)
-            if not slackapi.logger_info(messages.NOT_ENOUGH_CREDIT):
-                logger.warn(messages.SLACK_POST_LOG_FAILED)
-            try:
-                database.save_request_log(request, False, db_messages.NOT_ENOUGH_CREDIT)
-            except exceptions.SaveRequestLogError:
-                logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-            responder.buy_delayed_reply_not_enough_money(request)
-            return
-    except exceptions.QueryDatabaseError:
-        logger.critical(messages.USER_BALANCE_CHECK_FAILED.format(ex))
-        if not slackapi.logger_critical(messages.USER_BALANCE_CHECK_FAILED.format(ex)):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.USER_BALANCE_CHECK_FAILED)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.delayed_reply_default_error(request)
-        return
-
-    # Update both teams balances and register transaction
+    # Validate both users teams and credit, update both teams balances and register transaction
     try:
         description = parse_transaction_description(request_args[2:])
-        database.perform_buy(request["user_id"], destination_slack_user_id, transaction_amount, description)
+        [buy_result, channel_id] = database.perform_buy(request["user_id"], destination_slack_user_id, transaction_amount, description)
     except exceptions.QueryDatabaseError as ex:
         logger.critical(messages.BUY_OPERATION_FAILED.format(ex))
         if not slackapi.logger_critical(messages.BUY_OPERATION_FAILED.format(ex)):
@@ -541,86 +540,93 @@ def buy_dispatcher(request):
             logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
         responder.delayed_reply_default_error(request)
         return
-    else:
-        # Transaction done.
+
+    if buy_result == database.BuyResults.OriginWithoutTeam:
+        # User has no team
+        logger.warn(messages.USER_WITHOUT_TEAM)
+        if not slackapi.logger_warning(messages.USER_WITHOUT_TEAM):
+            logger.warn(messages.SLACK_POST_LOG_FAILED)
         try:
-            channel_id = database.get_team_slack_group_id_from_slack_user_id(destination_slack_user_id)
-        except exceptions.QueryDatabaseError as ex:
-            logger.error(messages.TEAM_CHANNEL_LOOKUP_FAILED.format(ex))
-            if not slackapi.logger_error(messages.TEAM_CHANNEL_LOOKUP_FAILED.format(ex)):
-                logger.warn(messages.SLACK_POST_LOG_FAILED)
-        else:
-            # Post message on destination team channel, if found
-            if channel_id:
-                if not slackapi.post_transaction_received_message(channel_id, transaction_amount, request["user_id"]):
-                    logger.warn(messages.SLACK_POST_TRANSACTION_FAILED)
-                    if not slackapi.logger_warning(messages.SLACK_POST_TRANSACTION_FAILED):
-                        logger.warn(messages.SLACK_POST_LOG_FAILED)
-            else:
-                logger.warn(messages.TEAM_CHANNEL_NOT_FOUND)
-                if not slackapi.logger_warning(messages.TEAM_CHANNEL_NOT_FOUND):
+            database.save_request_log(request, False, db_messages.USER_WITHOUT_TEAM)
+        except exceptions.SaveRequestLogError:
+            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
+        responder.buy_delayed_reply_no_team(request)
+    elif buy_result == database.BuyResults.DestinationWithoutTeam:
+        logger.info(messages.DESTINATION_USER_WITHOUT_TEAM)
+        if not slackapi.logger_info(messages.DESTINATION_USER_WITHOUT_TEAM):
+            logger.warn(messages.SLACK_POST_LOG_FAILED)
+        try:
+            database.save_request_log(request, False, db_messages.DESTINATION_USER_WITHOUT_TEAM)
+        except exceptions.SaveRequestLogError:
+            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
+        responder.buy_delayed_reply_destination_no_team(request)
+    elif buy_result == database.BuyResults.SameTeam:
+        logger.info(messages.DESTINATION_ORIGIN_SAME_TEAM)
+        if not slackapi.logger_info(messages.DESTINATION_ORIGIN_SAME_TEAM):
+            logger.warn(messages.SLACK_POST_LOG_FAILED)
+        try:
+            database.save_request_log(request, False, db_messages.DESTINATION_ORIGIN_SAME_TEAM)
+        except exceptions.SaveRequestLogError:
+            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
+        responder.buy_delayed_reply_destination_same_team(request)
+    elif buy_result == database.BuyResults.NotEnoughCredit:
+        logger.info(messages.NOT_ENOUGH_CREDIT)
+        if not slackapi.logger_info(messages.NOT_ENOUGH_CREDIT):
+            logger.warn(messages.SLACK_POST_LOG_FAILED)
+        try:
+            database.save_request_log(request, False, db_messages.NOT_ENOUGH_CREDIT)
+        except exceptions.SaveRequestLogError:
+            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
+        responder.buy_delayed_reply_not_enough_money(request)
+    else:
+        # Transaction done. Post message on destination team channel, if found
+        if channel_id:
+            if not slackapi.post_transaction_received_message(channel_id, transaction_amount, request["user_id"]):
+                logger.warn(messages.SLACK_POST_TRANSACTION_FAILED)
+                if not slackapi.logger_warning(messages.SLACK_POST_TRANSACTION_FAILED):
                     logger.warn(messages.SLACK_POST_LOG_FAILED)
+        else:
+            logger.warn(messages.TEAM_CHANNEL_NOT_FOUND)
+            if not slackapi.logger_warning(messages.TEAM_CHANNEL_NOT_FOUND):
+                logger.warn(messages.SLACK_POST_LOG_FAILED)
         try:
             database.save_request_log(request, True, db_messages.BUY_SUCCESS)
         except exceptions.SaveRequestLogError:
             logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
         responder.buy_delayed_reply_success(request, destination_slack_user_id)
 
-def list_transactions_dispatcher(request):
+@command("LIST_TRANSACTIONS", messages.REQUEST_LIST_TRANSACTIONS_START)
+def list_transactions_dispatcher(request, context):
     """Dispatcher to list transactions requests/commands."""
-    logger.info(messages.REQUEST_LIST_TRANSACTIONS_START)
-    if not slackapi.logger_info(messages.REQUEST_LIST_TRANSACTIONS_START):
-        logger.warn(messages.SLACK_POST_LOG_FAILED)
-
-    # Check if user is in the users table
-    if not user_exists_or_save_new_user(request):
-        return
-
-    # Check if quantity is valid
     request_args = get_request_args(request["text"])
-    if not request_args:
-        transactions_quantity = definitions.DEFAULT_TRANSACTION_LIST_LENGTH
-    else:
-        try:
-            transactions_quantity = parse_transaction_quantity(request_args[0])
-        except exceptions.IntegerParseError:
-            transactions_quantity = definitions.DEFAULT_TRANSACTION_LIST_LENGTH
-
-    # Check if value is positive
-    if transactions_quantity <= 0:
-        transactions_quantity = definitions.DEFAULT_TRANSACTION_LIST_LENGTH
-
-    # Check if value is not above the max
-    if transactions_quantity > definitions.DATABASE_MAX_LIMIT:
-        transactions_quantity = definitions.DATABASE_MAX_LIMIT
+    [transactions_quantity, page_token] = get_page_args(request_args, 0)
 
     # Check if user is in a team
-    try:
-        if not database.user_has_team(request["user_id"]):
-            # User has no team
-            logger.warn(messages.USER_WITHOUT_TEAM)
-            if not slackapi.logger_warning(messages.USER_WITHOUT_TEAM):
-                logger.warn(messages.SLACK_POST_LOG_FAILED)
-            try:
-                database.save_request_log(request, False, db_messages.USER_WITHOUT_TEAM)
-            except exceptions.SaveRequestLogError:
-                logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-            responder.list_transactions_delayed_reply_no_team(request)
-            return
-    except exceptions.QueryDatabaseError as ex:
-        logger.critical(messages.USER_HAS_TEAM_CHECK_FAILED.format(ex))
-        if not slackapi.logger_critical(messages.USER_HAS_TEAM_CHECK_FAILED.format(ex)):
+    if not context.team_id:
+        # User has no team
+        logger.warn(messages.USER_WITHOUT_TEAM)
+        if not slackapi.logger_warning(messages.USER_WITHOUT_TEAM):
             logger.warn(messages.SLACK_POST_LOG_FAILED)
         try:
-            database.save_request_log(request, False, db_messages.USER_HAS_TEAM_CHECK_FAILED)
+            database.save_request_log(request, False, db_messages.USER_WITHOUT_TEAM)
         except exceptions.SaveRequestLogError:
             logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.delayed_reply_default_error(request)
+        responder.list_transactions_delayed_reply_no_team(request)
         return
 
     try:
         # Retrieve 'transaction_quantity' transactions from the database.
-        transactions = database.get_last_transactions(request["user_id"], transactions_quantity)
+        [transactions, next_page_token] = database.get_last_team_transactions(context.team_id, transactions_quantity, page_token)
+    except exceptions.PageTokenError as ex:
+        logger.warn(messages.INVALID_PAGE_TOKEN.format(ex))
+        if not slackapi.logger_warning(messages.INVALID_PAGE_TOKEN.format(ex)):
+            logger.warn(messages.SLACK_POST_LOG_FAILED)
+        try:
+            database.save_request_log(request, False, db_messages.INVALID_PAGE_TOKEN)
+        except exceptions.SaveRequestLogError:
+            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
+        responder.delayed_reply_argument_formating_error(request)
+        return
     except exceptions.QueryDatabaseError as ex:
         logger.critical(messages.TRANSACTIONS_LIST_SEARCH_FAILED.format(ex))
         if not slackapi.logger_critical(messages.TRANSACTIONS_LIST_SEARCH_FAILED.format(ex)):
@@ -636,32 +642,20 @@ def list_transactions_dispatcher(request):
             database.save_request_log(request, True, db_messages.LIST_TRANSACTIONS_SUCCESS)
         except exceptions.SaveRequestLogError:
             logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.list_transactions_delayed_reply_success(request, transactions)
-
-def list_teams_dispatcher(request):
-    """Dispatcher to list teams requests/commands."""
-    logger.info(messages.REQUEST_LIST_TEAMS_START)
-    if not slackapi.logger_info(messages.REQUEST_LIST_TEAMS_START):
-        logger.warn(messages.SLACK_POST_LOG_FAILED)
-
-    # Check if user is in the users table
-    if not user_exists_or_save_new_user(request):
-        return
+        responder.list_transactions_delayed_reply_success(request, transactions, get_next_page_command(request, request_args, 0, transactions_quantity, next_page_token))
 
-    # Security check
-    if not security.user_has_permission(security.RoleLevels.Staff, request["user_id"]):
-        logger.warn(messages.INSUFFICIENT_PERMISSIONS)
-        if not slackapi.logger_warning(messages.INSUFFICIENT_PERMISSIONS):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.UNAUTHORIZED)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.unauthorized_error(request)
-        return
+def list_teams_inline(request):
+    """Answers list teams requests from the caches, as [db_message, response_content], or None."""
+    teams = listcache.get("teams")
+    if teams is None:
+        return None
+    return [db_messages.TEAM_LIST_RETRIEVE_SUCCESS, responder.list_teams_success_content(teams)]
 
+@command("LIST_TEAMS", messages.REQUEST_LIST_TEAMS_START, role=security.RoleLevels.Staff, inline_handler=list_teams_inline)
+def list_teams_dispatcher(request, context):
+    """Dispatcher to list teams requests/commands."""
     try:
-        teams = database.get_teams()
+        teams = get_cached_list("teams", database.get_teams)
     except exceptions.QueryDatabaseError as ex:
         logger.critical(messages.TEAM_LIST_RETRIEVE_FAILED.format(ex))
         if not slackapi.logger_critical(messages.TEAM_LIST_RETRIEVE_FAILED.format(ex)):
@@ -679,28 +673,9 @@ def list_teams_dispatcher(request):
             logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
         responder.list_teams_delayed_reply_success(request, teams)
 
-def list_teams_registration_dispatcher(request):
+@command("LIST_TEAMS_REGISTRATION", messages.REQUEST_LIST_REGISTRATION_TEAMS_START, role=security.RoleLevels.Staff)
+def list_teams_registration_dispatcher(request, context):
     """Dispatcher to list teams registrations requests/commands."""
-    logger.info(messages.REQUEST_LIST_REGISTRATION_TEAMS_START)
-    if not slackapi.logger_info(messages.REQUEST_LIST_REGISTRATION_TEAMS_START):
-        logger.warn(messages.SLACK_POST_LOG_FAILED)
-
-    # Check if user is in the users table
-    if not user_exists_or_save_new_user(request):
-        return
-
-    # Security check
-    if not security.user_has_permission(security.RoleLevels.Staff, request["user_id"]):
-        logger.warn(messages.INSUFFICIENT_PERMISSIONS)
-        if not slackapi.logger_warning(messages.INSUFFICIENT_PERMISSIONS):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.UNAUTHORIZED)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.unauthorized_error(request)
-        return
-
     try:
         teams = database.get_teams_registration()
     except exceptions.QueryDatabaseError as ex:
@@ -720,41 +695,11 @@ def list_teams_registration_dispatcher(request):
             logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
         responder.list_teams_registration_delayed_reply_success(request, teams)
 
-def team_details_dispatcher(request):
+@command("TEAM_DETAILS", messages.REQUEST_TEAM_DETAILS_START, role=security.RoleLevels.Staff, min_args=1, missing_args_reply=responder.team_details_delayed_reply_missing_args)
+def team_details_dispatcher(request, context):
     """Dispatcher to team details requests/commands."""
-    logger.info(messages.REQUEST_TEAM_DETAILS_START)
-    if not slackapi.logger_info(messages.REQUEST_TEAM_DETAILS_START):
-        logger.warn(messages.SLACK_POST_LOG_FAILED)
-
-    # Check if user is in the users table
-    if not user_exists_or_save_new_user(request):
-        return
-
-    # Security check
-    if not security.user_has_permission(security.RoleLevels.Staff, request["user_id"]):
-        logger.warn(messages.INSUFFICIENT_PERMISSIONS)
-        if not slackapi.logger_warning(messages.INSUFFICIENT_PERMISSIONS):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.UNAUTHORIZED)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.unauthorized_error(request)
-        return
-
     # Get team_id from args
     team_id = request["text"]
-    if not team_id:
-        # Bad usage
-        logger.warn(messages.MISSING_ARGS)
-        if not slackapi.logger_warning(messages.MISSING_ARGS):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.MISSING_ARGS)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.team_details_delayed_reply_missing_args(request)
-        return
 
     if not check_valid_uuid4(team_id):
         # Invalid team id
@@ -788,41 +733,11 @@ def team_details_dispatcher(request):
             logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
         responder.team_details_delayed_reply_success(request, details, users)
 
-def user_details_dispatcher(request):
+@command("USER_DETAILS", messages.REQUEST_USER_DETAILS_START, role=security.RoleLevels.Staff, min_args=1, max_args=1, missing_args_reply=responder.user_details_delayed_reply_missing_args)
+def user_details_dispatcher(request, context):
     """Dispatcher to user details requests/commands."""
-    logger.info(messages.REQUEST_USER_DETAILS_START)
-    if not slackapi.logger_info(messages.REQUEST_USER_DETAILS_START):
-        logger.warn(messages.SLACK_POST_LOG_FAILED)
-
-    # Check if user is in the users table
-    if not user_exists_or_save_new_user(request):
-        return
-
-    # Security check
-    if not security.user_has_permission(security.RoleLevels.Staff, request["user_id"]):
-        logger.warn(messages.INSUFFICIENT_PERMISSIONS)
-        if not slackapi.logger_warning(messages.INSUFFICIENT_PERMISSIONS):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.UNAUTHORIZED)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.unauthorized_error(request)
-        return
-
     # Get user from args
     args = get_request_args(request["text"])
-    if not args or len(args) > 1:
-        # Bad usage
-        logger.warn(messages.MISSING_ARGS)
-        if not slackapi.logger_warning(messages.MISSING_ARGS):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.MISSING_ARGS)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.user_details_delayed_reply_missing_args(request)
-        return
 
     user = args[0]
     user_id = get_slack_user_id_from_arg(user)
@@ -869,62 +784,39 @@ def user_details_dispatcher(request):
         logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
     responder.user_details_delayed_reply_success(request, user_info)
 
-def list_my_transactions_dispatcher(request):
+@command("LIST_MY_TRANSACTIONS", messages.REQUEST_LIST_MY_TRANSACTIONS_START)
+def list_my_transactions_dispatcher(request, context):
     """Dispatcher to list my transactions requests/commands."""
-    logger.info(messages.REQUEST_LIST_MY_TRANSACTIONS_START)
-    if not slackapi.logger_info(messages.REQUEST_LIST_MY_TRANSACTIONS_START):
-        logger.warn(messages.SLACK_POST_LOG_FAILED)
-
-    # Check if user is in the users table
-    if not user_exists_or_save_new_user(request):
-        return
-
-    # Check if quantity is valid
     request_args = get_request_args(request["text"])
-    if not request_args:
-        transactions_quantity = definitions.DEFAULT_TRANSACTION_LIST_LENGTH
-    else:
-        try:
-            transactions_quantity = parse_transaction_quantity(request_args[0])
-        except exceptions.IntegerParseError:
-            transactions_quantity = definitions.DEFAULT_TRANSACTION_LIST_LENGTH
-
-    # Check if value is positive
-    if transactions_quantity <= 0:
-        transactions_quantity = definitions.DEFAULT_TRANSACTION_LIST_LENGTH
-
-    # Check if value is not above the max
-    if transactions_quantity > definitions.DATABASE_MAX_LIMIT:
-        transactions_quantity = definitions.DATABASE_MAX_LIMIT
+    [transactions_quantity, page_token] = get_page_args(request_args, 0)
 
     # Check if user is in a team
-    try:
-        if not database.user_has_team(request["user_id"]):
-            # User has no team
-            logger.warn(messages.USER_WITHOUT_TEAM)
-            if not slackapi.logger_warning(messages.USER_WITHOUT_TEAM):
-                logger.warn(messages.SLACK_POST_LOG_FAILED)
-            try:
-                database.save_request_log(request, False, db_messages.USER_WITHOUT_TEAM)
-            except exceptions.SaveRequestLogError:
-                logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-            # Same method as before works well
-            responder.list_transactions_delayed_reply_no_team(request)
-            return
-    except exceptions.QueryDatabaseError as ex:
-        logger.critical(messages.USER_HAS_TEAM_CHECK_FAILED.format(ex))
-        if not slackapi.logger_critical(messages.USER_HAS_TEAM_CHECK_FAILED.format(ex)):
+    if not context.team_id:
+        # User has no team
+        logger.warn(messages.USER_WITHOUT_TEAM)
+        if not slackapi.logger_warning(messages.USER_WITHOUT_TEAM):
             logger.warn(messages.SLACK_POST_LOG_FAILED)
         try:
-            database.save_request_log(request, False, db_messages.USER_HAS_TEAM_CHECK_FAILED)
+            database.save_request_log(request, False, db_messages.USER_WITHOUT_TEAM)
         except exceptions.SaveRequestLogError:
             logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.delayed_reply_default_error(request)
+        # Same method as before works well
+        responder.list_transactions_delayed_reply_no_team(request)
         return
 
     try:
         # Retrieve 'transaction_quantity' transactions from the database.
-        transactions = database.get_last_user_transactions(request["user_id"], transactions_quantity)
+        [transactions, next_page_token] = database.get_last_user_transactions(request["user_id"], transactions_quantity, page_token)
+    except exceptions.PageTokenError as ex:
+        logger.warn(messages.INVALID_PAGE_TOKEN.format(ex))
+        if not slackapi.logger_warning(messages.INVALID_PAGE_TOKEN.format(ex)):
+            logger.warn(messages.SLACK_POST_LOG_FAILED)
+        try:
+            database.save_request_log(request, False, db_messages.INVALID_PAGE_TOKEN)
+        except exceptions.SaveRequestLogError:
+            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
+        responder.delayed_reply_argument_formating_error(request)
+        return
     except exceptions.QueryDatabaseError as ex:
         logger.critical(messages.TRANSACTIONS_LIST_SEARCH_FAILED.format(ex))
         if not slackapi.logger_critical(messages.TRANSACTIONS_LIST_SEARCH_FAILED.format(ex)):
@@ -940,43 +832,12 @@ def list_my_transactions_dispatcher(request):
             database.save_request_log(request, True, db_messages.LIST_TRANSACTIONS_SUCCESS)
         except exceptions.SaveRequestLogError:
             logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.list_user_transactions_delayed_reply_success(request, transactions)
+        responder.list_user_transactions_delayed_reply_success(request, transactions, get_next_page_command(request, request_args, 0, transactions_quantity, next_page_token))
 
-def change_permissions_dispatcher(request):
+@command("CHANGE_PERMISSIONS", messages.REQUEST_CHANGE_PERMISSIONS_START, role=security.RoleLevels.Admin, min_args=2, max_args=2, missing_args_reply=responder.change_permission_delayed_reply_missing_args, writes=True)
+def change_permissions_dispatcher(request, context):
     """Dispatcher to change permissions requests/commands."""
-    logger.info(messages.REQUEST_CHANGE_PERMISSIONS_START)
-    if not slackapi.logger_info(messages.REQUEST_CHANGE_PERMISSIONS_START):
-        logger.warn(messages.SLACK_POST_LOG_FAILED)
-
-    # Check if user is in the users table
-    if not user_exists_or_save_new_user(request):
-        return
-
-    # Security check
-    if not security.user_has_permission(security.RoleLevels.Admin, request["user_id"]):
-        logger.warn(messages.INSUFFICIENT_PERMISSIONS)
-        if not slackapi.logger_warning(messages.INSUFFICIENT_PERMISSIONS):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.UNAUTHORIZED)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.unauthorized_error(request)
-        return
-
-    # Check if args are present
     request_args = get_request_args(request["text"])
-    if not request_args or len(request_args) != 2:
-        # Bad usage
-        logger.warn(messages.MISSING_ARGS)
-        if not slackapi.logger_warning(messages.MISSING_ARGS):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.MISSING_ARGS)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.change_permission_delayed_reply_missing_args(request)
-        return
 
     slack_user_id = get_slack_user_id_from_arg(request_args[0])
     if not slack_user_id:
@@ -1018,6 +879,8 @@ def change_permissions_dispatcher(request):
             responder.delayed_reply_default_error(request)
             return
         else:
+            security.invalidate_user_permissions(slack_user_id)
+            listcache.invalidate("staff")
             try:
                 database.save_request_log(request, True, db_messages.UPDATE_USER_PERMISSONS_SUCCESS)
             except exceptions.SaveRequestLogError:
@@ -1047,6 +910,8 @@ def change_permissions_dispatcher(request):
                     responder.delayed_reply_default_error(request)
                     return
                 else:
+                    security.invalidate_user_permissions(slack_user_id)
+                    listcache.invalidate("staff")
                     try:
                         database.save_request_log(request, True, db_messages.UPDATE_USER_PERMISSONS_SUCCESS)
                     except exceptions.SaveRequestLogError:
@@ -1067,6 +932,8 @@ def change_permissions_dispatcher(request):
                     responder.delayed_reply_default_error(request)
                     return
                 else:
+                    security.invalidate_user_permissions(slack_user_id)
+                    listcache.invalidate("staff")
                     try:
                         database.save_request_log(request, True, db_messages.UPDATE_USER_PERMISSONS_SUCCESS)
                     except exceptions.SaveRequestLogError:
@@ -1090,30 +957,18 @@ def change_permissions_dispatcher(request):
             responder.delayed_reply_default_error(request)
             return
 
-def list_staff_dispatcher(request):
-    """Dispatcher to list staff requests/commands."""
-    logger.info(messages.REQUEST_LIST_STAFF_START)
-    if not slackapi.logger_info(messages.REQUEST_LIST_STAFF_START):
-        logger.warn(messages.SLACK_POST_LOG_FAILED)
-
-    # Check if user is in the users table
-    if not user_exists_or_save_new_user(request):
-        return
-
-    # Security check
-    if not security.user_has_permission(security.RoleLevels.Staff, request["user_id"]):
-        logger.warn(messages.INSUFFICIENT_PERMISSIONS)
-        if not slackapi.logger_warning(messages.INSUFFICIENT_PERMISSIONS):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.UNAUTHORIZED)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.unauthorized_error(request)
-        return
+def list_staff_inline(request):
+    """Answers list staff requests from the caches, as [db_message, response_content], or None."""
+    staff_team = listcache.get("staff")
+    if staff_team is None:
+        return None
+    return [db_messages.STAFF_TEAM_RETRIEVE_SUCCESS, responder.list_staff_success_content(staff_team)]
 
+@command("LIST_STAFF", messages.REQUEST_LIST_STAFF_START, role=security.RoleLevels.Staff, inline_handler=list_staff_inline)
+def list_staff_dispatcher(request, context):
+    """Dispatcher to list staff requests/commands."""
     try:
-        staff_team = database.get_staff_team()
+        staff_team = get_cached_list("staff", database.get_staff_team)
     except exceptions.QueryDatabaseError as ex:
             logger.critical(messages.STAFF_TEAM_RETRIEVE_FAILED.format(ex))
             if not slackapi.logger_critical(messages.STAFF_TEAM_RETRIEVE_FAILED.format(ex)):
@@ -1131,41 +986,10 @@ def list_staff_dispatcher(request):
             logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
         responder.list_staff_delayed_reply_success(request, staff_team)
 
-def hackerboy_dispatcher(request):
+@command("HACKERBOY", messages.REQUEST_HACKERBOY_START, role=security.RoleLevels.Admin, min_args=2, missing_args_reply=responder.hackerboy_delayed_reply_missing_args, writes=True)
+def hackerboy_dispatcher(request, context):
     """Dispatcher to hackerboy requests/commands."""
-    logger.info(messages.REQUEST_HACKERBOY_START)
-    if not slackapi.logger_info(messages.REQUEST_HACKERBOY_START):
-        logger.warn(messages.SLACK_POST_LOG_FAILED)
-
-    # Check if user is in the users table
-    if not user_exists_or_save_new_user(request):
-        return
-
-    # Security check
-    if not security.user_has_permission(security.RoleLevels.Admin, request["user_id"]):
-        logger.warn(messages.INSUFFICIENT_PERMISSIONS)
-        if not slackapi.logger_warning(messages.INSUFFICIENT_PERMISSIONS):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.UNAUTHORIZED)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.unauthorized_error(request)
-        return
-
-    # Check if args are present
     request_args = get_request_args(request["text"])
-    if not request_args or len(request_args) < 2:
-        # Bad usage
-        logger.warn(messages.MISSING_ARGS)
-        if not slackapi.logger_warning(messages.MISSING_ARGS):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.MISSING_ARGS)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.hackerboy_delayed_reply_missing_args(request)
-        return
 
     # Parse value to change
     try:
@@ -1229,9 +1053,12 @@ def hackerboy_dispatcher(request):
                 if not slackapi.logger_warning(messages.GET_TEAMS_CHANNEL_ID_FAILED.format(ex)):
                     logger.warn(messages.SLACK_POST_LOG_FAILED)
             else:
-                if not slackapi.post_hackerboy_action_general(teams_channels_id, change_amount, description):
-                    logger.warn(messages.SLACK_POST_HACKERBOY_FAILED)
-                    if not slackapi.logger_warning(messages.SLACK_POST_HACKERBOY_FAILED):
+                post_results = slackapi.post_hackerboy_action_general(teams_channels_id, change_amount, description)
+                failed_channels = [channel_id for [channel_id, success] in post_results if not success]
+                if failed_channels:
+                    failed_message = messages.SLACK_POST_HACKERBOY_FAILED.format(len(failed_channels), len(post_results), ", ".join(map(str, failed_channels)))
+                    logger.warn(failed_message)
+                    if not slackapi.logger_warning(failed_message):
                         logger.warn(messages.SLACK_POST_LOG_FAILED)
             responder.hackerboy_delayed_reply_success(request, change_amount)
             return
@@ -1274,9 +1101,12 @@ def hackerboy_dispatcher(request):
                         if not slackapi.logger_warning(messages.GET_TEAMS_CHANNEL_ID_FAILED.format(ex)):
                             logger.warn(messages.SLACK_POST_LOG_FAILED)
                     else:
-                        if not slackapi.post_hackerboy_action_general(teams_channels_id, change_amount, description):
-                            logger.warn(messages.SLACK_POST_HACKERBOY_FAILED)
-                            if not slackapi.logger_warning(messages.SLACK_POST_HACKERBOY_FAILED):
+                        post_results = slackapi.post_hackerboy_action_general(teams_channels_id, change_amount, description)
+                        failed_channels = [channel_id for [channel_id, success] in post_results if not success]
+                        if failed_channels:
+                            failed_message = messages.SLACK_POST_HACKERBOY_FAILED.format(len(failed_channels), len(post_results), ", ".join(map(str, failed_channels)))
+                            logger.warn(failed_message)
+                            if not slackapi.logger_warning(failed_message):
                                 logger.warn(messages.SLACK_POST_LOG_FAILED)
                     responder.hackerboy_delayed_reply_success(request, change_amount)
                     return
@@ -1317,43 +1147,11 @@ def hackerboy_dispatcher(request):
                 logger.warn(messages.SLACK_POST_LOG_FAILED)
         responder.hackerboy_delayed_reply_success(request, change_amount)
 
-def hackerboy_team_dispatcher(request):
+@command("HACKERBOY_TEAM", messages.REQUEST_HACKERBOY_TEAM_START, role=security.RoleLevels.Admin, min_args=3, missing_args_reply=responder.hackerboy_team_delayed_reply_missing_args, writes=True)
+def hackerboy_team_dispatcher(request, context):
     """Dispatcher to hackerboy team requests/commands."""
-    logger.info(messages.REQUEST_HACKERBOY_TEAM_START)
-    if not slackapi.logger_info(messages.REQUEST_HACKERBOY_TEAM_START):
-        logger.warn(messages.SLACK_POST_LOG_FAILED)
-
-    # Check if user is in the users table
-    if not user_exists_or_save_new_user(request):
-        return
-
-    # Security check
-    if not security.user_has_permission(security.RoleLevels.Admin, request["user_id"]):
-        logger.warn(messages.INSUFFICIENT_PERMISSIONS)
-        if not slackapi.logger_warning(messages.INSUFFICIENT_PERMISSIONS):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.UNAUTHORIZED)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.unauthorized_error(request)
-        return
-
-    # Check if args are present
     request_args = get_request_args(request["text"])
 
-    if not request_args or len(request_args) < 3:
-        # Bad usage
-        logger.warn(messages.MISSING_ARGS)
-        if not slackapi.logger_warning(messages.MISSING_ARGS):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.MISSING_ARGS)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.hackerboy_team_delayed_reply_missing_args(request)
-        return
-
     # Check if valid team uuid
     team_id = request_args[0]
     if not check_valid_uuid4(team_id):
@@ -1516,41 +1314,10 @@ def hackerboy_team_dispatcher(request):
                 logger.warn(messages.SLACK_POST_LOG_FAILED)
         responder.hackerboy_team_delayed_reply_success(request, change_amount)
 
-def list_user_transactions_dispatcher(request):
+@command("LIST_USER_TRANSACTIONS", messages.REQUEST_LIST_USER_TRANSACTIONS_START, role=security.RoleLevels.Admin, min_args=2, missing_args_reply=responder.list_user_transactions_delayed_reply_missing_args)
+def list_user_transactions_dispatcher(request, context):
     """Dispatcher to list an user transactions requests/commands."""
-    logger.info(messages.REQUEST_LIST_USER_TRANSACTIONS_START)
-    if not slackapi.logger_info(messages.REQUEST_LIST_USER_TRANSACTIONS_START):
-        logger.warn(messages.SLACK_POST_LOG_FAILED)
-
-    # Check if user is in the users table
-    if not user_exists_or_save_new_user(request):
-        return
-
-    # Security check
-    if not security.user_has_permission(security.RoleLevels.Admin, request["user_id"]):
-        logger.warn(messages.INSUFFICIENT_PERMISSIONS)
-        if not slackapi.logger_warning(messages.INSUFFICIENT_PERMISSIONS):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.UNAUTHORIZED)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.unauthorized_error(request)
-        return
-
-    # Check if arguments are good
     request_args = get_request_args(request["text"])
-    if not request_args or len(request_args) < 2:
-        # Bad usage
-        logger.warn(messages.MISSING_ARGS)
-        if not slackapi.logger_warning(messages.MISSING_ARGS):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.MISSING_ARGS)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.list_user_transactions_delayed_reply_missing_args(request)
-        return
 
     slack_user_id = get_slack_user_id_from_arg(request_args[0])
     if not slack_user_id:
@@ -1565,17 +1332,7 @@ def list_user_transactions_dispatcher(request):
         responder.list_user_transactions_delayed_reply_missing_args(request)
         return
 
-    try:
-        transactions_quantity = parse_transaction_quantity(request_args[1])
-    except exceptions.IntegerParseError as ex:
-        transactions_quantity = definitions.DEFAULT_TRANSACTION_LIST_LENGTH
-
-    if transactions_quantity <= 0:
-        transactions_quantity = definitions.DEFAULT_TRANSACTION_LIST_LENGTH
-
-   # Check if value is not above the max
-    if transactions_quantity > definitions.DATABASE_MAX_LIMIT:
-        transactions_quantity = definitions.DATABASE_MAX_LIMIT
+    [transactions_quantity, page_token] = get_page_args(request_args, 1)
 
     # Check if user is in a team
     try:
@@ -1602,7 +1359,17 @@ def list_user_transactions_dispatcher(request):
         return
     try:
         # Retrieving 'transactions_quantity' transactions from the database
-        transactions = database.get_last_user_transactions(slack_user_id, transactions_quantity)
+        [transactions, next_page_token] = database.get_last_user_transactions(slack_user_id, transactions_quantity, page_token)
+    except exceptions.PageTokenError as ex:
+        logger.warn(messages.INVALID_PAGE_TOKEN.format(ex))
+        if not slackapi.logger_warning(messages.INVALID_PAGE_TOKEN.format(ex)):
+            logger.warn(messages.SLACK_POST_LOG_FAILED)
+        try:
+            database.save_request_log(request, False, db_messages.INVALID_PAGE_TOKEN)
+        except exceptions.SaveRequestLogError:
+            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
+        responder.delayed_reply_argument_formating_error(request)
+        return
     except exceptions.QueryDatabaseError as ex:
         logger.critical(messages.TRANSACTIONS_LIST_SEARCH_FAILED.format(ex))
         if not slackapi.logger_critical(messages.TRANSACTIONS_LIST_SEARCH_FAILED.format(ex)):
@@ -1618,43 +1385,12 @@ def list_user_transactions_dispatcher(request):
             database.save_request_log(request, True, db_messages.LIST_TRANSACTIONS_SUCCESS)
         except exceptions.SaveRequestLogError:
             logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.list_to_admin_user_transactions_delayed_reply_success(request, transactions)
+        responder.list_to_admin_user_transactions_delayed_reply_success(request, transactions, get_next_page_command(request, request_args, 1, transactions_quantity, next_page_token))
 
-def list_team_transactions_dispatcher(request):
+@command("LIST_TEAM_TRANSACTIONS", messages.REQUEST_LIST_TEAM_TRANSACTIONS_START, role=security.RoleLevels.Admin, min_args=2, missing_args_reply=responder.list_team_transactions_delayed_reply_missing_args)
+def list_team_transactions_dispatcher(request, context):
     """Dispatcher to list a team transactions requests/commands."""
-    logger.info(messages.REQUEST_LIST_TEAM_TRANSACTIONS_START)
-    if not slackapi.logger_info(messages.REQUEST_LIST_TEAM_TRANSACTIONS_START):
-        logger.warn(messages.SLACK_POST_LOG_FAILED)
-
-    # Check if user is in the users table
-    if not user_exists_or_save_new_user(request):
-        return
-
-    # Security check
-    if not security.user_has_permission(security.RoleLevels.Admin, request["user_id"]):
-        logger.warn(messages.INSUFFICIENT_PERMISSIONS)
-        if not slackapi.logger_warning(messages.INSUFFICIENT_PERMISSIONS):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.UNAUTHORIZED)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.unauthorized_error(request)
-        return
-
-    # Check if arguments are good
     request_args = get_request_args(request["text"])
-    if not request_args or len(request_args) < 2:
-        # Bad usage
-        logger.warn(messages.MISSING_ARGS)
-        if not slackapi.logger_warning(messages.MISSING_ARGS):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.MISSING_ARGS)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.list_team_transactions_delayed_reply_missing_args(request)
-        return
 
     team_id = request_args[0]
     if not check_valid_uuid4(team_id):
@@ -1669,17 +1405,7 @@ def list_team_transactions_dispatcher(request):
         responder.delayed_reply_argument_formating_error(request)
         return
 
-    try:
-        transactions_quantity = parse_transaction_quantity(request_args[1])
-    except exceptions.IntegerParseError as ex:
-        transactions_quantity = definitions.DEFAULT_TRANSACTION_LIST_LENGTH
-
-    if transactions_quantity <= 0:
-        transactions_quantity = definitions.DEFAULT_TRANSACTION_LIST_LENGTH
-
-   # Check if value is not above the max
-    if transactions_quantity > definitions.DATABASE_MAX_LIMIT:
-        transactions_quantity = definitions.DATABASE_MAX_LIMIT
+    [transactions_quantity, page_token] = get_page_args(request_args, 1)
 
     # Check if team exists
     try:
@@ -1706,7 +1432,17 @@ def list_team_transactions_dispatcher(request):
 
     try:
         # Retrieving from the database
-        transactions = database.get_last_team_transactions(team_id, transactions_quantity)
+        [transactions, next_page_token] = database.get_last_team_transactions(team_id, transactions_quantity, page_token)
+    except exceptions.PageTokenError as ex:
+        logger.warn(messages.INVALID_PAGE_TOKEN.format(ex))
+        if not slackapi.logger_warning(messages.INVALID_PAGE_TOKEN.format(ex)):
+            logger.warn(messages.SLACK_POST_LOG_FAILED)
+        try:
+            database.save_request_log(request, False, db_messages.INVALID_PAGE_TOKEN)
+        except exceptions.SaveRequestLogError:
+            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
+        responder.delayed_reply_argument_formating_error(request)
+        return
     except exceptions.QueryDatabaseError as ex:
         logger.critical(messages.TRANSACTIONS_LIST_SEARCH_FAILED.format(ex))
         if not slackapi.logger_critical(messages.TRANSACTIONS_LIST_SEARCH_FAILED.format(ex)):
@@ -1722,59 +1458,28 @@ def list_team_transactions_dispatcher(request):
             database.save_request_log(request, True, db_messages.LIST_TRANSACTIONS_SUCCESS)
         except exceptions.SaveRequestLogError:
             logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.list_team_transactions_delayed_reply_success(request, transactions)
+        responder.list_team_transactions_delayed_reply_success(request, transactions, get_next_page_command(request, request_args, 1, transactions_quantity, next_page_token))
 
-def list_all_transactions_dispatcher(request):
+@command("LIST_ALL_TRANSACTIONS", messages.REQUEST_LIST_ALL_TRANSACTIONS_START, role=security.RoleLevels.Admin, min_args=1, missing_args_reply=responder.list_all_transactions_delayed_reply_missing_args)
+def list_all_transactions_dispatcher(request, context):
     """Dispatcher to list all transactions requests/commands."""
-    logger.info(messages.REQUEST_LIST_ALL_TRANSACTIONS_START)
-    if not slackapi.logger_info(messages.REQUEST_LIST_ALL_TRANSACTIONS_START):
-        logger.warn(messages.SLACK_POST_LOG_FAILED)
-
-    # Check if user is in the users table
-    if not user_exists_or_save_new_user(request):
-        return
+    request_args = get_request_args(request["text"])
 
-    # Security check
-    if not security.user_has_permission(security.RoleLevels.Admin, request["user_id"]):
-        logger.warn(messages.INSUFFICIENT_PERMISSIONS)
-        if not slackapi.logger_warning(messages.INSUFFICIENT_PERMISSIONS):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
-        try:
-            database.save_request_log(request, False, db_messages.UNAUTHORIZED)
-        except exceptions.SaveRequestLogError:
-            logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.unauthorized_error(request)
-        return
+    [transactions_quantity, page_token] = get_page_args(request_args, 0)
 
-    # Check if arguments are good
-    request_args = get_request_args(request["text"])
-    if not request_args or len(request_args) < 1:
-        # Bad usage
-        logger.warn(messages.MISSING_ARGS)
-        if not slackapi.logger_warning(messages.MISSING_ARGS):
+    try:
+        # Retrieve from the database
+        [transactions, next_page_token] = database.get_last_all_transactions(transactions_quantity, page_token)
+    except exceptions.PageTokenError as ex:
+        logger.warn(messages.INVALID_PAGE_TOKEN.format(ex))
+        if not slackapi.logger_warning(messages.INVALID_PAGE_TOKEN.format(ex)):
             logger.warn(messages.SLACK_POST_LOG_FAILED)
         try:
-            database.save_request_log(request, False, db_messages.MISSING_ARGS)
+            database.save_request_log(request, False, db_messages.INVALID_PAGE_TOKEN)
         except exceptions.SaveRequestLogError:
             logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.list_all_transactions_delayed_reply_missing_args(request)
+        responder.delayed_reply_argument_formating_error(request)
         return
-
-    try:
-        transactions_quantity = parse_transaction_quantity(request_args[0])
-    except exceptions.IntegerParseError as ex:
-        transactions_quantity = definitions.DEFAULT_TRANSACTION_LIST_LENGTH
-
-    if transactions_quantity <= 0:
-        transactions_quantity = definitions.DEFAULT_TRANSACTION_LIST_LENGTH
-
-   # Check if value is not above the max
-    if transactions_quantity > definitions.DATABASE_MAX_LIMIT:
-        transactions_quantity = definitions.DATABASE_MAX_LIMIT
-
-    try:
-        # Retrieve from the database
-        transactions = database.get_last_all_transactions(transactions_quantity)
     except exceptions.QueryDatabaseError as ex:
         logger.critical(messages.TRANSACTIONS_LIST_SEARCH_FAILED.format(ex))
         if not slackapi.logger_critical(messages.TRANSACTIONS_LIST_SEARCH_FAILED.format(ex)):
@@ -1790,17 +1495,60 @@ def list_all_transactions_dispatcher(request):
             database.save_request_log(request, True, db_messages.LIST_TRANSACTIONS_SUCCESS)
         except exceptions.SaveRequestLogError:
             logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        responder.list_all_transactions_delayed_reply_success(request, transactions)
+        responder.list_all_transactions_delayed_reply_success(request, transactions, get_next_page_command(request, request_args, 0, transactions_quantity, next_page_token))
 
 def add_request_to_queue(request):
-    """ Add a request to the requests queue."""
+    """ Add a request to the requests queue of its shard.
+    Requests issued by the members of a team are dispatched in order, different teams in parallel.
+    Effects on other teams, like the credit of a buy, aren't ordered with the requests of those teams:
+    balance updates rely on the database row locks instead."""
+    write_key = None
     try:
-        requests_queue.put(request, block=False)
+        shard_key = get_request_shard_key(request)
+        shard_queue = requests_queues[hash(shard_key) % len(requests_queues)]
+        command_info = commands.get(request["command"])
+        if command_info is not None and command_info.writes:
+            write_key = shard_key
+            add_pending_write(write_key)
+        shard_queue.put([request, time.monotonic(), write_key], block=False)
     except Exception:
+        if write_key is not None:
+            remove_pending_write(write_key)
         return False
     else:
         return True
 
+def add_pending_write(shard_key):
+    with pending_writes_lock:
+        pending_writes[shard_key] = pending_writes.get(shard_key, 0) + 1
+
+def remove_pending_write(shard_key):
+    with pending_writes_lock:
+        count = pending_writes.get(shard_key, 0) - 1
+        if count > 0:
+            pending_writes[shard_key] = count
+        else:
+            pending_writes.pop(shard_key, None)
+
+def has_pending_writes(shard_key):
+    """Checks if a shard has write requests queued or being dispatched."""
+    with pending_writes_lock:
+        return shard_key in pending_writes
+
+def get_request_shard_key(request):
+    """ Gets the key ordering a request: the team it acts on, or the issuing user while he has no team."""
+    if request["command"] == definitions.SLACK_COMMANDS["HACKERBOY_TEAM"]:
+        # Acts on the team given as argument, not on the admin team
+        request_args = get_request_args(request["text"])
+        if request_args and check_valid_uuid4(request_args[0]):
+            return str(uuid.UUID(request_args[0]))
+
+    # Called from the HTTP handler, so only the cache is used
+    team_id = users_team_ids.get(request["user_id"])
+    if team_id:
+        return team_id
+    return request["user_id"]
+
 def generate_team_entry_code():
     """ Generates and returns a team entry code."""
     # Exceptions will be caught by caller function
@@ -1840,6 +1588,29 @@ def parse_transaction_quantity(amount_str):
     except Exception as ex:
         raise exceptions.IntegerParseError("Failed to convert string to int: {}".format(ex))
 
+def get_page_args(request_args, quantity_idx):
+    """Gets [quantity, page_token] from the args of the transaction listing commands.
+    Missing or invalid quantities fall back to the default, quantities above the page size are capped."""
+    try:
+        transactions_quantity = parse_transaction_quantity(request_args[quantity_idx])
+    except (IndexError, exceptions.IntegerParseError):
+        transactions_quantity = definitions.DEFAULT_TRANSACTION_LIST_LENGTH
+
+    if transactions_quantity <= 0:
+        transactions_quantity = definitions.DEFAULT_TRANSACTION_LIST_LENGTH
+
+    if transactions_quantity > definitions.TRANSACTION_LIST_PAGE_MAX_LENGTH:
+        transactions_quantity = definitions.TRANSACTION_LIST_PAGE_MAX_LENGTH
+
+    page_token = request_args[quantity_idx + 1] if len(request_args) > quantity_idx + 1 else None
+    return [transactions_quantity, page_token]
+
+def get_next_page_command(request, request_args, quantity_idx, transactions_quantity, next_page_token):
+    """Builds the command that lists the next page, or None if there is no next page."""
+    if not next_page_token:
+        return None
+    return " ".join([request["command"]] + request_args[:quantity_idx] + [str(transactions_quantity), next_page_token])
+
 def parse_transaction_description(description_list):
     return " ".join(description_list)
 
@@ -1851,32 +1622,86 @@ def check_valid_uuid4(arg):
     else:
         return True
 
-def user_exists_or_save_new_user(request):
-    """ Check if user is already on database or save if not found. Returns False on failure"""
+def load_known_users():
+    """Fills the known users and users teams caches with every user in the database."""
     try:
-        if database.user_exists(request['user_id']):
-            return True
-        else:
-            try:
-                database.save_user(request["user_id"], request["user_name"])
-                return True
-            except exceptions.QueryDatabaseError as ex:
-                logger.critical(messages.USER_INSERTION_FAILED.format(ex))
-                if not slackapi.logger_critical(messages.USER_INSERTION_FAILED.format(ex)):
-                    logger.warn(messages.SLACK_POST_LOG_FAILED)
-                try:
-                    database.save_request_log(request, False, db_messages.USER_ADDITION_FAILED)
-                except exceptions.SaveRequestLogError:
-                    logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-                responder.delayed_reply_default_error(request)
-                return False
+        users = database.get_all_users_teams()
+    except exceptions.QueryDatabaseError as ex:
+        logger.warn(messages.KNOWN_USERS_LOAD_FAILED.format(ex))
+    else:
+        for [slack_id, team_id] in users:
+            known_users.add(slack_id)
+            if team_id:
+                users_team_ids[slack_id] = str(team_id)
+        logger.debug(messages.KNOWN_USERS_LOADED.format(len(known_users)))
+
+def load_recent_transactions():
+    """Fills the recent transactions cache of every team and user from the database."""
+    try:
+        team_transactions = database.get_recent_transactions(("origin_team", "destination_team"), definitions.RECENT_TRANSACTIONS_PER_KEY)
+        user_transactions = database.get_recent_transactions(("origin_slack_id", "destination_slack_id"), definitions.RECENT_TRANSACTIONS_PER_KEY)
+    except exceptions.QueryDatabaseError as ex:
+        logger.warn(messages.RECENT_TRANSACTIONS_LOAD_FAILED.format(ex))
+    else:
+        recenttransactions.load(team_transactions, user_transactions)
+        logger.debug(messages.RECENT_TRANSACTIONS_LOADED.format(len(recenttransactions.transactions_by_team), len(recenttransactions.transactions_by_user)))
+
+def reconcile_team_balances():
+    """Checks the team balances cache against the database, correcting it."""
+    try:
+        team_balances = database.get_teams_balances()
     except exceptions.QueryDatabaseError as ex:
-        logger.critical(messages.USER_EXISTANCE_CHECK_FAILED.format(ex))
-        if not slackapi.logger_critical(messages.USER_EXISTANCE_CHECK_FAILED.format(ex)):
+        logger.warn(messages.TEAM_BALANCES_RECONCILE_FAILED.format(ex))
+    else:
+        drifted = teambalances.reconcile(team_balances)
+        if drifted:
+            logger.warn(messages.TEAM_BALANCES_DRIFTED.format(", ".join(drifted)))
+        logger.debug(messages.TEAM_BALANCES_RECONCILED.format(len(team_balances)))
+
+def team_balances_reconciler():
+    """Team balances reconciler loop, run until stop() is called."""
+    while not team_balances_reconciler_stop.wait(definitions.TEAM_BALANCES_RECONCILE_INTERVAL_SECONDS):
+        reconcile_team_balances()
+
+def get_cached_list(name, query_function):
+    """Gets a list from the lists cache, reading it with query_function when not cached.
+    Raises the same exceptions as query_function."""
+    rows = listcache.get(name)
+    if rows is None:
+        generation = listcache.get_generation(name)
+        rows = query_function()
+        listcache.store(name, rows, generation)
+    return rows
+
+def load_lists():
+    """Fills the lists cache read by the inline answered commands."""
+    try:
+        get_cached_list("teams", database.get_teams)
+        get_cached_list("staff", database.get_staff_team)
+    except exceptions.QueryDatabaseError as ex:
+        logger.warn(messages.LISTS_CACHE_LOAD_FAILED.format(ex))
+
+def load_request_context(request):
+    """Loads the context of the user making a request, saving the user if new.
+    Returns None on failure, after replying to the request."""
+    generation = security.get_permissions_generation()
+    try:
+        context = database.get_request_context(request["user_id"], request["user_name"], request["user_id"] not in known_users)
+        if context is None:
+            raise exceptions.QueryDatabaseError("User not found after being saved.")
+    except exceptions.QueryDatabaseError as ex:
+        logger.critical(messages.REQUEST_CONTEXT_LOAD_FAILED.format(ex))
+        if not slackapi.logger_critical(messages.REQUEST_CONTEXT_LOAD_FAILED.format(ex)):
             logger.warn(messages.SLACK_POST_LOG_FAILED)
         try:
-            database.save_request_log(request, False, db_messages.USER_EXISTANCE_CHECK_FAILED)
+            database.save_request_log(request, False, db_messages.REQUEST_CONTEXT_LOAD_FAILED)
         except exceptions.SaveRequestLogError:
             logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
         responder.delayed_reply_default_error(request)
-        return False
\ No newline at end of file
+        return None
+    else:
+        known_users.add(request["user_id"])
+        if context.team_id:
+            users_team_ids[request["user_id"]] = str(context.team_id)
+        security.cache_user_role(request["user_id"], context.role, generation)
+        return context
@@ -18,3 +18,9 @@ class FloatParseError(Exception):
 
 class IntegerParseError(Exception):
     """Raise when a a string can not be converted to integer."""
+
+class MigrationError(Exception):
+    """Raise when the database migrations can't be applied."""
+
+class PageTokenError(Exception):
+    """Raise when a page token can't be decoded."""
@@ -1,33 +1,57 @@
 import logging as logger
 import responder
 import dispatcher
-from bottle import request
+from bottle import request, response
 from definitions import SLACK_REQUEST_DATA_KEYS, SLACK_REQUEST_TIMESTAMP_MAX_GAP_SECONDS
 import common
 import time
 import database
 import exceptions
 import hmac
+import json
 import hashlib
 import os
 import log_messages as messages
 import db_request_messages as db_messages
 import slackapi
+import metrics
+import tracing
+import uuid
 
 
 common.setup_logger()
 
+ack_latency = metrics.histogram("http_ack_seconds", "Time to answer Slack requests, by outcome.", ["outcome"])
+
 def request_handler():
-    """Handler to requests."""
+    """Handler to requests. Times the answer to Slack and starts the request trace,
+    finished here or, for queued requests, by the dispatcher."""
+    started = time.monotonic()
+    trace_id = uuid.uuid4().hex
+    tracing.start_trace(trace_id, request.POST.get("command") or "unknown")
+    [outcome, response_body] = tracing.traced(handle_request, "ack")(trace_id)
+    ack_latency.observe(time.monotonic() - started, (outcome,))
+    if outcome == "queued":
+        tracing.detach()
+    else:
+        tracing.finish_trace(trace_id)
+    return response_body
+
+def handle_request(trace_id):
+    """Answers a request, as [outcome, response body]. Outcomes label the ack metrics."""
     logger.debug(messages.REQUEST_RECEIVED)
     request_data = dict(request.POST)
+    request_data["trace_id"] = trace_id
 
     if check_request_origin(request):
         if all_elements_on_request(request_data):
-            # Procceed with request.
+            # Procceed with request. Cheap read commands are answered right away when cached.
+            inline_response = dispatch_request_inline(request_data)
+            if inline_response is not None:
+                return ["inline", inline_response]
             if dispatcher.add_request_to_queue(request_data):
                 # Request was added to queue
-                return responder.confirm_command_reception()
+                return ["queued", responder.confirm_command_reception()]
             else:
                 # Request wasn't added to queue
                 logger.critical(messages.SERVER_OVERLOADED_ERROR)
@@ -37,14 +61,14 @@ def request_handler():
                     database.save_request_log(request_data, False, db_messages.SERVER_OVERLOADED)
                 except exceptions.SaveRequestLogError:
                     logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-                return responder.overloaded_error()
+                return ["overloaded", responder.overloaded_error()]
         else:
             # Inform user of incomplete request.
             logger.error(messages.REQUEST_WITH_INVALID_PAYLOAD)
             if not slackapi.logger_error(messages.REQUEST_WITH_INVALID_PAYLOAD):
                 logger.warn(messages.SLACK_POST_LOG_FAILED)
             # Is incomplete. Don't save on database.
-            return responder.default_error()
+            return ["invalid_payload", responder.default_error()]
     else:
         # Could not validate user request
         logger.error(messages.REQUEST_ORIGIN_CHECK_FAILED)
@@ -55,7 +79,25 @@ def request_handler():
                 database.save_request_log(request_data, False, db_messages.REQUEST_ORIGIN_CHECK_FAILED)
             except exceptions.SaveRequestLogError:
                 logger.warn(messages.REQUEST_LOG_SAVE_FAILED)
-        return responder.unverified_origin_error()
+        return ["unverified_origin", responder.unverified_origin_error()]
+
+def metrics_handler():
+    """Handler to metrics scrapes, served on the metrics port only."""
+    response.content_type = "text/plain; version=0.0.4; charset=utf-8"
+    return metrics.render()
+
+def traces_handler():
+    """Handler to the last finished traces, served on the metrics port only."""
+    response.content_type = "application/json"
+    return json.dumps(tracing.get_traces())
+
+def dispatch_request_inline(request_data):
+    """Answers a request from the caches, or returns None to queue it. Never raises."""
+    try:
+        return dispatcher.dispatch_request_inline(request_data)
+    except Exception as ex:
+        logger.error(messages.INLINE_REPLY_FAILED.format(ex))
+        return None
 
 def all_elements_on_request(request_data):
     """Check if all elements (keys) are present in the request dictionary"""
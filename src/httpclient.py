@@ -0,0 +1,47 @@
+import definitions
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# Adapters hold the keep-alive connection pools and are shared by every thread.
+# Sessions are per thread, as requests doesn't guarantee a Session is thread-safe.
+http_adapters = {}
+http_adapters_lock = threading.Lock()
+thread_data = threading.local()
+
+def get_adapters():
+    """Returns the shared HTTP adapters, keyed by URL prefix. Creates them on first use."""
+    with http_adapters_lock:
+        if not http_adapters:
+            default_adapter = HTTPAdapter(
+                pool_connections=definitions.HTTP_POOL_HOSTS,
+                pool_maxsize=definitions.HTTP_POOL_DEFAULT_MAXSIZE
+            )
+            http_adapters["http://"] = default_adapter
+            http_adapters["https://"] = default_adapter
+            for url_prefix, pool_maxsize in definitions.HTTP_POOL_MAXSIZE_PER_HOST.items():
+                http_adapters[url_prefix] = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        return http_adapters
+
+def get_session():
+    """Returns the HTTP session of the current thread, backed by the shared connection pools."""
+    session = getattr(thread_data, "session", None)
+    if session is None:
+        session = requests.Session()
+        for url_prefix, adapter in get_adapters().items():
+            session.mount(url_prefix, adapter)
+        thread_data.session = session
+    return session
+
+def post(url, json = None, headers = None, timeout = None):
+    """POSTs through a pooled keep-alive connection. Raises the same exceptions as requests.post."""
+    if timeout is None:
+        timeout = (definitions.HTTP_CONNECT_TIMEOUT_SECONDS, definitions.HTTP_READ_TIMEOUT_SECONDS)
+    return get_session().post(url, json = json, headers = headers, timeout = timeout)
+
+def close():
+    """Closes all pooled connections."""
+    with http_adapters_lock:
+        for adapter in http_adapters.values():
+            adapter.close()
@@ -0,0 +1,36 @@
+import definitions
+import threading
+import time
+
+
+# Lists read by the read only commands, by name, as [rows, expires_at] lists.
+# Commands changing a list must invalidate it.
+lists_cache = {}
+lists_cache_lock = threading.Lock()
+# Bumped on every invalidation of a list, so rows read before it aren't cached after it
+lists_cache_generations = {}
+
+def get(name):
+    """Gets the rows of a cached list, or None when not cached or expired."""
+    with lists_cache_lock:
+        entry = lists_cache.get(name)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        return None
+
+def get_generation(name):
+    """Gets the invalidations generation of a list, to be taken before reading the rows to cache."""
+    with lists_cache_lock:
+        return lists_cache_generations.get(name, 0)
+
+def store(name, rows, generation):
+    """Caches the rows of a list, unless invalidated since generation was taken."""
+    with lists_cache_lock:
+        if lists_cache_generations.get(name, 0) == generation:
+            lists_cache[name] = [rows, time.monotonic() + definitions.LISTS_CACHE_TTL_SECONDS]
+
+def invalidate(name):
+    """Drops a cached list. Must be called after changing the list."""
+    with lists_cache_lock:
+        lists_cache.pop(name, None)
+        lists_cache_generations[name] = lists_cache_generations.get(name, 0) + 1
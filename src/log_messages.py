@@ -2,11 +2,13 @@
 
 SERVER_STARTING = "Server booting..."
 SLACK_POSTING_LOG = "POSTing log to Slack."
-DISPATCHER_STARTING = "Starting dispatcher thread."
-HTTP_SERVER_STARTING = "Starting HTTP server on port {}."
+DISPATCHER_STARTING = "Starting {} dispatcher threads."
+DISPATCHER_STOPPING = "Stopping dispatcher threads."
+HTTP_SERVER_STARTING = "Starting HTTP server on port {}, using {} with {} threads."
 REQUEST_RECEIVED = "New request received."
 DISPATCH_REQUEST_STARTING = "Dispatching new request."
 DISPATCH_REQUEST_COMPLETE = "New request dispatched."
+DISPATCH_REQUEST_FAILED = "Unexpected error while dispatching request. Details: {}"
 REQUEST_CREATE_TEAM_START = "New 'create team' request."
 SLACK_POST_LOG_FAILED = "Failed to POST log into Slack channel."
 SLACK_POST_LOG_ERROR = "Error POSTing log into Slack channel: {}"
@@ -81,7 +83,7 @@ REQUEST_HACKERBOY_START = "New 'hackerboy' request."
 UPDATE_TEAMS_BALANCE_FAILED = "Failed to update all teams balance. Details: {}"
 REWARD_LOG_FAILED = "Failed to save reward record. Details: {}"
 GET_TEAMS_CHANNEL_ID_FAILED = "Failed to get all teams channel ids. Details: {}"
-SLACK_POST_HACKERBOY_FAILED = "Failed to report hackerboy command to some/all teams."
+SLACK_POST_HACKERBOY_FAILED = "Failed to report hackerboy command to {} of {} team channels: {}"
 HACKERBOY_NOT_ENOUGH_MONEY = "Not enough money on some teams."
 HACKERBOY_BALANCE_CHECK_FAILED = "Balance check on teams failed. Details: {}"
 REQUEST_HACKERBOY_TEAM_START = "New 'hackerboy team' request."
@@ -98,8 +100,45 @@ CONNECT_TO_DB_FAILED = "Failed to connect to the database: {}"
 DB_EXECUTE_FAILED = "Failed to execute query: {}"
 SLACK_CHANNEL_NAME_TRUNCATED = "Channel name will be truncated."
 SLACK_POST_FAILED = "Error while POSTing data to Slack: {}"
-USER_PERMISSION_CHECK_FAILED = "Could not perform user permissions check. Details: {}"
 INVALID_UUID = "Invalid UUID4 provided."
 TRANSACTION_BELOW_MINIUM = "Transaction amount is below the minimum defined."
 REMOVE_USER_FROM_STAFF_CHANNEL_FAILED = "User was not removed from staff group channel."
 ADD_USER_TO_STAFF_CHANNEL_FAILED = "User was not added to staff group channel."
+DB_POOL_CREATED = "Database connection pool created (min: {}, max: {})."
+DB_POOL_CHECKOUT_TIMEOUT = "Timed out waiting for a free database connection."
+DB_POOL_HEALTH_CHECK_FAILED = "Pooled database connection failed health check, replacing it: {}"
+DB_POOL_RELEASE_FAILED = "Failed to return connection to the pool: {}"
+MIGRATIONS_LIST_FAILED = "Failed to list database migrations: {}"
+MIGRATION_APPLYING = "Applying database migration {}: {}"
+MIGRATION_FAILED = "Failed to apply database migrations, none were applied: {}"
+MIGRATIONS_APPLIED = "Database schema up to date, {} migration(s) applied."
+SERVER_STARTUP_MIGRATIONS_FAILED = "Server not started, database migrations failed: {}"
+SLACK_LOG_LINES_DROPPED = "[*WARNING*] : {} log lines dropped, logs were produced faster than shipped."
+SLACK_API_RATE_LIMITED = "Slack rate limited {}, retrying in {:.2f} seconds (attempt {} of {})."
+SLACK_API_RETRIES_EXHAUSTED = "Slack kept rate limiting {}, giving up after {} retries."
+SLACK_API_WAITED = "Waited {:.2f} seconds for Slack rate limits before calling {}."
+REQUEST_LOG_SPILLED = "Could not insert {} request logs, appending them to the spill file. Details: {}"
+REQUEST_LOG_SPILL_FAILED = "Could not append {} request logs to the spill file, they are lost. Details: {}"
+REQUEST_LOG_REPLAY_FAILED = "Could not insert the spilled request logs, will retry on the next flush. Details: {}"
+REQUEST_LOG_REPLAYED = "Inserted {} spilled request logs."
+REQUEST_LOG_CLAIMED_READ_FAILED = "Could not read the claimed request logs file {}, keeping it for manual recovery. Details: {}"
+REQUEST_LOG_CLAIMED_REMOVE_FAILED = "Could not remove the replayed request logs file {}, it won't be replayed again. Details: {}"
+KNOWN_USERS_LOAD_FAILED = "Could not load the known users cache, users will be checked on the database. Details: {}"
+KNOWN_USERS_LOADED = "Known users cache loaded with {} users."
+REQUEST_CONTEXT_LOAD_FAILED = "Failed to load the user context of the request. Details: {}"
+INVALID_PAGE_TOKEN = "Invalid page token provided. Details: {}"
+RECENT_TRANSACTIONS_LOAD_FAILED = "Could not load the recent transactions cache, transactions will be listed from the database. Details: {}"
+RECENT_TRANSACTIONS_LOADED = "Recent transactions cache loaded for {} teams and {} users."
+TEAM_BALANCES_RECONCILE_FAILED = "Could not reconcile the team balances cache with the database. Details: {}"
+TEAM_BALANCES_RECONCILED = "Team balances cache reconciled with {} teams."
+TEAM_BALANCES_DRIFTED = "Cached balances of teams {} differed from the database and were corrected."
+INLINE_REPLY_CACHE_COLD = "Request to {} not in the caches, queueing it."
+INLINE_REPLY_OVER_BUDGET = "Inline reply to {} took {:.3f} seconds, over budget, queueing it."
+INLINE_REPLY_PENDING_WRITES = "Request to {} has writes of its team pending, queueing it."
+LISTS_CACHE_LOAD_FAILED = "Could not load the lists cache, lists will be read from the database. Details: {}"
+INLINE_REPLY_FAILED = "Failed to answer a request inline, queueing it. Details: {}"
+HTTP_SERVER_UNKNOWN = "Unknown HTTP server {}, using {}."
+METRICS_SERVER_STARTING = "Starting metrics server on port {}, path {}."
+METRICS_SERVER_FAILED = "Metrics server stopped: {}"
+TRACE_SLOW = "Slow request {}: {:.1f}ms, trace {}. Spans:\n{}"
+TRACE_WRITE_FAILED = "Could not append a trace to the traces file. Details: {}"
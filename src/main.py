@@ -1,12 +1,16 @@
 #!/usr/bin/env python3
 
 import common
+import database
 import exceptions
 import logging as logger
 import server
 import dispatcher
+import httpclient
 import log_messages as messages
+import schema
 import slackapi
+import sys
 
 
 def main():
@@ -15,15 +19,38 @@ def main():
     if not slackapi.logger_info(messages.SERVER_STARTING):
         logger.warn(messages.SLACK_POST_LOG_FAILED)
 
+    try:
+        # Bring database schema up to date
+        schema.apply_migrations()
+    except exceptions.MigrationError as ex:
+        logger.critical(messages.SERVER_STARTUP_MIGRATIONS_FAILED.format(ex))
+        if not slackapi.logger_critical(messages.SERVER_STARTUP_MIGRATIONS_FAILED.format(ex)):
+            logger.warn(messages.SLACK_POST_LOG_FAILED)
+        database.close_pool()
+        # Ship the critical log before exiting, the shipper thread is a daemon
+        slackapi.stop_log_shipper()
+        httpclient.close()
+        # Non zero exit code, so the container is restarted once the database is reachable
+        sys.exit(1)
+
     try:
         # Start dispatcher
         dispatcher.start()
+        # Start metrics server, on its own port
+        server.start_metrics()
         # Start http server
         server.start()
     except Exception as ex:
         logger.error(messages.HTTP_SERVER_STOPPED.format(ex))
         if not slackapi.logger_error(messages.HTTP_SERVER_STOPPED.format(ex)):
             logger.warn(messages.SLACK_POST_LOG_FAILED)
+    finally:
+        # Finish queued requests before closing database connections
+        dispatcher.stop()
+        database.stop_request_log_writer()
+        database.close_pool()
+        slackapi.stop_log_shipper()
+        httpclient.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,159 @@
+import functools
+import inspect
+import math
+import threading
+import time
+
+
+# Every metric, in registration order, rendered by render() in the Prometheus text format
+registry = []
+registry_lock = threading.Lock()
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Metric:
+    """Base of every metric. Values are kept by label values tuple, in the order of labelnames."""
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def get_samples(self):
+        """Returns the samples to render, as [suffix, labels dict, value] lists."""
+        with self.lock:
+            return [["", dict(zip(self.labelnames, labels)), value] for labels, value in self.values.items()]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, labels = (), amount = 1):
+        with self.lock:
+            self.values[tuple(labels)] = self.values.get(tuple(labels), 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, labels = ()):
+        with self.lock:
+            self.values[tuple(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames = (), buckets = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels = ()):
+        with self.lock:
+            entry = self.values.get(tuple(labels))
+            if entry is None:
+                # Count of each bucket, not cumulative, then sum and count
+                entry = self.values[tuple(labels)] = [[0] * len(self.buckets), 0.0, 0]
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][idx] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def get_samples(self):
+        samples = []
+        with self.lock:
+            for labels, [bucket_counts, total, count] in self.values.items():
+                labels = dict(zip(self.labelnames, labels))
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+                    samples.append(["_bucket", dict(labels, le=format_value(bound)), cumulative])
+                samples.append(["_bucket", dict(labels, le="+Inf"), count])
+                samples.append(["_sum", labels, total])
+                samples.append(["_count", labels, count])
+        return samples
+
+
+class FunctionMetric(Metric):
+    """Metric read at scrape time from a function returning a {label values tuple: value} dict."""
+
+    def __init__(self, name, documentation, kind, labelnames, function):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.function = function
+
+    def get_samples(self):
+        return [["", dict(zip(self.labelnames, labels)), value] for labels, value in self.function().items()]
+
+
+def register(metric):
+    with registry_lock:
+        registry.append(metric)
+    return metric
+
+def counter(name, documentation, labelnames = ()):
+    return register(Counter(name, documentation, labelnames))
+
+def gauge(name, documentation, labelnames = ()):
+    return register(Gauge(name, documentation, labelnames))
+
+def histogram(name, documentation, labelnames = (), buckets = DEFAULT_BUCKETS):
+    return register(Histogram(name, documentation, labelnames, buckets))
+
+def function_metric(name, documentation, kind, labelnames, function):
+    return register(FunctionMetric(name, documentation, kind, labelnames, function))
+
+def format_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+def render():
+    """Renders every registered metric in the Prometheus text exposition format."""
+    with registry_lock:
+        metrics = list(registry)
+    lines = []
+    for metric in metrics:
+        lines.append("# HELP {} {}".format(metric.name, metric.documentation))
+        lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+        for [suffix, labels, value] in metric.get_samples():
+            if labels:
+                labels_str = ",".join('{}="{}"'.format(k, escape_label_value(v)) for k, v in labels.items())
+                lines.append("{}{}{{{}}} {}".format(metric.name, suffix, labels_str, format_value(value)))
+            else:
+                lines.append("{}{} {}".format(metric.name, suffix, format_value(value)))
+    return "\n".join(lines) + "\n"
+
+def instrument_functions(namespace, latency, errors, exclude = ()):
+    """Replaces every function defined in a module namespace (its globals()) by a wrapper observing
+    its latency and counting the exceptions it raises, labelled by function name.
+    Calls from inside the module are instrumented too, as they are resolved through the namespace."""
+    for name, function in list(namespace.items()):
+        if name in exclude or not inspect.isfunction(function) or function.__module__ != namespace["__name__"]:
+            continue
+        namespace[name] = timed(function, latency, errors, (name,))
+
+def timed(function, latency, errors, labels):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        started = time.monotonic()
+        try:
+            return function(*args, **kwargs)
+        except Exception:
+            errors.inc(labels)
+            raise
+        finally:
+            latency.observe(time.monotonic() - started, labels)
+    return wrapper
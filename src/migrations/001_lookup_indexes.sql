@@ -0,0 +1,11 @@
+-- Indexes for the columns every hot query filters on.
+
+CREATE INDEX IF NOT EXISTS users_team_idx ON users (team);
+
+CREATE INDEX IF NOT EXISTS transactions_origin_user_id_created_at_idx ON transactions (origin_user_id, created_at);
+
+CREATE INDEX IF NOT EXISTS transactions_destination_user_id_created_at_idx ON transactions (destination_user_id, created_at);
+
+CREATE INDEX IF NOT EXISTS transactions_created_at_idx ON transactions (created_at);
+
+CREATE INDEX IF NOT EXISTS permissions_user_id_idx ON permissions (user_id);
@@ -0,0 +1,45 @@
+-- Unique constraints for lookups that must match at most one row.
+-- Their indexes also serve the users.slack_id, entry_code and team_name searches.
+
+-- Rows saved concurrently before these constraints may be duplicated. Merging them is a manual decision
+-- (users and teams are referenced by transactions, permissions and balances), so the migration stops
+-- listing every conflicting row instead of failing on the first constraint.
+DO $$
+DECLARE
+    conflicts TEXT;
+BEGIN
+    SELECT string_agg(conflict, E'\n') INTO conflicts
+    FROM (
+        SELECT format('users.slack_id %L: user_id %s', slack_id, string_agg(user_id::TEXT, ', ' ORDER BY created_at)) AS conflict
+        FROM users
+        WHERE slack_id IS NOT NULL
+        GROUP BY slack_id
+        HAVING count(*) > 1
+        UNION ALL
+        SELECT format('team_registration.entry_code %L: team_id %s', entry_code, string_agg(team_id::TEXT, ', ' ORDER BY created_at))
+        FROM team_registration
+        WHERE entry_code IS NOT NULL
+        GROUP BY entry_code
+        HAVING count(*) > 1
+        UNION ALL
+        SELECT format('team_registration.team_name %L: team_id %s', team_name, string_agg(team_id::TEXT, ', ' ORDER BY created_at))
+        FROM team_registration
+        WHERE team_name IS NOT NULL
+        GROUP BY team_name
+        HAVING count(*) > 1
+    ) AS duplicates;
+
+    IF conflicts IS NOT NULL THEN
+        RAISE EXCEPTION E'Duplicated rows found, merge or delete them and restart:\n%', conflicts;
+    END IF;
+END
+$$;
+
+ALTER TABLE users
+    ADD CONSTRAINT users_slack_id_key UNIQUE (slack_id);
+
+ALTER TABLE team_registration
+    ADD CONSTRAINT team_registration_entry_code_key UNIQUE (entry_code);
+
+ALTER TABLE team_registration
+    ADD CONSTRAINT team_registration_team_name_key UNIQUE (team_name);
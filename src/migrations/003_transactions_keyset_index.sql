@@ -0,0 +1,6 @@
+-- Transaction listings page on (created_at, id), newest first.
+-- This index serves both the ordering and the page condition, replacing the created_at only one.
+
+CREATE INDEX IF NOT EXISTS transactions_created_at_id_idx ON transactions (created_at, id);
+
+DROP INDEX IF EXISTS transactions_created_at_idx;
@@ -0,0 +1,25 @@
+-- Origin and destination team and user of each transaction, copied from users when the transaction is made.
+-- Team and user histories become index range scans on transactions, with no joins.
+-- Users never change team or name, so the copies don't go stale.
+
+ALTER TABLE transactions
+    ADD COLUMN IF NOT EXISTS origin_team UUID,
+    ADD COLUMN IF NOT EXISTS origin_slack_id TEXT,
+    ADD COLUMN IF NOT EXISTS origin_slack_name TEXT,
+    ADD COLUMN IF NOT EXISTS destination_team UUID,
+    ADD COLUMN IF NOT EXISTS destination_slack_id TEXT,
+    ADD COLUMN IF NOT EXISTS destination_slack_name TEXT;
+
+UPDATE transactions
+SET origin_team = users.team, origin_slack_id = users.slack_id, origin_slack_name = users.slack_name
+FROM users
+WHERE users.user_id = transactions.origin_user_id;
+
+UPDATE transactions
+SET destination_team = users.team, destination_slack_id = users.slack_id, destination_slack_name = users.slack_name
+FROM users
+WHERE users.user_id = transactions.destination_user_id;
+
+CREATE INDEX IF NOT EXISTS transactions_origin_team_created_at_idx ON transactions (origin_team, created_at, id);
+
+CREATE INDEX IF NOT EXISTS transactions_destination_team_created_at_idx ON transactions (destination_team, created_at, id);
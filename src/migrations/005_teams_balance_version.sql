@@ -0,0 +1,6 @@
+-- Count of the balance updates of each team, incremented by every statement updating teams.balance.
+-- Updates of a row are serialized by its lock, so a higher version is always a newer balance,
+-- letting the team balances cache ignore updates applied out of order.
+
+ALTER TABLE teams
+    ADD COLUMN IF NOT EXISTS balance_version BIGINT NOT NULL DEFAULT 0;
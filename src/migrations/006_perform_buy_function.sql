@@ -0,0 +1,109 @@
+-- A buy as one function, called in one round trip on an autocommit connection.
+-- Both teams are locked in team_id order before the debit and credit, as alter_money_to_all_teams
+-- locks them, so opposite buys between two teams wait on each other instead of deadlocking.
+-- Result codes match database.BuyResults. Any error rolls the whole buy back.
+
+CREATE OR REPLACE FUNCTION perform_buy(p_origin TEXT, p_destination TEXT, p_amount NUMERIC, p_description TEXT)
+RETURNS TABLE (
+    buy_result TEXT,
+    destination_channel_id TEXT,
+    origin_balance NUMERIC,
+    origin_balance_version BIGINT,
+    destination_balance NUMERIC,
+    destination_balance_version BIGINT,
+    movement_origin_team UUID,
+    movement_destination_team UUID,
+    movement_created_at TIMESTAMP,
+    movement_origin_slack_id TEXT,
+    movement_origin_slack_name TEXT,
+    movement_destination_slack_id TEXT,
+    movement_destination_slack_name TEXT,
+    movement_amount NUMERIC,
+    movement_description TEXT,
+    movement_id UUID
+) AS $$
+DECLARE
+    origin users%ROWTYPE;
+    destination users%ROWTYPE;
+    movement transactions%ROWTYPE;
+BEGIN
+    SELECT * INTO origin FROM users WHERE users.slack_id = p_origin LIMIT 1;
+    SELECT * INTO destination FROM users WHERE users.slack_id = p_destination LIMIT 1;
+    SELECT teams.slack_channel_id INTO destination_channel_id FROM teams WHERE teams.team_id = destination.team;
+
+    IF origin.team IS NULL THEN
+        buy_result := 'ORIGIN_WITHOUT_TEAM';
+    ELSIF destination.team IS NULL THEN
+        buy_result := 'DESTINATION_WITHOUT_TEAM';
+    ELSIF origin.team = destination.team THEN
+        buy_result := 'SAME_TEAM';
+    END IF;
+    IF buy_result IS NOT NULL THEN
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    PERFORM 1
+    FROM teams
+    WHERE teams.team_id IN (origin.team, destination.team)
+    ORDER BY teams.team_id
+    FOR UPDATE;
+
+    UPDATE teams
+    SET balance = teams.balance - p_amount, balance_version = teams.balance_version + 1
+    WHERE teams.team_id = origin.team
+    AND teams.balance > p_amount
+    RETURNING teams.balance, teams.balance_version INTO origin_balance, origin_balance_version;
+    IF NOT FOUND THEN
+        buy_result := 'NOT_ENOUGH_CREDIT';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    UPDATE teams
+    SET balance = teams.balance + p_amount, balance_version = teams.balance_version + 1
+    WHERE teams.team_id = destination.team
+    RETURNING teams.balance, teams.balance_version INTO destination_balance, destination_balance_version;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Destination team % not found, buy rolled back.', destination.team;
+    END IF;
+
+    INSERT INTO transactions (
+        origin_user_id,
+        destination_user_id,
+        amount,
+        description,
+        origin_team,
+        origin_slack_id,
+        origin_slack_name,
+        destination_team,
+        destination_slack_id,
+        destination_slack_name
+    ) VALUES (
+        origin.user_id,
+        destination.user_id,
+        p_amount,
+        p_description,
+        origin.team,
+        origin.slack_id,
+        origin.slack_name,
+        destination.team,
+        destination.slack_id,
+        destination.slack_name
+    )
+    RETURNING * INTO movement;
+
+    buy_result := 'SUCCESS';
+    movement_origin_team := movement.origin_team;
+    movement_destination_team := movement.destination_team;
+    movement_created_at := movement.created_at;
+    movement_origin_slack_id := movement.origin_slack_id;
+    movement_origin_slack_name := movement.origin_slack_name;
+    movement_destination_slack_id := movement.destination_slack_id;
+    movement_destination_slack_name := movement.destination_slack_name;
+    movement_amount := movement.amount;
+    movement_description := movement.description;
+    movement_id := movement.id;
+    RETURN NEXT;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,69 @@
+import bisect
+import definitions
+import threading
+
+
+# Last transactions of each team and user, oldest first, as stored by the transaction listings:
+# (created_at, origin_slack_id, origin_slack_name, destination_slack_id, destination_slack_name, amount, description, id)
+# Keys missing from a loaded cache have no transactions.
+transactions_by_team = {}
+transactions_by_user = {}
+recent_transactions_lock = threading.Lock()
+recent_transactions_state = {
+    "loaded": False,
+}
+
+def transaction_sort_key(transaction):
+    """Orders transactions as the listings do, by created_at then id."""
+    return (transaction[0], str(transaction[7]))
+
+def load(team_transactions, user_transactions):
+    """Fills the cache from [key, transaction] lists, as returned by database.get_recent_transactions."""
+    with recent_transactions_lock:
+        transactions_by_team.clear()
+        transactions_by_user.clear()
+        for [team_id, transaction] in team_transactions:
+            insert(transactions_by_team, str(team_id), transaction)
+        for [slack_id, transaction] in user_transactions:
+            insert(transactions_by_user, slack_id, transaction)
+        recent_transactions_state["loaded"] = True
+
+def add(transaction, origin_team, destination_team):
+    """Adds a committed transaction to the cache of both teams and both users."""
+    with recent_transactions_lock:
+        if not recent_transactions_state["loaded"]:
+            return
+        insert(transactions_by_team, str(origin_team), transaction)
+        insert(transactions_by_team, str(destination_team), transaction)
+        insert(transactions_by_user, transaction[1], transaction)
+        insert(transactions_by_user, transaction[3], transaction)
+
+def insert(transactions_by_key, key, transaction):
+    """Inserts a transaction in order, keeping only the last RECENT_TRANSACTIONS_PER_KEY.
+    Concurrent buys may be added out of order. Must be called holding recent_transactions_lock."""
+    transactions = transactions_by_key.setdefault(key, [])
+    keys = [transaction_sort_key(t) for t in transactions]
+    transactions.insert(bisect.bisect(keys, transaction_sort_key(transaction)), transaction)
+    if len(transactions) > definitions.RECENT_TRANSACTIONS_PER_KEY:
+        del transactions[0]
+
+def get_page(transactions_by_key, key, page_size):
+    """Gets the first page of a key, newest first, as [transactions, has_more].
+    Returns None when the cached transactions may not be enough to fill the page."""
+    with recent_transactions_lock:
+        if not recent_transactions_state["loaded"]:
+            return None
+        transactions = transactions_by_key.get(key, [])
+        # A full buffer may have dropped older transactions
+        if len(transactions) <= page_size and len(transactions) >= definitions.RECENT_TRANSACTIONS_PER_KEY:
+            return None
+        page = transactions[::-1][:page_size]
+        return [page, len(transactions) > page_size]
+
+def get_team_page(team_id, page_size):
+    """Gets the first page of a team transactions, see get_page."""
+    return get_page(transactions_by_team, str(team_id), page_size)
+
+def get_user_page(slack_id, page_size):
+    """Gets the first page of a user transactions, see get_page."""
+    return get_page(transactions_by_user, slack_id, page_size)
@@ -3,6 +3,7 @@ import json
 import exceptions
 import os
 import requests
+import httpclient
 import logging as logger
 import common
 import database
@@ -10,6 +11,10 @@ import datetime
 import responder_messages as messages
 import log_messages
 import slackapi
+import slackclient
+import time
+import tracing
+import urllib.parse
 
 
 common.setup_logger()
@@ -85,7 +90,11 @@ def check_balance_delayed_reply_no_team(request):
 
 def check_balance_delayed_reply_success(request, team, balance):
     """Delayed response to Slack reporting the user's balance."""
-    response_content = {
+    send_delayed_response(request['response_url'], check_balance_success_content(team, balance))
+
+def check_balance_success_content(team, balance):
+    """Response content reporting the user's balance."""
+    return {
         "text": messages.CHECK_BALANCE_SUCCESS,
         "attachments": [
             {
@@ -93,7 +102,6 @@ def check_balance_delayed_reply_success(request, team, balance):
             }
         ]
     }
-    send_delayed_response(request['response_url'], response_content)
 
 def buy_delayed_reply_missing_args(request):
     """Delayed response to Slack reporting not enough arguments on buy command"""
@@ -165,7 +173,7 @@ def list_transactions_delayed_reply_no_team(request):
     }
     send_delayed_response(request['response_url'], response_content)
 
-def list_transactions_delayed_reply_success(request, transaction_list):
+def list_transactions_delayed_reply_success(request, transaction_list, next_page_command = None):
     """Delayed response to Slack reporting the last quantity transactions made."""
     response_content = {
         "text": messages.LIST_TRANSACTIONS_SUCCESS.format(len(transaction_list)),
@@ -186,17 +194,23 @@ def list_transactions_delayed_reply_success(request, transaction_list):
 
         response_content["text"] += messages.LIST_TRANSACTIONS_TRANSACTION_AMOUNT.format(transaction[5], transaction[6])
 
+    if next_page_command:
+        response_content["text"] += messages.LIST_TRANSACTIONS_NEXT_PAGE.format(next_page_command)
+
     send_delayed_response(request['response_url'], response_content)
 
 def list_teams_delayed_reply_success(request, teams_list):
     """Delayed response to Slack reporting the teams list."""
+    send_delayed_response(request['response_url'], list_teams_success_content(teams_list))
+
+def list_teams_success_content(teams_list):
+    """Response content reporting the teams list."""
     response_content = {
         "text": messages.LIST_TEAMS_SUCCESS.format(len(teams_list)),
     }
     for idx, team in enumerate(teams_list):
         response_content["text"] += messages.LIST_TEAMS_TEAM_DETAILS.format(idx + 1, team[1], team[0])
-
-    send_delayed_response(request['response_url'], response_content)
+    return response_content
 
 def list_teams_registration_delayed_reply_success(request, teams_list):
     """Delayed response to Slack reporting the registration teams list."""
@@ -256,7 +270,7 @@ def user_details_delayed_reply_success(request, user_info):
         }
     send_delayed_response(request['response_url'], response_content)
 
-def list_user_transactions_delayed_reply_success(request, transaction_list):
+def list_user_transactions_delayed_reply_success(request, transaction_list, next_page_command = None):
     """Delayed response to Slack reporting the last quantity transactions made by user."""
     response_content = {
         "text": messages.LIST_USER_TRANSACTIONS_SUCCESS.format(len(transaction_list)),
@@ -277,6 +291,9 @@ def list_user_transactions_delayed_reply_success(request, transaction_list):
 
         response_content["text"] += messages.LIST_TRANSACTIONS_TRANSACTION_AMOUNT.format(transaction[5], transaction[6])
 
+    if next_page_command:
+        response_content["text"] += messages.LIST_TRANSACTIONS_NEXT_PAGE.format(next_page_command)
+
     send_delayed_response(request['response_url'], response_content)
 
 def change_permission_delayed_reply_missing_args(request):
@@ -302,14 +319,17 @@ def change_permission_delayed_reply_user_channel_not_modified(request):
 
 def list_staff_delayed_reply_success(request, staff_team):
     """Delayed response to Slack reporting the staff team."""
+    send_delayed_response(request['response_url'], list_staff_success_content(staff_team))
+
+def list_staff_success_content(staff_team):
+    """Response content reporting the staff team."""
     response_content = {
         "text": messages.LIST_STAFF_SUCCESS,
     }
 
     for element in staff_team:
         response_content["text"] += messages.LIST_STAFF_DETAILS.format(element[2], element[3], element[1], element[0])
-
-    send_delayed_response(request['response_url'], response_content)
+    return response_content
 
 def hackerboy_delayed_reply_missing_args(request):
     """Delayed response to Slack reporting a bad usage on hackerboy command."""
@@ -387,7 +407,7 @@ def delayed_reply_user_has_no_team(request):
     }
     send_delayed_response(request['response_url'], response_content)
 
-def list_to_admin_user_transactions_delayed_reply_success(request, transaction_list):
+def list_to_admin_user_transactions_delayed_reply_success(request, transaction_list, next_page_command = None):
     """Delayed response to Slack reporting the last quantity transactions made an user."""
     response_content = {
         "text": messages.LIST_ADMIN_USER_TRANSACTIONS_SUCCESS.format(len(transaction_list)),
@@ -398,6 +418,9 @@ def list_to_admin_user_transactions_delayed_reply_success(request, transaction_l
         response_content["text"] += messages.LIST_TRANSACTIONS_TRANSACTION.format(transaction[1], transaction[2], transaction[3], transaction[4], datetime.datetime.strftime(transaction[0], "%Y-%m-%d %H:%M:%S"))
         response_content["text"] += messages.LIST_TRANSACTIONS_TRANSACTION_AMOUNT.format(transaction[5], transaction[6])
 
+    if next_page_command:
+        response_content["text"] += messages.LIST_TRANSACTIONS_NEXT_PAGE.format(next_page_command)
+
     send_delayed_response(request['response_url'], response_content)
 
 def list_team_transactions_delayed_reply_missing_args(request):
@@ -414,7 +437,7 @@ def list_team_transactions_delayed_reply_team_not_existant(request):
     }
     send_delayed_response(request['response_url'], response_content)
 
-def list_team_transactions_delayed_reply_success(request, transaction_list):
+def list_team_transactions_delayed_reply_success(request, transaction_list, next_page_command = None):
     """Delayed response to Slack reporting the last quantity transactions made a team."""
     response_content = {
         "text": messages.LIST_TEAMS_TRANSACTIONS_SUCCESS.format(len(transaction_list)),
@@ -425,6 +448,9 @@ def list_team_transactions_delayed_reply_success(request, transaction_list):
         response_content["text"] += messages.LIST_TRANSACTIONS_TRANSACTION.format(transaction[1], transaction[2], transaction[3], transaction[4], datetime.datetime.strftime(transaction[0], "%Y-%m-%d %H:%M:%S"))
         response_content["text"] += messages.LIST_TRANSACTIONS_TRANSACTION_AMOUNT.format(transaction[5], transaction[6])
 
+    if next_page_command:
+        response_content["text"] += messages.LIST_TRANSACTIONS_NEXT_PAGE.format(next_page_command)
+
     send_delayed_response(request['response_url'], response_content)
 
 def list_all_transactions_delayed_reply_missing_args(request):
@@ -434,7 +460,7 @@ def list_all_transactions_delayed_reply_missing_args(request):
     }
     send_delayed_response(request['response_url'], response_content)
 
-def list_all_transactions_delayed_reply_success(request, transaction_list):
+def list_all_transactions_delayed_reply_success(request, transaction_list, next_page_command = None):
     """Delayed response to Slack reporting the last quantity transactions made overall."""
     response_content = {
         "text": messages.LIST_ALL_TRANSACTIONS_SUCCESS.format(len(transaction_list)),
@@ -444,8 +470,16 @@ def list_all_transactions_delayed_reply_success(request, transaction_list):
         response_content["text"] += messages.LIST_TRANSACTIONS_TRANSACTION.format(transaction[1], transaction[2], transaction[3], transaction[4], datetime.datetime.strftime(transaction[0], "%Y-%m-%d %H:%M:%S"))
         response_content["text"] += messages.LIST_TRANSACTIONS_TRANSACTION_AMOUNT.format(transaction[5], transaction[6])
 
+    if next_page_command:
+        response_content["text"] += messages.LIST_TRANSACTIONS_NEXT_PAGE.format(next_page_command)
+
     send_delayed_response(request['response_url'], response_content)
 
+def immediate_reply(response_content):
+    """Immediate response to a request answered without being queued."""
+    response.add_header("Content-Type", "application/json")
+    return json.dumps(response_content, ensure_ascii=False).encode("utf-8")
+
 def default_error():
     """Immediate default response to report an error."""
     response.add_header("Content-Type", "application/json")
@@ -495,11 +529,20 @@ def get_support_channel_id():
     """Get slack support channel id."""
     return os.getenv("SLACK_SUPPORT_CHANNEL_ID")
 
+def get_response_url(url):
+    """Gets where to send a delayed response. With SLACK_RESPONSE_BASE_URL set, responses go to that base URL
+    with the path of the response_url, eg: to a fake Slack server when replaying requests."""
+    base_url = os.getenv("SLACK_RESPONSE_BASE_URL")
+    if not base_url:
+        return url
+    return base_url.rstrip("/") + urllib.parse.urlsplit(url).path
+
 def send_delayed_response(url, content):
     """Send a POST request to Slacsend_delayed_responsesend_delayed_responsek with JSON body."""
     headers = {"Content-Type": "application/json"}
+    started = time.monotonic()
     try:
-        r = requests.post(url, json=content, headers=headers)
+        r = httpclient.post(get_response_url(url), json=content, headers=headers)
         if not r.status_code == 200:
             logger.critical(log_messages.DELAYED_MESSAGE_POST_FAILED_BAD_HTTP_CODE.format(r.status_code))
             if not slackapi.logger_critical(log_messages.DELAYED_MESSAGE_POST_FAILED_BAD_HTTP_CODE.format(r.status_code)):
@@ -508,6 +551,8 @@ def send_delayed_response(url, content):
         logger.critical(log_messages.DELAYED_MESSAGE_POST_FAILED.format(ex))
         if not slackapi.logger_critical(log_messages.DELAYED_MESSAGE_POST_FAILED.format(ex)):
             logger.warn(log_messages.SLACK_POST_LOG_FAILED)
+    finally:
+        slackclient.call_latency.observe(time.monotonic() - started, ("response_url",))
 
 def get_slack_user_tag(slack_user_id):
     """Gets user information from database to build Slack like @user"""
@@ -519,3 +564,17 @@ def get_slack_user_tag(slack_user_id):
         if not slackapi.logger_critical(log_messages.DB_EXECUTE_FAILED.format(ex)):
             logger.warn(log_messages.SLACK_POST_LOG_FAILED)
         return None
+
+# Time every delayed response. Immediate responses and content builders don't leave the process and are left out
+tracing.instrument_functions(globals(), exclude = (
+    "confirm_command_reception",
+    "check_balance_success_content",
+    "list_teams_success_content",
+    "list_staff_success_content",
+    "immediate_reply",
+    "default_error",
+    "overloaded_error",
+    "unverified_origin_error",
+    "get_support_channel_id",
+    "get_response_url",
+))
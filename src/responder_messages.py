@@ -34,6 +34,7 @@ LIST_TRANSACTIONS_TRANSACTION_ORIGIN_ME = "*De:* mim | *Para:* <@{}|{}> | *Data:
 LIST_TRANSACTIONS_TRANSACTION_DESTINATION_ME = "*De:* <@{}|{}> | *Para:* mim | *Data:* {}\n"
 LIST_TRANSACTIONS_TRANSACTION = "*De:* <@{}|{}> | *Para:* <@{}|{}> | *Data:* {}\n"
 LIST_TRANSACTIONS_TRANSACTION_AMOUNT = "*Valor:* {:.2f} :money_with_wings: | *Descrição:* {}\n\n"
+LIST_TRANSACTIONS_NEXT_PAGE = "_Há mais movimentos. Para veres os seguintes:_ `{}`"
 LIST_TEAMS_SUCCESS = "Aqui está a lista das {} equipas a participar:\n"
 LIST_TEAMS_TEAM_DETAILS = "_{}_: *Nome:* {} | *ID:* {}\n"
 LIST_REGISTRATION_TEAMS_SUCCESS = "Aqui estão as {} equipas registadas:\n"
@@ -63,13 +64,13 @@ HACKERBOY_TEAM_NOT_ENOUGH_MONEY = "Erro. A equipa irá ficar com saldo negativo
 HACKERBOY_TEAM_SUCCESS_ADD = "Boa! Transferimos {} :money_with_wings: para a equipa!"
 HACKERBOY_TEAM_SUCCESS_SUB = "Muahahah. Roubámos {} :money_with_wings: da equipa!"
 HACKERBOY_TEAM_SUCCESS_ZERO = "Enfim, mais valia estares quieto.... 0 +- alguma coisa não faz grande diferença..."
-LIST_USER_TRANSACTIONS_COMMAND_USAGE = "*Utilização: `/transacoes-participante @user [quantidade]`"
+LIST_USER_TRANSACTIONS_COMMAND_USAGE = "*Utilização: `/transacoes-participante @user [quantidade] [página]`"
 USER_HAS_NO_TEAM = "*ERRO:* O utilizador não se encontra numa equipa."
 LIST_ADMIN_USER_TRANSACTIONS_SUCCESS = "Aqui tens os detalhes dos últimos {} movimentos do jogador:\n"
-LIST_TEAM_TRANSACTIONS_COMMAND_USAGE = "*Utilização: `/transacoes-equipa <id-equipa> [quantidade]`"
+LIST_TEAM_TRANSACTIONS_COMMAND_USAGE = "*Utilização: `/transacoes-equipa <id-equipa> [quantidade] [página]`"
 TEAM_NOT_FOUND = "*ERRO:* Essa equipa não existe."
 LIST_TEAMS_TRANSACTIONS_SUCCESS = "Aqui tens os detalhes dos últimos {} movimentos da equipa:\n"
-LIST_ALL_TRANSACTIONS_COMMAND_USAGE = "*Utilização: `/transacoes-todas [quantidade]`"
+LIST_ALL_TRANSACTIONS_COMMAND_USAGE = "*Utilização: `/transacoes-todas [quantidade] [página]`"
 LIST_ALL_TRANSACTIONS_SUCCESS = "Aqui tens os detalhes dos últimos {} movimentos da NEECathon:\n"
 HACKERBOY_TEAM_ADD_MONEY = "O _hackerboy_ é bondoso! Receberam uma transferência de {} :money_with_wings: !\n"
 HACKERBOY_TEAM_REMOVE_MONEY = "O _hackerboy_ decidiu revoltar-se! Perderam {} :money_with_wings: do vosso saldo!\n"
@@ -0,0 +1,79 @@
+import common
+import database
+import definitions
+import exceptions
+import logging as logger
+import log_messages as messages
+import os
+import re
+
+
+common.setup_logger()
+
+# Migration files are named <version>_<description>.sql, eg: 001_lookup_indexes.sql
+MIGRATION_FILE_REGEX = r"^(\d+)_(\w+)\.sql$"
+
+# Advisory lock key, so only one process applies migrations at a time
+MIGRATIONS_LOCK_KEY = 4101
+
+def get_migrations_directory():
+    """Returns the absolute path of the migrations directory."""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), definitions.DATABASE_MIGRATIONS_DIRECTORY)
+
+def list_migrations():
+    """Returns all migrations found, as [version, name, path] lists sorted by version."""
+    migrations = []
+    directory = get_migrations_directory()
+    for file_name in os.listdir(directory):
+        matches = re.match(MIGRATION_FILE_REGEX, file_name)
+        if matches:
+            migrations.append([int(matches.group(1)), matches.group(2), os.path.join(directory, file_name)])
+
+    migrations.sort(key=lambda migration: migration[0])
+    versions = [migration[0] for migration in migrations]
+    if len(versions) != len(set(versions)):
+        raise exceptions.MigrationError("Duplicated migration versions found.")
+    return migrations
+
+def apply_migrations():
+    """Applies every migration not yet recorded on the schema_version table.
+    All pending migrations run in one transaction. Returns the number of migrations applied."""
+    try:
+        migrations = list_migrations()
+    except OSError as ex:
+        logger.critical(messages.MIGRATIONS_LIST_FAILED.format(ex))
+        raise exceptions.MigrationError("Could not list migrations: {}".format(ex))
+
+    try:
+        with database.connection(False) as db_connection:
+            cursor = db_connection.cursor()
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATIONS_LOCK_KEY,))
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT,
+                    applied_at TIMESTAMP DEFAULT NOW()
+                )
+                """)
+            cursor.execute("SELECT version FROM schema_version")
+            applied_versions = set([r[0] for r in cursor.fetchall()])
+
+            applied_count = 0
+            for [version, name, path] in migrations:
+                if version in applied_versions:
+                    continue
+                logger.info(messages.MIGRATION_APPLYING.format(version, name))
+                with open(path, encoding="utf-8") as migration_file:
+                    cursor.execute(migration_file.read())
+                cursor.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s)", (version, name))
+                applied_count += 1
+            cursor.close()
+    except exceptions.DatabaseConnectionError as ex:
+        logger.critical(messages.CONNECT_TO_DB_FAILED.format(ex))
+        raise exceptions.MigrationError("Could not connect to database: {}".format(ex))
+    except Exception as ex:
+        logger.critical(messages.MIGRATION_FAILED.format(ex))
+        raise exceptions.MigrationError("Could not apply migrations: {}".format(ex))
+    else:
+        logger.info(messages.MIGRATIONS_APPLIED.format(applied_count))
+        return applied_count
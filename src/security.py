@@ -1,13 +1,9 @@
-import common
-import database
-import exceptions
-import logging as logger
-import log_messages as messages
-import slackapi
+import definitions
+import metrics
+import threading
+import time
 
 
-common.setup_logger()
-
 class RoleLevels:
     Admin = "admin"
     Staff = "staff"
@@ -17,19 +13,65 @@ role_level = {
     "staff": 40
 }
 
-def user_has_permission(level, user):
-    """ Checks if a user has permissions to execute some operation."""
-    try:
-        user_permission = database.get_user_permissions(user)
-    except exceptions.QueryDatabaseError as ex:
-        logger.error(messages.USER_PERMISSION_CHECK_FAILED.format(ex))
-        if not slackapi.logger_error(messages.USER_PERMISSION_CHECK_FAILED.format(ex)):
-            logger.warn(messages.SLACK_POST_LOG_FAILED)
+# Role of each user, or None for users without permissions, as [role, expires_at] lists.
+# Filled with the role read by every request context, read by the inline fast path.
+permissions_cache = {}
+permissions_cache_lock = threading.Lock()
+permissions_cache_metrics = {
+    "hits": 0,
+    "misses": 0,
+    "invalidations": 0,
+}
+# Bumped on every invalidation, so a role read before it isn't cached after it
+permissions_cache_state = {
+    "generation": 0,
+}
+
+def get_cached_user_role(user):
+    """Gets a user role from the permissions cache without querying, as [role],
+    or None when the user isn't cached or has expired."""
+    now = time.monotonic()
+    with permissions_cache_lock:
+        entry = permissions_cache.get(user)
+        if entry is not None and entry[1] > now:
+            permissions_cache_metrics["hits"] += 1
+            return [entry[0]]
+        permissions_cache_metrics["misses"] += 1
+        return None
+
+def get_permissions_generation():
+    """Gets the invalidations generation, to be taken before reading a role to cache."""
+    with permissions_cache_lock:
+        return permissions_cache_state["generation"]
+
+def cache_user_role(user, role, generation):
+    """Caches a user role read from the database, unless invalidated since generation was taken."""
+    with permissions_cache_lock:
+        if permissions_cache_state["generation"] == generation:
+            permissions_cache[user] = [role, time.monotonic() + definitions.PERMISSIONS_CACHE_TTL_SECONDS]
+
+def invalidate_user_permissions(user):
+    """Drops a user from the permissions cache. Must be called after changing the user permissions."""
+    with permissions_cache_lock:
+        permissions_cache.pop(user, None)
+        permissions_cache_state["generation"] += 1
+        permissions_cache_metrics["invalidations"] += 1
+
+def get_permissions_cache_metrics():
+    """Returns the permissions cache hit, miss and invalidation counters."""
+    with permissions_cache_lock:
+        return dict(permissions_cache_metrics)
+
+metrics.function_metric(
+    "permissions_cache_events_total", "Permissions cache hits, misses and invalidations.", "counter", ["event"],
+    lambda: {(event,): count for event, count in get_permissions_cache_metrics().items()}
+)
+
+def role_has_permission(level, role):
+    """ Checks if a role is allowed to execute operations of some level. role may be None."""
+    if not role:
         return False
+    if role_level[role] >= role_level[level]:
+        return True
     else:
-        if not user_permission:
-            return False
-        if role_level[user_permission] >= role_level[level]:
-            return True
-        else:
-            return False
+        return False
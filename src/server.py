@@ -1,10 +1,15 @@
 import common
+import definitions
 import exceptions
 import handlers
 import json
 import logging as logger
+import os
 from bottle import Bottle, response, run
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
 from definitions import SERVER_PORT
+from wsgiref.simple_server import WSGIServer
 import log_messages as messages
 import slackapi
 
@@ -21,19 +26,101 @@ class JSONBottle(Bottle):
         response.add_header("Content-Type", "application/json")
         return json.dumps(dict(message = res.body, status_code = res.status_code))
 
+class PooledWSGIServer(WSGIServer):
+    """wsgiref server handling each connection on a bounded pool of threads, instead of one at a time."""
+    threads = definitions.HTTP_SERVER_DEFAULT_THREADS
+
+    def server_activate(self):
+        super().server_activate()
+        self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="HTTPServerThread")
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
 def start():
     """Start HTTP server."""
     bot_app = JSONBottle()
-    logger.debug(messages.HTTP_SERVER_STARTING.format(SERVER_PORT))
+    [server_name, threads] = get_server_config()
+    logger.debug(messages.HTTP_SERVER_STARTING.format(SERVER_PORT, server_name, threads))
     try:
         define_routing(bot_app)
-        run(app = bot_app, host="0.0.0.0", port=SERVER_PORT)
+        [server, server_options] = get_server_adapter(server_name, threads)
+        run(app = bot_app, server=server, host="0.0.0.0", port=SERVER_PORT, **server_options)
     except Exception as ex:
         logger.error(messages.HTTP_SERVER_STARTUP_ERROR.format(ex))
         if not slackapi.logger_error(messages.HTTP_SERVER_STARTUP_ERROR.format(ex)):
             logger.warn(messages.SLACK_POST_LOG_FAILED)
         raise exceptions.HTTPServerStartError("HTTP server startup failed.")
 
+def start_metrics():
+    """Start the metrics HTTP server on its own port and thread. The port isn't proxied by nginx."""
+    port = get_metrics_port()
+    if not port:
+        return
+    metrics_app = JSONBottle()
+    metrics_app.route(path=definitions.METRICS_PATH, method=["GET"], callback=handlers.metrics_handler)
+    metrics_app.route(path=definitions.TRACES_PATH, method=["GET"], callback=handlers.traces_handler)
+    logger.debug(messages.METRICS_SERVER_STARTING.format(port, definitions.METRICS_PATH))
+    t = Thread(target=serve_metrics, args=(metrics_app, port), name="MetricsServerThread")
+    t.setDaemon(True)
+    t.start()
+
+def serve_metrics(metrics_app, port):
+    """Metrics HTTP server loop, run by the metrics server thread."""
+    [server, server_options] = get_server_adapter("threaded", definitions.METRICS_SERVER_THREADS)
+    try:
+        run(app = metrics_app, server=server, host="0.0.0.0", port=port, quiet=True, **server_options)
+    except Exception as ex:
+        logger.error(messages.METRICS_SERVER_FAILED.format(ex))
+
+def get_metrics_port():
+    """Gets the metrics server port from the environment. 0 disables the metrics server."""
+    try:
+        return int(os.getenv("METRICS_PORT") or definitions.METRICS_SERVER_PORT)
+    except ValueError:
+        return definitions.METRICS_SERVER_PORT
+
 def define_routing(app):
     """Defines all server routing scheme."""
     app.route(path="/", method=["POST"], callback=handlers.request_handler)
+
+def get_server_config():
+    """Gets the HTTP server backend and its threads count, from the environment."""
+    server_name = os.getenv("HTTP_SERVER") or definitions.HTTP_SERVER_DEFAULT
+    if server_name not in definitions.HTTP_SERVERS:
+        logger.warn(messages.HTTP_SERVER_UNKNOWN.format(server_name, definitions.HTTP_SERVER_DEFAULT))
+        server_name = definitions.HTTP_SERVER_DEFAULT
+    try:
+        threads = int(os.getenv("HTTP_SERVER_THREADS", definitions.HTTP_SERVER_DEFAULT_THREADS))
+    except ValueError:
+        threads = definitions.HTTP_SERVER_DEFAULT_THREADS
+    if server_name == "wsgiref":
+        threads = 1
+    return [server_name, max(1, threads)]
+
+def get_server_adapter(server_name, threads):
+    """Gets the bottle server and its options for a backend of HTTP_SERVERS, as [server, options].
+    wsgiref: single threaded, one request at a time.
+    threaded: wsgiref with a pool of threads, no keep-alive.
+    waitress: pool of threads with HTTP/1.1 keep-alive, needs the waitress package."""
+    if server_name == "threaded":
+        server_class = type("PooledWSGIServer", (PooledWSGIServer,), {"threads": threads})
+        return ["wsgiref", {"server_class": server_class}]
+    if server_name == "waitress":
+        return ["waitress", {
+            "threads": threads,
+            "channel_timeout": definitions.HTTP_SERVER_KEEPALIVE_SECONDS,
+        }]
+    return ["wsgiref", {}]
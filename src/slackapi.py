@@ -1,7 +1,12 @@
 import logging as logger
 import common
-import requests
+import slackclient
 import os
+import threading
+import tracing
+import definitions
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import log_messages as messages
 import responder_messages
@@ -9,6 +14,23 @@ import responder_messages
 
 common.setup_logger()
 
+LOG_LEVELS = {
+    "DEBUG": 10,
+    "INFO": 20,
+    "WARNING": 30,
+    "ERROR": 40,
+    "CRITICAL": 50,
+}
+
+# Log lines waiting to be shipped. When full, the oldest lines are dropped.
+log_buffer = deque(maxlen=definitions.SLACK_LOG_BUFFER_MAX_LINES)
+log_buffer_condition = threading.Condition()
+log_shipper_state = {
+    "thread": None,
+    "stopping": False,
+    "dropped_lines": 0,
+}
+
 def set_headers():
     """ Sets the appropriate headers."""
     token = os.getenv("SLACK_USER_TOKEN")
@@ -20,7 +42,7 @@ def set_headers():
 
 def create_group(group_name):
     """ Creates a new private channel."""
-    url = "https://slack.com/api/groups.create"
+    method = "groups.create"
     headers = set_headers()
     if len(group_name) > 22:
         logger.warn(messages.SLACK_CHANNEL_NAME_TRUNCATED)
@@ -28,7 +50,7 @@ def create_group(group_name):
         "name": group_name,
     }
     try:
-        r = requests.post(url, json = payload, headers = headers)
+        r = slackclient.call(method, payload, headers)
     except Exception as ex:
         logger.error(messages.SLACK_POST_FAILED.format(ex))
         if not logger_error(messages.SLACK_POST_FAILED.format(ex)):
@@ -46,14 +68,14 @@ def create_group(group_name):
 
 def invite_to_group(group_id, user_id):
     """ Invites a user to a private channel."""
-    url = "https://slack.com/api/groups.invite"
+    method = "groups.invite"
     headers = set_headers()
     payload = {
         "channel": group_id,
         "user": user_id
     }
     try:
-        r = requests.post(url, json = payload, headers = headers)
+        r = slackclient.call(method, payload, headers)
     except Exception as ex:
         logger.error(messages.SLACK_POST_FAILED.format(ex))
         if not logger_error(messages.SLACK_POST_FAILED.format(ex)):
@@ -69,14 +91,14 @@ def post_transaction_received_message(channel_id, amount, origin_user):
 
 def remove_from_group(group_id, user_id):
     """ Removes a user from a private channel."""
-    url = "https://slack.com/api/groups.kick"
+    method = "groups.kick"
     headers = set_headers()
     payload = {
         "channel": group_id,
         "user": user_id
     }
     try:
-        r = requests.post(url, json = payload, headers = headers)
+        r = slackclient.call(method, payload, headers)
     except Exception as ex:
         logger.error(messages.SLACK_POST_FAILED.format(ex))
         if not logger_error(messages.SLACK_POST_FAILED.format(ex)):
@@ -88,7 +110,7 @@ def remove_from_group(group_id, user_id):
 
 def post_message(channel_id, message):
     """Post a message on a channel."""
-    url = "https://slack.com/api/chat.postMessage"
+    method = "chat.postMessage"
     headers = set_headers()
     payload = {
         "channel": channel_id,
@@ -98,7 +120,7 @@ def post_message(channel_id, message):
         "text": message
     }
     try:
-        r = requests.post(url, json = payload, headers = headers)
+        r = slackclient.call(method, payload, headers)
     except Exception as ex:
         logger.error(messages.SLACK_POST_FAILED.format(ex))
         if not logger_error(messages.SLACK_POST_FAILED.format(ex)):
@@ -108,11 +130,27 @@ def post_message(channel_id, message):
         req_response = r.json()
         return r.status_code == 200 and req_response["ok"] == True
 
+def fan_out(post_function, channel_ids, *args):
+    """Calls post_function(channel_id, *args) for every channel, a few channels at a time.
+    Every channel is attempted, missing (None) channels fail without a call.
+    Returns [channel_id, success] lists, in the order of channel_ids."""
+    results = [[channel_id, False] for channel_id in channel_ids]
+    indexes = [idx for idx, channel_id in enumerate(channel_ids) if channel_id is not None]
+    if not indexes:
+        return results
+    max_workers = min(definitions.SLACK_FAN_OUT_MAX_WORKERS, len(indexes))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="SlackFanOutThread") as executor:
+        futures = {executor.submit(tracing.bind(post_function), channel_ids[idx], *args): idx for idx in indexes}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]][1] = bool(future.result())
+            except Exception as ex:
+                logger.error(messages.SLACK_POST_FAILED.format(ex))
+    return results
+
 def post_hackerboy_action_general(team_channel_ids, amount_changed, hacker_message):
-    ret_val = True
-    for channel_id in team_channel_ids:
-        ret_val = ret_val and post_hackerboy_action_team(channel_id, amount_changed, hacker_message)
-    return ret_val
+    """ Posts the balance change message on every team channel. Returns [channel_id, success] lists, see fan_out."""
+    return fan_out(post_hackerboy_action_team, team_channel_ids, amount_changed, hacker_message)
 
 def post_hackerboy_action_team(team_channel_id, amount_changed, hacker_message):
     """ Posts a message on a team channel reporting a balance change."""
@@ -140,15 +178,85 @@ def logger_critical(message):
     """ Logs a CRITICAL level message into a Slack channel."""
     return post_log("CRITICAL", message)
 
+def get_log_level_threshold():
+    """Gets the minimum level of the logs shipped to Slack, from the environment."""
+    level = os.getenv("SLACK_LOG_LEVEL") or definitions.SLACK_LOG_DEFAULT_LEVEL
+    return LOG_LEVELS.get(level.upper(), LOG_LEVELS[definitions.SLACK_LOG_DEFAULT_LEVEL])
+
 def post_log(level, message):
-    """Posts a message on a log channel."""
-    url = "https://slack.com/api/chat.postMessage"
-    logger.debug(messages.SLACK_POSTING_LOG)
-    headers = set_headers()
+    """Queues a message to be posted on the log channel by the log shipper thread."""
+    if LOG_LEVELS[level] < get_log_level_threshold():
+        return True
 
     # Format example: [21-10-2018 19:00:45] [INFO] : Message
     slack_message = "[_{}_] [*{}*] : {}".format(datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S"), level, message)
 
+    with log_buffer_condition:
+        if len(log_buffer) == log_buffer.maxlen:
+            log_shipper_state["dropped_lines"] += 1
+        log_buffer.append(slack_message)
+        if log_shipper_state["thread"] is None:
+            start_log_shipper()
+    return True
+
+def start_log_shipper():
+    """Starts the log shipper thread. Must be called holding log_buffer_condition."""
+    log_shipper_state["stopping"] = False
+    t = threading.Thread(target=log_shipper, name="SlackLogShipperThread")
+    t.setDaemon(True)
+    t.start()
+    log_shipper_state["thread"] = t
+
+def stop_log_shipper():
+    """Ships the buffered logs and stops the log shipper thread."""
+    with log_buffer_condition:
+        t = log_shipper_state["thread"]
+        log_shipper_state["stopping"] = True
+        log_buffer_condition.notify()
+    if t is not None:
+        t.join(definitions.SLACK_LOG_FLUSH_INTERVAL_SECONDS + definitions.HTTP_CONNECT_TIMEOUT_SECONDS + definitions.HTTP_READ_TIMEOUT_SECONDS)
+    with log_buffer_condition:
+        log_shipper_state["thread"] = None
+
+def log_shipper():
+    """Log shipper loop. Every flush interval, merges the buffered lines into as few messages as possible."""
+    while True:
+        with log_buffer_condition:
+            if not log_shipper_state["stopping"]:
+                log_buffer_condition.wait(definitions.SLACK_LOG_FLUSH_INTERVAL_SECONDS)
+            stopping = log_shipper_state["stopping"]
+
+        slack_message = get_log_batch()
+        while slack_message:
+            send_log_message(slack_message)
+            slack_message = get_log_batch()
+
+        if stopping:
+            return
+
+def get_log_batch():
+    """Takes buffered lines, up to the Slack message size, and joins them in one message."""
+    with log_buffer_condition:
+        lines = []
+        if log_shipper_state["dropped_lines"]:
+            lines.append(messages.SLACK_LOG_LINES_DROPPED.format(log_shipper_state["dropped_lines"]))
+            log_shipper_state["dropped_lines"] = 0
+        length = sum(len(line) + 1 for line in lines)
+        while log_buffer:
+            line = log_buffer[0][:definitions.SLACK_LOG_MESSAGE_MAX_LENGTH]
+            if lines and length + len(line) + 1 > definitions.SLACK_LOG_MESSAGE_MAX_LENGTH:
+                break
+            log_buffer.popleft()
+            lines.append(line)
+            length += len(line) + 1
+    return "\n".join(lines)
+
+def send_log_message(slack_message):
+    """Posts a message on a log channel."""
+    method = "chat.postMessage"
+    logger.debug(messages.SLACK_POSTING_LOG)
+    headers = set_headers()
+
     payload = {
         "channel": os.getenv("SLACK_LOGS_CHANNEL_ID"),
         "as_user": False,
@@ -157,7 +265,7 @@ def post_log(level, message):
         "text": slack_message
     }
     try:
-        r = requests.post(url, json = payload, headers = headers)
+        r = slackclient.call(method, payload, headers)
     except Exception as ex:
         logger.warn(messages.SLACK_POST_LOG_ERROR.format(ex))
     else:
@@ -166,3 +274,20 @@ def post_log(level, message):
             return True
         else:
             logger.warn(messages.SLACK_POST_LOG_REQUEST_RESPONSE.format(req_response))
+    return False
+
+# Time every Slack call made for a request. Logging goes through the log shipper thread and is left out
+tracing.instrument_functions(globals(), exclude = (
+    "set_headers",
+    "logger_info",
+    "logger_warning",
+    "logger_error",
+    "logger_critical",
+    "get_log_level_threshold",
+    "post_log",
+    "start_log_shipper",
+    "stop_log_shipper",
+    "log_shipper",
+    "get_log_batch",
+    "send_log_message",
+))
@@ -0,0 +1,160 @@
+import logging as logger
+import common
+import definitions
+import httpclient
+import metrics
+import os
+import random
+import threading
+import time
+import log_messages as messages
+
+
+common.setup_logger()
+
+class TokenBucket:
+    """Thread-safe token bucket. Callers reserve a token and sleep for the returned time,
+    so concurrent callers are served in the order they reserved."""
+
+    def __init__(self, rate_per_second, capacity):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Takes a token, returning how many seconds to wait before using it."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def block(self, seconds):
+        """Makes every reservation wait at least the given seconds, eg: after a 429 response."""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+method_buckets = {}
+channel_buckets = {}
+buckets_lock = threading.Lock()
+
+rate_limit_metrics = {}
+rate_limit_metrics_lock = threading.Lock()
+
+# Includes the time waiting for rate limits and retries. Delayed responses are labelled response_url
+call_latency = metrics.histogram("slack_api_call_seconds", "Duration of Slack API calls, by method.", ["method"])
+
+def get_method_bucket(method):
+    """Returns the bucket of a method tier, or None for methods not limited by tier."""
+    tier = definitions.SLACK_API_METHOD_TIERS.get(method)
+    if tier is None:
+        return None
+    with buckets_lock:
+        if tier not in method_buckets:
+            per_minute = definitions.SLACK_API_TIER_LIMITS_PER_MINUTE[tier]
+            method_buckets[tier] = TokenBucket(per_minute / 60.0, per_minute)
+        return method_buckets[tier]
+
+def get_channel_bucket(channel_id):
+    """Returns the message bucket of a channel."""
+    with buckets_lock:
+        if channel_id not in channel_buckets:
+            channel_buckets[channel_id] = TokenBucket(
+                definitions.SLACK_API_CHANNEL_MESSAGES_PER_SECOND,
+                definitions.SLACK_API_CHANNEL_BURST
+            )
+        return channel_buckets[channel_id]
+
+def get_buckets(method, payload):
+    """Returns the buckets a call to a method must take a token from."""
+    buckets = []
+    method_bucket = get_method_bucket(method)
+    if method_bucket is not None:
+        buckets.append(method_bucket)
+    if method == "chat.postMessage" and payload and payload.get("channel"):
+        buckets.append(get_channel_bucket(payload["channel"]))
+    return buckets
+
+def get_retry_after(response):
+    """Reads the Retry-After header of a 429 response, in seconds."""
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return definitions.SLACK_API_DEFAULT_RETRY_AFTER_SECONDS
+
+def record_metrics(method, waited = 0.0, rate_limited = 0, retries = 0):
+    with rate_limit_metrics_lock:
+        method_metrics = rate_limit_metrics.setdefault(method, {
+            "calls": 0,
+            "rate_limited": 0,
+            "retries": 0,
+            "wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+        })
+        method_metrics["calls"] += 1
+        method_metrics["rate_limited"] += rate_limited
+        method_metrics["retries"] += retries
+        method_metrics["wait_seconds"] += waited
+        method_metrics["max_wait_seconds"] = max(method_metrics["max_wait_seconds"], waited)
+
+def get_metrics():
+    """Returns, by method, the calls made, 429 responses, retries and the time spent waiting on rate limits."""
+    with rate_limit_metrics_lock:
+        return {method: dict(method_metrics) for method, method_metrics in rate_limit_metrics.items()}
+
+def get_api_base_url():
+    """Gets the Slack Web API base URL. SLACK_API_BASE_URL environment variable overrides it, eg: with a fake Slack server."""
+    return os.getenv("SLACK_API_BASE_URL") or definitions.SLACK_API_BASE_URL
+
+def call(method, payload, headers):
+    """Calls a Slack Web API method, waiting for the local rate limits first.
+    On a 429 response, waits Retry-After plus jitter and retries, up to SLACK_API_MAX_RETRIES times.
+    Returns the last response. Raises the same exceptions as httpclient.post."""
+    url = get_api_base_url() + method
+    started = time.monotonic()
+    buckets = get_buckets(method, payload)
+    waited = 0.0
+    rate_limited = 0
+    attempt = 0
+    try:
+        while True:
+            wait = max([bucket.reserve() for bucket in buckets] or [0.0])
+            if wait > 0:
+                time.sleep(wait)
+                waited += wait
+
+            r = httpclient.post(url, json = payload, headers = headers)
+            if r.status_code != 429:
+                return r
+
+            rate_limited += 1
+            retry_after = get_retry_after(r)
+            for bucket in buckets:
+                bucket.block(retry_after)
+            if attempt >= definitions.SLACK_API_MAX_RETRIES:
+                logger.warn(messages.SLACK_API_RETRIES_EXHAUSTED.format(method, attempt))
+                return r
+
+            attempt += 1
+            wait = retry_after + random.uniform(0, definitions.SLACK_API_RETRY_JITTER_SECONDS)
+            logger.warn(messages.SLACK_API_RATE_LIMITED.format(method, wait, attempt, definitions.SLACK_API_MAX_RETRIES))
+            time.sleep(wait)
+            waited += wait
+    finally:
+        if waited > 0:
+            logger.debug(messages.SLACK_API_WAITED.format(waited, method))
+        record_metrics(method, waited, rate_limited, attempt)
+        call_latency.observe(time.monotonic() - started, (method,))
+
+def get_metrics_counter(key):
+    """Reads one counter of the rate limit metrics of every method, for the metrics endpoint."""
+    return {(method,): method_metrics[key] for method, method_metrics in get_metrics().items()}
+
+metrics.function_metric("slack_api_rate_limited_total", "429 responses from Slack, by method.", "counter", ["method"], lambda: get_metrics_counter("rate_limited"))
+metrics.function_metric("slack_api_rate_limit_wait_seconds_total", "Time waiting for Slack rate limits, by method.", "counter", ["method"], lambda: get_metrics_counter("wait_seconds"))
@@ -0,0 +1,46 @@
+import threading
+
+
+# Balance of each team, as [balance, version], written through by every balance update.
+# The version is teams.balance_version, incremented by every balance update on the database, so
+# updates applied here out of order, or a reconcile read before an update, never replace a newer balance.
+balances_by_team = {}
+team_balances_lock = threading.Lock()
+
+def update(team_id, balance, version):
+    """Stores the balance of a team, as returned by the database update, unless a newer one is cached."""
+    if team_id is None or balance is None or version is None:
+        return
+    with team_balances_lock:
+        key = str(team_id)
+        cached = balances_by_team.get(key)
+        if cached is None or cached[1] <= version:
+            balances_by_team[key] = [balance, version]
+
+def get(team_id):
+    """Gets the cached balance of a team, or None when it isn't cached."""
+    with team_balances_lock:
+        cached = balances_by_team.get(str(team_id))
+        return cached[0] if cached is not None else None
+
+def reconcile(team_balances):
+    """Replaces the cache with [team_id, balance, version] lists read from the database.
+    Teams with a newer cached version keep their cached balance.
+    Returns the teams whose cached balance differed from the database one at the same version."""
+    drifted = []
+    with team_balances_lock:
+        database_teams = set()
+        for [team_id, balance, version] in team_balances:
+            key = str(team_id)
+            database_teams.add(key)
+            cached = balances_by_team.get(key)
+            if cached is not None:
+                if cached[1] > version:
+                    continue
+                if cached[1] == version and cached[0] != balance:
+                    drifted.append(key)
+            balances_by_team[key] = [balance, version]
+        for key in list(balances_by_team):
+            if key not in database_teams:
+                del balances_by_team[key]
+    return drifted
@@ -0,0 +1,218 @@
+import common
+import definitions
+import functools
+import inspect
+import json
+import logging as logger
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+import log_messages as messages
+
+
+common.setup_logger()
+
+class Span:
+    """Timed stage of a trace. Times are time.monotonic() values."""
+
+    def __init__(self, trace, span_id, parent_id, name, started):
+        self.trace = trace
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.started = started
+        self.finished = None
+        self.error = None
+
+    def to_dict(self):
+        finished = self.finished if self.finished is not None else time.monotonic()
+        return {
+            "id": self.span_id,
+            "parent": self.parent_id,
+            "name": self.name,
+            "start_ms": round((self.started - self.trace.started) * 1000, 3),
+            "duration_ms": round((finished - self.started) * 1000, 3),
+            "error": self.error,
+        }
+
+
+class Trace:
+    """Spans of one request, from the HTTP handler to the last Slack call of its dispatcher.
+    Spans are added by the handler and dispatcher threads, so they are guarded by a lock."""
+
+    def __init__(self, trace_id, name):
+        self.trace_id = trace_id
+        self.name = name
+        self.started_at = datetime.now()
+        self.started = time.monotonic()
+        self.spans = []
+        self.lock = threading.Lock()
+        self.root = self.add_span(None, name, self.started)
+
+    def add_span(self, parent, name, started):
+        with self.lock:
+            span = Span(self, len(self.spans), parent.span_id if parent is not None else None, name, started)
+            self.spans.append(span)
+            return span
+
+    def to_dict(self):
+        with self.lock:
+            spans = [span.to_dict() for span in self.spans]
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": spans[0]["duration_ms"],
+            "spans": spans,
+        }
+
+
+# Traces started by the HTTP handler and not yet finished, by trace id
+active_traces = {}
+active_traces_lock = threading.Lock()
+# Last finished traces, oldest first
+finished_traces = deque(maxlen=definitions.TRACE_BUFFER_SIZE)
+finished_traces_lock = threading.Lock()
+trace_file_lock = threading.Lock()
+# Stack of the open spans of the current thread, innermost last
+thread_data = threading.local()
+
+def get_span_stack():
+    stack = getattr(thread_data, "spans", None)
+    if stack is None:
+        stack = thread_data.spans = []
+    return stack
+
+def get_current_span():
+    """Gets the innermost open span of the current thread, or None when not tracing."""
+    stack = get_span_stack()
+    return stack[-1] if stack else None
+
+def start_trace(trace_id, name):
+    """Starts a trace, making its root span current on this thread."""
+    trace = Trace(trace_id, name)
+    with active_traces_lock:
+        active_traces[trace_id] = trace
+    get_span_stack().append(trace.root)
+    return trace
+
+def detach():
+    """Stops tracing on this thread, leaving the trace open to be resumed by the dispatcher."""
+    del get_span_stack()[:]
+
+def resume(trace_id, name, queued_at):
+    """Resumes a trace on this thread, under a span named name.
+    The time between queued_at and now is recorded as a queue span. Returns the span, or None for unknown traces."""
+    with active_traces_lock:
+        trace = active_traces.get(trace_id)
+    if trace is None:
+        return None
+    now = time.monotonic()
+    queue_span = trace.add_span(trace.root, "queue", queued_at)
+    queue_span.finished = now
+    span = trace.add_span(trace.root, name, now)
+    get_span_stack().append(span)
+    return span
+
+def finish_trace(trace_id):
+    """Finishes a trace: closes its root span, stops tracing on this thread,
+    keeps it on the ring buffer, writes it to the trace file and dumps it when slow."""
+    detach()
+    with active_traces_lock:
+        trace = active_traces.pop(trace_id, None)
+    if trace is None:
+        return
+    finished = time.monotonic()
+    with trace.lock:
+        for span in trace.spans:
+            if span.finished is None:
+                span.finished = finished
+    trace_dict = trace.to_dict()
+    with finished_traces_lock:
+        finished_traces.append(trace_dict)
+    write_trace(trace_dict)
+    if finished - trace.started > definitions.TRACE_SLOW_THRESHOLD_SECONDS:
+        logger.warn(messages.TRACE_SLOW.format(trace.name, trace_dict["duration_ms"], trace.trace_id, format_span_tree(trace_dict)))
+
+def get_traces():
+    """Gets the last finished traces, oldest first."""
+    with finished_traces_lock:
+        return list(finished_traces)
+
+def get_trace_file():
+    """Gets the path of the traces JSON-lines file."""
+    path = os.getenv("TRACE_FILE") or definitions.TRACE_FILE
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+
+def write_trace(trace_dict):
+    """Appends a finished trace to the traces file."""
+    trace_file = get_trace_file()
+    try:
+        with trace_file_lock:
+            with open(trace_file, "a") as f:
+                f.write(json.dumps(trace_dict) + "\n")
+    except OSError as ex:
+        logger.warn(messages.TRACE_WRITE_FAILED.format(ex))
+
+def format_span_tree(trace_dict):
+    """Formats the spans of a trace as an indented tree, one span per line."""
+    children = {}
+    for span in trace_dict["spans"]:
+        children.setdefault(span["parent"], []).append(span)
+    lines = []
+    def add_lines(span, depth):
+        lines.append("{}{} +{:.1f}ms {:.1f}ms{}".format(
+            "  " * depth, span["name"], span["start_ms"], span["duration_ms"],
+            " error: {}".format(span["error"]) if span["error"] else ""
+        ))
+        for child in sorted(children.get(span["id"], []), key=lambda s: s["start_ms"]):
+            add_lines(child, depth + 1)
+    for root in children.get(None, []):
+        add_lines(root, 0)
+    return "\n".join(lines)
+
+def traced(function, name):
+    """Wraps a function to run in a child span of the current one. Untraced threads just call it."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        parent = get_current_span()
+        if parent is None:
+            return function(*args, **kwargs)
+        span = parent.trace.add_span(parent, name, time.monotonic())
+        stack = get_span_stack()
+        stack.append(span)
+        try:
+            return function(*args, **kwargs)
+        except Exception as ex:
+            span.error = type(ex).__name__
+            raise
+        finally:
+            span.finished = time.monotonic()
+            stack.pop()
+    return wrapper
+
+def bind(function):
+    """Wraps a function to run under the current span when called from another thread, eg: a thread pool."""
+    parent = get_current_span()
+    if parent is None:
+        return function
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        stack = get_span_stack()
+        stack.append(parent)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stack.pop()
+    return wrapper
+
+def instrument_functions(namespace, exclude = ()):
+    """Replaces every function defined in a module namespace (its globals()) by a wrapper
+    timing it in a span named module.function. See metrics.instrument_functions."""
+    module = namespace["__name__"]
+    for name, function in list(namespace.items()):
+        if name in exclude or not inspect.isfunction(function) or function.__module__ != module:
+            continue
+        namespace[name] = traced(function, "{}.{}".format(module, name))